@@ -0,0 +1,62 @@
+"""
+Micro-benchmark of the comment moderation filter.
+
+Compares the Aho–Corasick automaton with a naive scan that looks for every term in the text,
+for blocklists of growing size. The scan time of the automaton should stay flat.
+
+Usage:
+    python -m bench.bench_moderation --sizes 10 1000 100000 --scans 2000
+"""
+import argparse
+import random
+import string
+import time
+
+from src.services.moderation import AhoCorasick, normalize_text
+
+
+def random_terms(count: int, rng: random.Random) -> list[str]:
+    return ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 12))) for _ in range(count)]
+
+
+def random_comment(rng: random.Random, words: int = 30) -> str:
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(words))
+
+
+def naive_find(terms: list[str], text: str) -> list[str]:
+    text = normalize_text(text)
+    return [term for term in terms if term in text]
+
+
+def measure(function, texts: list[str]) -> float:
+    start = time.perf_counter()
+    for text in texts:
+        function(text)
+    return (time.perf_counter() - start) / len(texts) * 1_000_000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1_000, 100_000])
+    parser.add_argument("--scans", type=int, default=2_000)
+    parser.add_argument("--naive-limit", type=int, default=10_000, help="skip the naive scan above this size")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    texts = [random_comment(rng) for _ in range(args.scans)]
+
+    print(f"{'terms':>10} {'build, ms':>10} {'automaton, us/scan':>20} {'naive, us/scan':>16}")
+    for size in args.sizes:
+        terms = random_terms(size, rng)
+        start = time.perf_counter()
+        automaton = AhoCorasick(terms)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        automaton_us = measure(automaton.find, texts)
+        naive = f"{measure(lambda text: naive_find(automaton.terms, text), texts):16.1f}" if size <= args.naive_limit else f"{'-':>16}"
+        print(f"{size:>10} {build_ms:>10.1f} {automaton_us:>20.1f} {naive}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark of the related-tags co-occurrence counts and the MinHash/LSH similar picture index.
+
+Generates a synthetic dataset of pictures with 1 to 5 tags drawn from a Zipf-like distribution,
+builds both structures in memory the same way the database tables are filled on upload,
+and compares the query time with a full scan of all pictures.
+
+Usage:
+    python -m bench.bench_similarity --pictures 1000000 --tags 50000 --queries 200
+"""
+import argparse
+import heapq
+import itertools
+import random
+import time
+from collections import Counter, defaultdict
+
+from src.services.minhash import MinHasher, jaccard
+
+
+def synthetic_pictures(count: int, tags: int, rng: random.Random) -> list[list[int]]:
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, tags + 1)))
+    return [list(set(rng.choices(range(1, tags + 1), cum_weights=weights, k=rng.randint(1, 5)))) for _ in range(count)]
+
+
+def build_cooccurrence(pictures: list[list[int]]) -> dict[int, Counter]:
+    cooccurrence = defaultdict(Counter)
+    for tag_ids in pictures:
+        for tag_id, related_tag_id in itertools.permutations(tag_ids, 2):
+            cooccurrence[tag_id][related_tag_id] += 1
+    return cooccurrence
+
+
+def build_buckets(pictures: list[list[int]], minhasher: MinHasher) -> tuple[list[list[int]], dict]:
+    signatures = []
+    buckets = defaultdict(list)
+    for picture_id, tag_ids in enumerate(pictures):
+        picture_buckets = minhasher.buckets(tag_ids)
+        signatures.append(picture_buckets)
+        for band, bucket in enumerate(picture_buckets):
+            buckets[band, bucket].append(picture_id)
+    return signatures, buckets
+
+
+def similar_lsh(picture_id: int, pictures, signatures, buckets, limit: int) -> list[int]:
+    shared = Counter()
+    for band, bucket in enumerate(signatures[picture_id]):
+        shared.update(buckets[band, bucket])
+    del shared[picture_id]
+    candidates = [candidate for candidate, _ in shared.most_common(limit * 3)]
+    return heapq.nlargest(limit, candidates, key=lambda candidate: jaccard(pictures[picture_id], pictures[candidate]))
+
+
+def similar_scan(picture_id: int, pictures, limit: int) -> list[int]:
+    others = (candidate for candidate in range(len(pictures)) if candidate != picture_id)
+    return heapq.nlargest(limit, others, key=lambda candidate: jaccard(pictures[picture_id], pictures[candidate]))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pictures", type=int, default=1_000_000)
+    parser.add_argument("--tags", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--scan-queries", type=int, default=5, help="queries answered by a full scan for comparison")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    minhasher = MinHasher()
+    pictures, seconds = timed(synthetic_pictures, args.pictures, args.tags, rng)
+    print(f"dataset: {args.pictures} pictures, {args.tags} tags, generated in {seconds:.1f} s")
+
+    cooccurrence, seconds = timed(build_cooccurrence, pictures)
+    pairs = sum(len(related) for related in cooccurrence.values())
+    print(f"co-occurrence build: {seconds:.1f} s, {pairs} pairs, {seconds / args.pictures * 1e6:.1f} us/picture")
+
+    (signatures, buckets), seconds = timed(build_buckets, pictures, minhasher)
+    print(f"LSH build: {seconds:.1f} s, {len(buckets)} buckets, {seconds / args.pictures * 1e6:.1f} us/picture")
+
+    queries = [rng.randrange(args.pictures) for _ in range(args.queries)]
+    top_tags = [tag_id for tag_id, _ in Counter(itertools.chain.from_iterable(pictures)).most_common(args.queries)]
+    ranked = {tag_id: [related for related, _ in cooccurrence[tag_id].most_common()] for tag_id in top_tags}
+
+    _, seconds = timed(lambda: [ranked[tag_id][:args.limit] for tag_id in top_tags])
+    print(f"related tags, presorted (index range): {seconds / len(top_tags) * 1e6:.1f} us/query")
+    _, seconds = timed(lambda: [cooccurrence[tag_id].most_common(args.limit) for tag_id in top_tags])
+    print(f"related tags, top-k of the counts:     {seconds / len(top_tags) * 1e6:.1f} us/query")
+
+    _, seconds = timed(lambda: [similar_lsh(query, pictures, signatures, buckets, args.limit) for query in queries])
+    print(f"similar pictures, LSH:       {seconds / len(queries) * 1000:.2f} ms/query")
+    scan_queries = queries[:args.scan_queries]
+    if scan_queries:
+        _, seconds = timed(lambda: [similar_scan(query, pictures, args.limit) for query in scan_queries])
+        print(f"similar pictures, full scan: {seconds / len(scan_queries) * 1000:.2f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
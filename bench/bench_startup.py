@@ -0,0 +1,77 @@
+"""
+Startup benchmark of the API.
+
+Imports the application in fresh interpreters with `python -X importtime` and breaks the import time down
+by top-level package, taking the median of the runs. The run fails when the import takes longer than
+--max-ms or when one of the dependencies that must be imported on first use is loaded at startup,
+so it can guard worker boot time in CI.
+
+Usage:
+    python -m bench.bench_startup --runs 5 --top 15 --max-ms 1500
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+# Dependencies that only some requests use: they are imported by the code that needs them.
+LAZY_MODULES = ("cloudinary", "qrcode", "PIL", "requests", "fastapi_mail", "libgravatar", "passlib", "opentelemetry")
+
+
+def import_times(module: str) -> dict[str, tuple[int, int]]:
+    """
+    Imports the module in a new interpreter and returns the self and cumulative import time
+    in microseconds of every module it loaded.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{result.stderr}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="number of packages shown")
+    parser.add_argument("--max-ms", type=float, default=None, help="fail above this median import time")
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    total_ms = statistics.median(run[args.module][1] for run in runs) / 1000
+
+    by_package = defaultdict(list)
+    for run in runs:
+        packages = defaultdict(int)
+        for name, (self_us, _) in run.items():
+            packages[name.split(".")[0]] += self_us
+        for package, self_us in packages.items():
+            by_package[package].append(self_us)
+    medians = {package: statistics.median(times + [0] * (args.runs - len(times))) / 1000 for package, times in by_package.items()}
+
+    print(f"{'package':<30} {'self, ms':>10} {'share':>7}")
+    for package, ms in sorted(medians.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"{package:<30} {ms:>10.1f} {ms / total_ms:>7.1%}")
+    print(f"{'import ' + args.module:<30} {total_ms:>10.1f}")
+
+    failures = []
+    loaded = sorted({module for run in runs for module in run if module in LAZY_MODULES})
+    if loaded:
+        failures.append(f"imported at startup: {', '.join(loaded)}")
+    if args.max_ms is not None and total_ms > args.max_ms:
+        failures.append(f"import took {total_ms:.1f} ms, over the {args.max_ms:.1f} ms threshold")
+    if failures:
+        raise SystemExit("FAILED: " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+"""
+End-to-end load tests of the API.
+
+The harness seeds a database with users, tags, pictures, comments and ratings, starts the app with a local fake
+of Cloudinary and an SMTP sink in place of the mail server, and drives weighted scenarios of real workflows
+with concurrent virtual users. It reports the throughput, the error rate and the latency percentiles per route,
+saves them as JSON, and compares two saved runs to catch regressions.
+
+Usage:
+    # SQLite and fakeredis, app in the process of the driver
+    python -m bench.load --database-url sqlite+aiosqlite:///bench.sqlite seed --users 200 --pictures-per-user 10
+    python -m bench.load --database-url sqlite+aiosqlite:///bench.sqlite run --redis fake --duration 30 --output base.json
+
+    # local Postgres and Redis, app served by 4 uvicorn workers in another process
+    python -m bench.load seed --reset
+    python -m bench.load serve --workers 4 &
+    python -m bench.load run --url http://127.0.0.1:8000 --concurrency 100 --duration 60 --output new.json
+
+    python -m bench.load compare base.json new.json --threshold 0.1
+"""
@@ -0,0 +1,203 @@
+"""
+Command line of the load tests, see bench.load for the usage.
+The --database-url option is read before anything of the app is imported, since the engine is built on import.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+
+def seed_command(args) -> None:
+    from bench.load.seed import Volumes, seed
+    from src.database.db import sessionmanager
+
+    async def main() -> dict:
+        try:
+            return await seed(
+                Volumes(args.users, args.tags, args.pictures_per_user, args.tags_per_picture,
+                        args.comments_per_picture, args.ratings_per_picture),
+                reset=args.reset, seed=args.seed,
+            )
+        finally:
+            await sessionmanager.close()
+
+    start = time.perf_counter()
+    counts = asyncio.run(main())
+    print(", ".join(f"{count} {table}" for table, count in counts.items()), f"seeded in {time.perf_counter() - start:.1f} s")
+
+
+async def run_against_url(args, weights: dict) -> dict:
+    import httpx
+
+    from bench.load.scenarios import drive
+    from bench.load.seed import load_catalog
+    from src.database.db import sessionmanager
+
+    catalog = await load_catalog()
+    await sessionmanager.close()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        recorder = await drive(client, catalog, weights, args.concurrency, args.duration, args.think_ms / 1000,
+                               args.upload_bytes, args.seed)
+    return recorder.summary(config_of(args, weights))
+
+
+async def run_in_process(args, weights: dict) -> dict:
+    """
+    Drives the app in the process of the driver through an ASGI transport: no network and no worker processes,
+    so the numbers show the cost of the app itself. Background tasks, like the confirmation emails, run before
+    the response is returned, within the latency of the request. An exception of the app is a 500 response,
+    as it would be behind a server, instead of an exception raised in the virtual user.
+    """
+    import httpx
+
+    from bench.load.fakes import FakeStorage, SmtpSink, install_fake_redis
+    from bench.load.scenarios import drive
+    from bench.load.seed import load_catalog
+
+    if args.redis == "fake":
+        install_fake_redis()
+    sink = SmtpSink()
+    await sink.start()
+    sink.install()
+    with tempfile.TemporaryDirectory(prefix="bench-storage-") as directory:
+        storage = FakeStorage(directory, args.storage_latency_ms)
+        storage.install()
+
+        from main import app
+
+        catalog = await load_catalog()
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+                recorder = await drive(client, catalog, weights, args.concurrency, args.duration, args.think_ms / 1000,
+                                       args.upload_bytes, args.seed)
+        print(f"{storage.uploads} pictures uploaded ({storage.uploaded_bytes / 1e6:.1f} MB) to the fake storage")
+    await sink.stop()
+    print(f"{sink.messages} emails received by the SMTP sink")
+    return recorder.summary(config_of(args, weights))
+
+
+def config_of(args, weights: dict) -> dict:
+    return {
+        "mode": "url" if args.url else "in-process",
+        "url": args.url,
+        "redis": args.redis,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "think_ms": args.think_ms,
+        "weights": weights,
+        "seed": args.seed,
+    }
+
+
+def run_command(args) -> None:
+    from bench.load import report
+    from bench.load.scenarios import parse_weights
+
+    weights = parse_weights(args.weights)
+    summary = asyncio.run(run_against_url(args, weights) if args.url else run_in_process(args, weights))
+    report.print_summary(summary)
+    if args.output:
+        report.save(summary, args.output)
+        print(f"Saved to {args.output}")
+
+
+def serve_command(args) -> None:
+    """
+    Serves the app with uvicorn workers that use the fake storage and the SMTP sink of this process,
+    and optionally fakeredis, while the database and Redis are the configured ones.
+    """
+    import uvicorn
+
+    from bench.load import fakes
+    from src.cli import prepare_metrics_dir
+    from src.conf.config import settings
+
+    if args.redis == "fake" and args.workers > 1:
+        sys.exit("--redis fake only fits one worker: each worker would get its own fake")
+    directory = args.storage_dir or tempfile.mkdtemp(prefix="bench-storage-")
+    sink = fakes.SmtpSink()
+    os.environ[fakes.STORAGE_DIR_ENV] = directory
+    os.environ[fakes.STORAGE_LATENCY_ENV] = str(args.storage_latency_ms)
+    os.environ[fakes.SMTP_PORT_ENV] = str(sink.start_in_thread())
+    if args.redis == "fake":
+        os.environ[fakes.FAKE_REDIS_ENV] = "1"
+    if args.workers > 1 and settings.metrics_enabled:
+        print(f"Sharing metrics through {prepare_metrics_dir()}")
+    print(f"Fake storage in {directory}, SMTP sink on port {sink.port}")
+    uvicorn.run("bench.load.app:app", host=args.host, port=args.port, workers=args.workers, lifespan="on")
+    print(f"{sink.messages} emails received by the SMTP sink")
+
+
+def compare_command(args) -> None:
+    from bench.load import report
+
+    regressions = report.compare(report.load(args.base), report.load(args.new), args.threshold, args.min_count)
+    if regressions:
+        print(f"\n{len(regressions)} regressions above {args.threshold:.0%}:")
+        print("\n".join(f"  {regression}" for regression in regressions))
+        sys.exit(1)
+    print(f"\nNo regression above {args.threshold:.0%}")
+
+
+def main() -> None:
+    import bench.load
+
+    parser = argparse.ArgumentParser(prog="python -m bench.load", description=bench.load.__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="SQLAlchemy url of the database, in place of the POSTGRES_* settings")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="insert the seeded users, tags, pictures, comments and ratings")
+    seed_parser.add_argument("--users", type=int, default=100)
+    seed_parser.add_argument("--tags", type=int, default=200)
+    seed_parser.add_argument("--pictures-per-user", type=int, default=10)
+    seed_parser.add_argument("--tags-per-picture", type=int, default=3)
+    seed_parser.add_argument("--comments-per-picture", type=int, default=5)
+    seed_parser.add_argument("--ratings-per-picture", type=int, default=3)
+    seed_parser.add_argument("--reset", action="store_true", help="drop and recreate all tables first")
+    seed_parser.add_argument("--seed", type=int, default=42)
+    seed_parser.set_defaults(handler=seed_command)
+
+    run_parser = commands.add_parser("run", help="drive the scenarios and report the latencies per route")
+    run_parser.add_argument("--url", help="url of a running app; by default the app runs in this process")
+    run_parser.add_argument("--redis", choices=("real", "fake"), default="real", help="Redis of the in-process app")
+    run_parser.add_argument("--concurrency", type=int, default=20, help="number of virtual users")
+    run_parser.add_argument("--duration", type=float, default=30, help="seconds")
+    run_parser.add_argument("--think-ms", type=float, default=0, help="mean pause of a user between two steps")
+    run_parser.add_argument("--weights", help="weights of the scenarios, e.g. browse=50,signup=0")
+    run_parser.add_argument("--storage-latency-ms", type=float, default=0, help="latency of the fake storage")
+    run_parser.add_argument("--upload-bytes", type=int, default=20_000)
+    run_parser.add_argument("--timeout", type=float, default=30, help="seconds per request")
+    run_parser.add_argument("--output", help="save the summary to this JSON file")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.set_defaults(handler=run_command)
+
+    serve_parser = commands.add_parser("serve", help="serve the app with the fakes for `run --url`")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--workers", type=int, default=1)
+    serve_parser.add_argument("--redis", choices=("real", "fake"), default="real")
+    serve_parser.add_argument("--storage-dir", help="directory of the fake storage; a new temporary one by default")
+    serve_parser.add_argument("--storage-latency-ms", type=float, default=0)
+    serve_parser.set_defaults(handler=serve_command)
+
+    compare_parser = commands.add_parser("compare", help="compare two saved runs, exit 1 on regressions")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="tolerated relative change")
+    compare_parser.add_argument("--min-count", type=int, default=20, help="requests needed to judge a route")
+    compare_parser.set_defaults(handler=compare_command)
+
+    args = parser.parse_args()
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
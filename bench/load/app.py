@@ -0,0 +1,10 @@
+"""
+The app with the fakes of bench.load.fakes installed, for the uvicorn workers started by `python -m bench.load serve`.
+"""
+from bench.load.fakes import install_from_env
+
+install_from_env()
+
+from main import app  # noqa: E402
+
+__all__ = ["app"]
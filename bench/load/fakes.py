@@ -0,0 +1,202 @@
+"""
+Local stand-ins of the external services the app talks to: Cloudinary, the mail server and, optionally, Redis.
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+from pathlib import Path
+
+STORAGE_DIR_ENV = "BENCH_STORAGE_DIR"
+STORAGE_LATENCY_ENV = "BENCH_STORAGE_LATENCY_MS"
+SMTP_PORT_ENV = "BENCH_SMTP_PORT"
+FAKE_REDIS_ENV = "BENCH_FAKE_REDIS"
+
+
+class FakeStorage:
+    """
+    Stores the uploaded pictures as files in a local directory and returns urls shaped like those of Cloudinary,
+    so that the code that parses them (CloudPicture.is_stored, public_id_from_url) keeps working.
+    The calls are blocking, like the Cloudinary SDK, and can be slowed down to the latency of the real API.
+    """
+
+    def __init__(self, directory: str, latency_ms: float = 0.0):
+        self.directory = Path(directory)
+        self.latency = latency_ms / 1000
+        self.uploads = 0
+        self.uploaded_bytes = 0
+
+    def wait(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def upload_picture(self, file, public_id: str, transformation: dict = {}) -> dict:
+        self.wait()
+        data = file.read()
+        path = self.directory / public_id
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        self.uploads += 1
+        self.uploaded_bytes += len(data)
+        return {"public_id": public_id, "version": 1, "bytes": len(data)}
+
+    @staticmethod
+    def get_url_for_picture(public_id: str, r: dict) -> str:
+        from src.conf.config import settings
+
+        return f"https://res.cloudinary.com/{settings.cloudinary_name}/image/upload/c_fill,h_350,w_350/v{r.get('version', 1)}/{public_id}"
+
+    def delete_pictures(self, public_ids: list[str]) -> dict:
+        self.wait()
+        deleted = {}
+        for public_id in public_ids:
+            path = self.directory / public_id
+            deleted[public_id] = "deleted" if path.exists() else "not_found"
+            path.unlink(missing_ok=True)
+        return {"deleted": deleted}
+
+    def list_pictures(self, prefix: str, next_cursor: str | None = None) -> dict:
+        self.wait()
+        resources = []
+        for path in sorted(self.directory.rglob("*")):
+            public_id = path.relative_to(self.directory).as_posix()
+            if path.is_file() and public_id.startswith(prefix):
+                created_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(path.stat().st_mtime))
+                resources.append({"public_id": public_id, "secure_url": self.get_url_for_picture(public_id, {}), "created_at": created_at})
+        return {"resources": resources}
+
+    def install(self) -> None:
+        """
+        Replaces the Cloudinary calls of CloudPicture by those of the fake storage.
+        """
+        from src.services.cloud_picture import CloudPicture
+
+        for name in ("upload_picture", "get_url_for_picture", "delete_pictures", "list_pictures"):
+            setattr(CloudPicture, name, staticmethod(getattr(self, name)))
+
+
+class SmtpSink:
+    """
+    A minimal SMTP server that accepts every message without sending it, and counts them.
+    It speaks enough of the protocol for aiosmtplib, the client of fastapi_mail, without TLS or authentication.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.recipients: list[str] = []
+        self.port: int | None = None
+        self._server: asyncio.base_events.Server | None = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def start_in_thread(self, host: str = "127.0.0.1") -> int:
+        """
+        Serves from a daemon thread with its own event loop, for apps run by other processes.
+
+        :return: The port of the server
+        """
+        started = threading.Event()
+
+        def serve() -> None:
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(self.start(host))
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, name="smtp-sink", daemon=True).start()
+        started.wait()
+        return self.port
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.write(b"220 bench SMTP sink\r\n")
+        try:
+            while line := await reader.readline():
+                verb = line[:4].upper()
+                if verb == b"EHLO":
+                    writer.write(b"250-bench\r\n250 8BITMIME\r\n")
+                elif verb in (b"HELO", b"MAIL", b"RSET", b"NOOP"):
+                    writer.write(b"250 OK\r\n")
+                elif verb == b"RCPT":
+                    self.recipients.append(line.decode(errors="replace").partition(":")[2].strip(" <>\r\n"))
+                    writer.write(b"250 OK\r\n")
+                elif verb == b"DATA":
+                    writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                    await writer.drain()
+                    while (await reader.readline()) not in (b".\r\n", b""):
+                        pass
+                    self.messages += 1
+                    writer.write(b"250 OK\r\n")
+                elif verb == b"QUIT":
+                    writer.write(b"221 Bye\r\n")
+                    break
+                else:
+                    writer.write(b"502 Command not implemented\r\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def install(self) -> None:
+        """
+        Points the mail client of the app at the sink.
+        """
+        from fastapi_mail import ConnectionConfig, FastMail
+
+        from src.conf.config import settings
+        from src.services import email
+
+        conf = ConnectionConfig(
+            MAIL_USERNAME=settings.mail_username,
+            MAIL_PASSWORD=settings.mail_password,
+            MAIL_FROM=settings.mail_from,
+            MAIL_PORT=self.port,
+            MAIL_SERVER="127.0.0.1",
+            MAIL_FROM_NAME="Bench",
+            MAIL_STARTTLS=False,
+            MAIL_SSL_TLS=False,
+            USE_CREDENTIALS=False,
+            VALIDATE_CERTS=False,
+            TEMPLATE_FOLDER=Path(email.__file__).parent / "templates",
+        )
+        email.get_mail = functools.cache(lambda: FastMail(conf))
+
+
+def install_fake_redis() -> None:
+    """
+    Gives the app a fakeredis client in place of the shared Redis client. Each process gets its own fake,
+    so it only fits a single worker. The rate limiter is not initialised: no route is rate limited,
+    and its Lua scripts would need fakeredis[lua].
+    """
+    import fakeredis
+    from fastapi_limiter import FastAPILimiter
+
+    from src.conf import config
+
+    async def init(*args, **kwargs) -> None:
+        pass
+
+    config._redis_client = fakeredis.aioredis.FakeRedis()
+    FastAPILimiter.init = init
+
+
+def install_from_env() -> None:
+    """
+    Installs the fakes described by the BENCH_* environment variables, in the workers started by `serve`.
+    """
+    if os.environ.get(STORAGE_DIR_ENV):
+        FakeStorage(os.environ[STORAGE_DIR_ENV], float(os.environ.get(STORAGE_LATENCY_ENV, 0))).install()
+    if os.environ.get(SMTP_PORT_ENV):
+        sink = SmtpSink()
+        sink.port = int(os.environ[SMTP_PORT_ENV])
+        sink.install()
+    if os.environ.get(FAKE_REDIS_ENV):
+        install_fake_redis()
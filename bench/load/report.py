@@ -0,0 +1,135 @@
+"""
+Records the requests of a load test and summarizes them per route, and compares two summaries.
+"""
+import json
+import math
+import time
+from collections import defaultdict
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    The percentile function returns the nearest-rank percentile of sorted values.
+
+    :param values: list[float]: The values, sorted
+    :param q: float: The percentile, between 0 and 100
+    :return: The value below which q percent of the values fall, 0 for no values
+    """
+    if not values:
+        return 0.0
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+class Recorder:
+    """
+    Keeps the latency and the outcome of every request, by route name.
+    """
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.statuses: dict[str, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.started = time.perf_counter()
+        self.stopped: float | None = None
+
+    def record(self, route: str, seconds: float, status: int, ok: bool) -> None:
+        self.latencies[route].append(seconds)
+        self.statuses[route][status] += 1
+        if not ok:
+            self.errors[route] += 1
+
+    def stop(self) -> None:
+        self.stopped = time.perf_counter()
+
+    def summary(self, config: dict | None = None) -> dict:
+        """
+        The summary function computes the throughput, the error rate and the latency percentiles in milliseconds
+        of every route and of all of them together.
+
+        :param config: dict | None: The parameters of the run, saved with the results
+        :return: A dict that can be saved as JSON and compared
+        """
+        duration = (self.stopped or time.perf_counter()) - self.started
+
+        def stats(latencies: list[float], errors: int, statuses: dict[int, int] | None = None) -> dict:
+            latencies = sorted(latencies)
+            result = {
+                "count": len(latencies),
+                "errors": errors,
+                "error_rate": errors / len(latencies) if latencies else 0.0,
+                "rps": len(latencies) / duration if duration else 0.0,
+                "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+                **{f"p{q}_ms": percentile(latencies, q) * 1000 for q in PERCENTILES},
+                "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+            }
+            if statuses is not None:
+                result["statuses"] = {str(status): count for status, count in sorted(statuses.items())}
+            return result
+
+        routes = {route: stats(latencies, self.errors[route], self.statuses[route]) for route, latencies in sorted(self.latencies.items())}
+        everything = [latency for latencies in self.latencies.values() for latency in latencies]
+        return {
+            "config": config or {},
+            "duration_seconds": duration,
+            "total": stats(everything, sum(self.errors.values())),
+            "routes": routes,
+        }
+
+
+def print_summary(summary: dict) -> None:
+    header = f"{'route':<48} {'count':>7} {'err %':>6} {'rps':>8} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}"
+    print(header)
+    print("-" * len(header))
+    for route, stats in [*summary["routes"].items(), ("total", summary["total"])]:
+        print(
+            f"{route:<48} {stats['count']:>7} {stats['error_rate'] * 100:>6.1f} {stats['rps']:>8.1f} {stats['mean_ms']:>8.1f}"
+            f" {stats['p50_ms']:>8.1f} {stats['p90_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['max_ms']:>8.1f}"
+        )
+    print(f"{summary['duration_seconds']:.1f} s, latencies in ms")
+
+
+def save(summary: dict, path: str) -> None:
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(summary, file, indent=2)
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def compare(base: dict, new: dict, threshold: float = 0.1, min_count: int = 20) -> list[str]:
+    """
+    The compare function finds the routes whose p99 latency grew, whose throughput fell or whose error rate rose
+    by more than the threshold between two runs. Routes with fewer than min_count requests in either run
+    are printed but not judged, their percentiles being noise.
+
+    :param base: dict: The summary of the reference run
+    :param new: dict: The summary of the run under test
+    :param threshold: float: The tolerated relative change, e.g. 0.1 for 10 %, and absolute change of the error rate
+    :param min_count: int: The minimum number of requests of a route to judge it
+    :return: The regressions found, one line each
+    """
+    print(f"{'route':<48} {'rps':>18} {'p99 ms':>20} {'err %':>14}")
+    regressions = []
+    for route in [*sorted(base["routes"].keys() | new["routes"].keys()), "total"]:
+        old_stats = base["total"] if route == "total" else base["routes"].get(route)
+        new_stats = new["total"] if route == "total" else new["routes"].get(route)
+        if old_stats is None or new_stats is None:
+            print(f"{route:<48} {'only in ' + ('new' if old_stats is None else 'base'):>18}")
+            continue
+        print(
+            f"{route:<48} {old_stats['rps']:>8.1f} → {new_stats['rps']:>7.1f} {old_stats['p99_ms']:>9.1f} → {new_stats['p99_ms']:>8.1f}"
+            f" {old_stats['error_rate'] * 100:>5.1f} → {new_stats['error_rate'] * 100:>5.1f}"
+        )
+        if min(old_stats["count"], new_stats["count"]) < min_count:
+            continue
+        if new_stats["p99_ms"] > old_stats["p99_ms"] * (1 + threshold):
+            regressions.append(f"{route}: p99 {old_stats['p99_ms']:.1f} ms → {new_stats['p99_ms']:.1f} ms")
+        if new_stats["rps"] < old_stats["rps"] * (1 - threshold):
+            regressions.append(f"{route}: throughput {old_stats['rps']:.1f} → {new_stats['rps']:.1f} requests/s")
+        if new_stats["error_rate"] > old_stats["error_rate"] + threshold:
+            regressions.append(f"{route}: error rate {old_stats['error_rate']:.1%} → {new_stats['error_rate']:.1%}")
+    return regressions
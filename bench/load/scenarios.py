@@ -0,0 +1,230 @@
+"""
+The workflows the virtual users of a load test go through, picked at random with configurable weights.
+Every request is recorded under the route template it hits, e.g. GET /api/pictures/{picture_id}.
+"""
+import asyncio
+import os
+import random
+import time
+import uuid
+
+import httpx
+
+from bench.load.report import Recorder
+from bench.load.seed import EMAIL_DOMAIN, PASSWORD, Catalog
+
+SIGNUP_DOMAIN = f"signup.{EMAIL_DOMAIN}"
+OK = (200, 201, 204)
+# The search routes answer 404 when nothing matches, which is a valid answer for a random query.
+FOUND_OR_NOT = (200, 404)
+
+
+class VirtualUser:
+    """
+    One client of the API: it logs in as one of the seeded users and then runs scenarios in a loop.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, catalog: Catalog, rng: random.Random,
+                 think_seconds: float = 0.0, upload_bytes: int = 20_000):
+        self.client = client
+        self.recorder = recorder
+        self.catalog = catalog
+        self.rng = rng
+        self.think_seconds = think_seconds
+        self.upload_bytes = upload_bytes
+        self.token: str | None = None
+
+    async def request(self, route: str, method: str, url: str, expected=OK, **kwargs) -> httpx.Response | None:
+        if self.token is not None:
+            kwargs.setdefault("headers", {})["Authorization"] = f"Bearer {self.token}"
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except Exception:
+            # Any failure is a failed request of this route, so one error never stops the other virtual users.
+            self.recorder.record(route, time.perf_counter() - start, 0, ok=False)
+            return None
+        self.recorder.record(route, time.perf_counter() - start, response.status_code, ok=response.status_code in expected)
+        return response
+
+    async def think(self) -> None:
+        if self.think_seconds:
+            await asyncio.sleep(self.rng.expovariate(1 / self.think_seconds))
+
+    def picture_id(self) -> int:
+        return self.rng.choice(self.catalog.picture_ids)
+
+    def tag_name(self) -> str:
+        return self.rng.choice(self.catalog.tag_names) if self.catalog.tag_names else "tag"
+
+    async def login(self, email: str, password: str = PASSWORD) -> bool:
+        self.token = None
+        response = await self.request(
+            "POST /api/auth/login", "POST", "/api/auth/login", data={"username": email, "password": password}
+        )
+        if response is None or response.status_code != 200:
+            return False
+        self.token = response.json()["access_token"]
+        return True
+
+    async def upload(self) -> int | None:
+        tags = self.rng.sample(self.catalog.tag_names, min(3, len(self.catalog.tag_names)))
+        content = b"\x89PNG\r\n\x1a\n" + os.urandom(self.upload_bytes)
+        response = await self.request(
+            "POST /api/pictures/", "POST", "/api/pictures/",
+            params={"name": f"upload {self.rng.randrange(10_000)}", "description": "uploaded by bench.load"},
+            # The route reads the tags from the form, as one comma-separated field.
+            data={"tags": ",".join(tags)},
+            files={"file": ("picture.png", content, "image/png")},
+        )
+        if response is None or response.status_code != 201:
+            return None
+        return response.json()["picture"]["id"]
+
+    async def rate(self, picture_id: int) -> None:
+        # Rating twice or rating an own picture is refused: these answers are part of the workload.
+        await self.request(
+            "POST /api/pictures{picture_id}/ratings", "POST", f"/api/pictures{picture_id}/ratings",
+            expected=(200, 400), params={"rating": self.rng.randint(1, 5)},
+        )
+
+    async def comment(self, picture_id: int) -> None:
+        await self.request(
+            "POST /api/pictures/{picture_id}/comments", "POST", f"/api/pictures/{picture_id}/comments",
+            json={"text": f"comment {self.rng.randrange(10_000)}"},
+        )
+
+    async def search_by_tag(self, comments_preview: int = 0) -> None:
+        await self.request(
+            "GET /api/pictures/?tags", "GET", "/api/pictures/", expected=FOUND_OR_NOT,
+            params={"tags__normalized_tagname": self.tag_name(), "comments_preview": comments_preview},
+        )
+
+
+async def browse(user: VirtualUser) -> None:
+    """Lists pictures by name, opens one and reads its comments."""
+    await user.request(
+        "GET /api/pictures/?name", "GET", "/api/pictures/", expected=FOUND_OR_NOT,
+        params={"name__ilike": str(user.rng.randrange(100)), "order_by": "-rating_average"},
+    )
+    await user.think()
+    picture_id = user.picture_id()
+    await user.request("GET /api/pictures/{picture_id}", "GET", f"/api/pictures/{picture_id}", expected=FOUND_OR_NOT)
+    await user.request("GET /api/pictures/{picture_id}/comments", "GET", f"/api/pictures/{picture_id}/comments",
+                       expected=FOUND_OR_NOT, params={"limit": 10})
+
+
+async def search(user: VirtualUser) -> None:
+    """Autocompletes a tag and searches the pictures with it."""
+    prefix = user.tag_name()[:4]
+    await user.request("GET /api/tags/suggest", "GET", "/api/tags/suggest", params={"prefix": prefix})
+    await user.think()
+    await user.search_by_tag(comments_preview=3)
+
+
+async def engage(user: VirtualUser) -> None:
+    """Rates and comments a picture, then reads the comments."""
+    picture_id = user.picture_id()
+    await user.rate(picture_id)
+    await user.think()
+    await user.comment(picture_id)
+    await user.request("GET /api/pictures/{picture_id}/comments", "GET", f"/api/pictures/{picture_id}/comments",
+                       expected=FOUND_OR_NOT, params={"limit": 10})
+
+
+async def upload(user: VirtualUser) -> None:
+    """Uploads a picture with tags to the fake storage."""
+    await user.upload()
+
+
+async def signup(user: VirtualUser) -> None:
+    """
+    The whole life of a new user: signup, email confirmation, login, upload, rating, comment and search.
+    The confirmation link is built from the token the email carries, signed with the secret key of the app.
+    The virtual user logs back in as its seeded user afterwards.
+    """
+    from src.services.auth import auth_service
+
+    seeded_token = user.token
+    user.token = None
+    name = uuid.uuid4().hex[:16]
+    email = f"{name}@{SIGNUP_DOMAIN}"
+    response = await user.request(
+        "POST /api/auth/signup", "POST", "/api/auth/signup",
+        json={"username": name, "email": email, "password": PASSWORD},
+    )
+    if response is not None and response.status_code == 201:
+        token = auth_service.create_email_token({"sub": email})
+        await user.request("GET /api/auth/confirmed_email/{token}", "GET", f"/api/auth/confirmed_email/{token}")
+        if await user.login(email):
+            picture_id = await user.upload()
+            await user.rate(user.picture_id())
+            if picture_id is not None:
+                await user.comment(picture_id)
+            await user.search_by_tag()
+    user.token = seeded_token
+
+
+SCENARIOS = {
+    "browse": browse,
+    "search": search,
+    "engage": engage,
+    "upload": upload,
+    "signup": signup,
+}
+DEFAULT_WEIGHTS = {"browse": 50, "search": 15, "engage": 25, "upload": 7, "signup": 3}
+
+
+def parse_weights(text: str | None) -> dict[str, float]:
+    """
+    The parse_weights function reads weights like browse=50,signup=0; the scenarios not named keep their default.
+
+    :param text: str | None: The weights
+    :return: The weight of every scenario
+    """
+    weights = dict(DEFAULT_WEIGHTS)
+    for item in filter(None, (text or "").split(",")):
+        name, _, value = item.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}, choose among {', '.join(SCENARIOS)}")
+        weights[name.strip()] = float(value)
+    return weights
+
+
+async def run_user(user: VirtualUser, email: str, weights: dict[str, float], deadline: float) -> None:
+    if not await user.login(email):
+        return
+    names = [name for name, weight in weights.items() if weight > 0]
+    chances = [weights[name] for name in names]
+    while time.perf_counter() < deadline:
+        await SCENARIOS[user.rng.choices(names, chances)[0]](user)
+        await user.think()
+
+
+async def drive(client: httpx.AsyncClient, catalog: Catalog, weights: dict[str, float], concurrency: int,
+                duration: float, think_seconds: float = 0.0, upload_bytes: int = 20_000, seed: int = 42) -> Recorder:
+    """
+    The drive function runs concurrency virtual users for duration seconds, each logged in as a different seeded user
+    when there are enough of them.
+
+    :param client: httpx.AsyncClient: The client bound to the app or to its url
+    :param catalog: Catalog: The seeded data
+    :param weights: dict[str, float]: The weight of every scenario
+    :param concurrency: int: The number of virtual users
+    :param duration: float: How long the users keep starting scenarios
+    :param think_seconds: float: The mean pause between two steps
+    :param upload_bytes: int: The size of the uploaded pictures
+    :param seed: int: The seed of the random choices
+    :return: The recorder of the requests
+    """
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+    users = [
+        VirtualUser(client, recorder, catalog, random.Random(seed + index), think_seconds, upload_bytes)
+        for index in range(concurrency)
+    ]
+    await asyncio.gather(*(
+        run_user(user, catalog.emails[index % len(catalog.emails)], weights, deadline) for index, user in enumerate(users)
+    ))
+    recorder.stop()
+    return recorder
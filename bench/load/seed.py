@@ -0,0 +1,145 @@
+"""
+Seeds the database of the load tests with users, tags, pictures, comments and ratings, with bulk INSERTs.
+The counters the app keeps (usage_count, comments_count, rating_average) are filled in consistently.
+"""
+import random
+import uuid
+from dataclasses import dataclass
+
+from sqlalchemy import bindparam, func, insert, select, update
+
+from src.conf.config import settings
+from src.database.db import sessionmanager
+from src.database.models import Base, Comment, Picture, Rating, Role, Tag, User, picture_tags
+from src.services.auth import auth_service
+
+EMAIL_DOMAIN = "bench.example.com"
+PASSWORD = "bench-password"
+BATCH_SIZE = 5_000
+
+
+@dataclass
+class Volumes:
+    users: int = 100
+    tags: int = 200
+    pictures_per_user: int = 10
+    tags_per_picture: int = 3
+    comments_per_picture: int = 5
+    ratings_per_picture: int = 3
+
+
+@dataclass
+class Catalog:
+    """
+    What the scenarios need to know about the seeded data.
+    """
+
+    emails: list[str]
+    picture_ids: list[int]
+    tag_names: list[str]
+
+
+def bench_email(index: int) -> str:
+    return f"user{index}@{EMAIL_DOMAIN}"
+
+
+def picture_url(public_id: str) -> str:
+    return f"https://res.cloudinary.com/{settings.cloudinary_name}/image/upload/c_fill,h_350,w_350/v1/{public_id}"
+
+
+async def execute_batches(db, statement, rows: list[dict]) -> None:
+    for start in range(0, len(rows), BATCH_SIZE):
+        await db.execute(statement, rows[start:start + BATCH_SIZE])
+
+
+async def seed(volumes: Volumes, reset: bool = False, seed: int = 42) -> dict:
+    """
+    The seed function creates the missing tables and inserts the seeded rows.
+    Every seeded user has the email user<n>@bench.example.com and the password bench-password,
+    hashed once for all of them.
+
+    :param volumes: Volumes: The number of rows to insert
+    :param reset: bool: Drop and recreate all tables first
+    :param seed: int: The seed of the random choices
+    :return: The number of rows inserted per table
+    """
+    rng = random.Random(seed)
+    async with sessionmanager._engine.begin() as connection:
+        if reset:
+            await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+
+    password = auth_service.get_password_hash(PASSWORD)
+    async with sessionmanager.session() as db:
+        first_user = (await db.scalar(select(func.max(User.id)))) or 0
+        await execute_batches(db, insert(User), [
+            {"username": f"bench{first_user + index}", "email": bench_email(first_user + index), "password": password,
+             "confirmed": True, "roles": Role.user}
+            for index in range(1, volumes.users + 1)
+        ])
+        user_ids = (await db.execute(select(User.id).where(User.email.like(f"%@{EMAIL_DOMAIN}")).order_by(User.id))).scalars().all()
+
+        first_tag = (await db.scalar(select(func.max(Tag.id)))) or 0
+        await execute_batches(db, insert(Tag), [{"tagname": f"tag{first_tag + index}"} for index in range(1, volumes.tags + 1)])
+        tag_ids = (await db.execute(select(Tag.id))).scalars().all()
+
+        pictures = []
+        for user_id in user_ids[-volumes.users:]:
+            for _ in range(volumes.pictures_per_user):
+                public_id = f"{settings.cloudinary_folder}/bench/{uuid.uuid4().hex}"
+                pictures.append({"name": f"picture {rng.randrange(10_000)}", "description": "seeded by bench.load",
+                                 "picture_url": picture_url(public_id), "user_id": user_id,
+                                 "comments_count": volumes.comments_per_picture})
+        first_picture = (await db.scalar(select(func.max(Picture.id)))) or 0
+        await execute_batches(db, insert(Picture), pictures)
+        picture_ids = (await db.execute(select(Picture.id, Picture.user_id).where(Picture.id > first_picture))).all()
+
+        tags, comments, ratings, averages, usage = [], [], [], [], {}
+        for picture_id, owner_id in picture_ids:
+            for tag_id in rng.sample(tag_ids, min(volumes.tags_per_picture, len(tag_ids))):
+                tags.append({"picture_id": picture_id, "tag_id": tag_id})
+                usage[tag_id] = usage.get(tag_id, 0) + 1
+            comments.extend(
+                {"text": f"comment {rng.randrange(10_000)}", "picture_id": picture_id, "user_id": rng.choice(user_ids)}
+                for _ in range(volumes.comments_per_picture)
+            )
+            raters = [user_id for user_id in rng.sample(user_ids, min(volumes.ratings_per_picture + 1, len(user_ids)))
+                      if user_id != owner_id][:volumes.ratings_per_picture]
+            values = [rng.randint(1, 5) for _ in raters]
+            ratings.extend({"rating": value, "user_id": user_id, "picture_id": picture_id} for user_id, value in zip(raters, values))
+            if values:
+                averages.append((picture_id, sum(values) / len(values)))
+        await execute_batches(db, insert(picture_tags), tags)
+        await execute_batches(db, insert(Comment), comments)
+        await execute_batches(db, insert(Rating), ratings)
+        pictures_table, tags_table = Picture.__table__, Tag.__table__
+        await execute_batches(
+            db,
+            update(pictures_table).where(pictures_table.c.id == bindparam("b_id")).values(rating_average=bindparam("b_value")),
+            [{"b_id": picture_id, "b_value": average} for picture_id, average in averages],
+        )
+        await execute_batches(
+            db,
+            update(tags_table).where(tags_table.c.id == bindparam("b_id")).values(usage_count=tags_table.c.usage_count + bindparam("b_value")),
+            [{"b_id": tag_id, "b_value": count} for tag_id, count in usage.items()],
+        )
+        await db.commit()
+    return {"users": volumes.users, "tags": volumes.tags, "pictures": len(picture_ids), "picture_tags": len(tags),
+            "comments": len(comments), "ratings": len(ratings)}
+
+
+async def load_catalog(limit: int = 10_000) -> Catalog:
+    """
+    The load_catalog function reads the seeded users, pictures and tags that the scenarios pick from.
+
+    :param limit: int: The maximum number of pictures and tags read
+    :return: The catalog
+    """
+    async with sessionmanager.session() as db:
+        emails = (await db.execute(select(User.email).where(User.email.like(f"%@{EMAIL_DOMAIN}"), User.is_active))).scalars().all()
+        picture_ids = (await db.execute(select(Picture.id).order_by(Picture.id.desc()).limit(limit))).scalars().all()
+        tag_names = (await db.execute(select(Tag.tagname).order_by(Tag.usage_count.desc()).limit(limit))).scalars().all()
+    if not emails or not picture_ids:
+        raise SystemExit("The database has no seeded data: run `python -m bench.load seed` first")
+    return Catalog(list(emails), list(picture_ids), list(tag_names))
+
@@ -1,9 +1,10 @@
+import asyncio
+import contextlib
 import logging
 
 import click
 import redis.asyncio as redis_async
-import uvicorn
-from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi_limiter import FastAPILimiter
 
 from fastapi.templating import Jinja2Templates
@@ -12,54 +13,108 @@ from fastapi.staticfiles import StaticFiles
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.conf.config import init_async_redis
-from src.database.db import get_db
-from src.routes import auth, comments, pictures, ratings, tags, users
+from src.conf.config import close_async_redis, init_async_redis, settings
+from src.database.db import get_db, sessionmanager
+from src.routes import auth, comments, events, exports, pictures, ratings, tags, users
+from src.services import metrics, tracing
+from src.services.events import event_broker
+from src.services.moderation import moderation_service
+from src.services.qrcode_generator import qrcode_generator
+from src.services.query_stats import QueryStatsMiddleware
+from src.services.read_your_writes import ReadYourWritesMiddleware, read_your_writes
+from src.services.roles import admin
+from src.services.storage_gc import storage_collector
+from src.services.tag_index import tag_index
 
 logger = logging.getLogger("uvicorn")
 
-app = FastAPI()
 
-app.include_router(auth.router, prefix="/api/auth")
-app.include_router(users.router, prefix="/api/users")
-app.include_router(tags.router, prefix="/api/tags")
-app.include_router(comments.router, prefix="/api/pictures")
-app.include_router(pictures.router, prefix="/api/pictures")
-app.include_router(ratings.router, prefix="/api/pictures")
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    The lifespan function sets up the resources of a worker before it serves requests and releases them when it stops.
 
+    On startup it creates the tracer of the worker if tracing is enabled, connects the Redis client shared
+    by the worker and the rate limiter, opens the first connections of the database pools, loads the moderation
+    blocklist and the tag index, and starts the replica health checks, the blocklist watcher and the storage
+    garbage collector. A failure to warm up the database or the caches is logged,
+    and they are filled on first use instead; without Redis the worker does not start.
 
-@app.on_event("startup")
-async def startup() -> FastAPILimiter:
-    """
-    The startup function is called when the server starts up.
-    It's a good place to initialize things that are needed by your application,
-    such as databases and caches.  It can also be used to pre-load data into memory,
-    or do other tasks that need to happen before the server begins serving requests.
+    On shutdown the background tasks are stopped first, the storage garbage collector being given
+    web_shutdown_timeout seconds to finish its batch, then the event streams, the HTTP session,
+    the Redis client and the database connections are closed, the live metrics of the worker are dropped
+    and the buffered spans are exported.
 
-    :return: A fastapilimiter object
+    :param app: FastAPI: The application
+    :return: None
     """
+    if settings.tracing_enabled:
+        tracing.setup()
     r = await init_async_redis()
     try:
+        await r.ping()
         await FastAPILimiter.init(r)
     except redis_async.ConnectionError as e:
         color_error = click.style(f"Error connecting to Redis: {str(e)}", bold=True, fg="red", italic=True)
         logger.error(e, extra={"color_message": color_error})
         raise HTTPException(status_code=500, detail="Error connecting to the redis")
 
+    try:
+        opened = await sessionmanager.warm_up(settings.db_pool_min_size)
+        logger.info(f"Opened {opened} database connections")
+    except Exception as e:
+        logger.error(f"Error warming up the database pool: {e}")
+    try:
+        await asyncio.to_thread(moderation_service.load)
+        async with sessionmanager.session() as db:
+            await tag_index.load(db)
+    except Exception as e:
+        logger.error(f"Error warming up the caches: {e}")
 
-@app.on_event("startup")
-async def on_startup() -> None:
-    """
-    The on_startup function is called when the application starts.
-    It prints a message to the console, so that you know where to go in your browser.
+    sessionmanager.start()
+    moderation_service.start()
+    tag_index.start()
+    if settings.storage_gc_enabled:
+        storage_collector.start()
 
-    :return: None
-    """
     message = "Open http://127.0.0.1:8000/docs to start api 🚀 🌘 🪐"
     color_url = click.style("http://127.0.0.1:8000/docs", bold=True, fg="green", italic=True)
     color_message = f"Open {color_url} to start api 🚀 🌘 🪐"
     logger.info(message, extra={"color_message": color_message})
 
+    yield
+
+    await storage_collector.stop(settings.web_shutdown_timeout)
+    await moderation_service.stop()
+    await tag_index.stop()
+    await event_broker.close()
+    qrcode_generator.close()
+    await close_async_redis()
+    await sessionmanager.close()
+    metrics.mark_process_dead()
+    tracing.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(
+    ReadYourWritesMiddleware, read_your_writes=read_your_writes, enabled=bool(settings.replica_database_urls)
+)
+app.add_middleware(QueryStatsMiddleware, server_timing=settings.db_server_timing)
+if settings.metrics_enabled:
+    app.add_middleware(metrics.MetricsMiddleware, routes=app.router.routes)
+if settings.tracing_enabled:
+    app.add_middleware(tracing.TracingMiddleware)
+
+app.include_router(auth.router, prefix="/api/auth")
+app.include_router(users.router, prefix="/api/users")
+app.include_router(tags.router, prefix="/api/tags")
+app.include_router(comments.router, prefix="/api/pictures")
+app.include_router(pictures.router, prefix="/api/pictures")
+app.include_router(ratings.router, prefix="/api/pictures")
+app.include_router(events.router, prefix="/api/pictures")
+app.include_router(exports.router, prefix="/api/exports")
+
 
 @app.get("/api/healthchecker", tags=["healthchecker"])
 async def healthchecker(db: AsyncSession = Depends(get_db)) -> dict:
@@ -81,6 +136,37 @@ async def healthchecker(db: AsyncSession = Depends(get_db)) -> dict:
         logger.error(e, extra={"color_message": color_error})
         raise HTTPException(status_code=500, detail="Error connecting to the database")
 
+
+@app.get("/api/healthchecker/pool", tags=["healthchecker"], dependencies=[Depends(admin)])
+async def pool_stats() -> dict:
+    """
+    The pool_stats function returns the usage and checkout wait times of the database connection pool,
+    with the health and replication lag of every replica. Only administrators may see them.
+
+    :return: A dictionary with the statistics of the pool
+    """
+    return {"pool": sessionmanager.pool_stats()}
+
+
+if settings.metrics_enabled:
+
+    @app.get("/metrics", include_in_schema=False)
+    async def get_metrics() -> Response:
+        """
+        The get_metrics function returns the metrics of the API in the Prometheus text format:
+        the latency, status and number in progress of the requests by route, the database pool checkout waits
+        and the statements per request, the Redis commands and the user cache hits, the Cloudinary calls
+        and the background task queues.
+
+        :return: A text response for the Prometheus scraper
+        """
+        body, content_type = metrics.render()
+        return Response(content=body, media_type=content_type)
+
+
+if settings.tracing_enabled:
+    tracing.instrument_app(app)
+
 app.mount("/static", StaticFiles(directory="static"), name="style.css")
 app.mount("/images", StaticFiles(directory="images"), name="schema.jpg")
 
@@ -101,4 +187,6 @@ async def documentation(request: Request):
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", reload=True, host="0.0.0.0")
+    from src.cli import serve
+
+    serve()
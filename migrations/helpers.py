@@ -0,0 +1,123 @@
+"""
+Helpers shared by the revisions: concurrent index builds and the backfills of the derived data.
+
+The backfills use lightweight table clauses instead of the models, so they keep matching the schema
+of the revision that calls them when the models change later. They run in the transaction of the migration.
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from src.services.minhash import minhasher
+
+BATCH_SIZE = 1000
+
+pictures = sa.table("pictures", sa.column("id"))
+tags = sa.table("tags", sa.column("id"), sa.column("tagname"), sa.column("usage_count"))
+picture_tags = sa.table("picture_tags", sa.column("picture_id"), sa.column("tag_id"))
+tag_cooccurrence = sa.table("tag_cooccurrence", sa.column("tag_id"), sa.column("related_tag_id"), sa.column("count"))
+picture_lsh_buckets = sa.table("picture_lsh_buckets", sa.column("picture_id"), sa.column("band"), sa.column("bucket"))
+
+
+def drop_invalid_index(name: str) -> None:
+    connection = op.get_bind()
+    if connection.dialect.name != "postgresql" or op.get_context().as_sql:
+        return
+    valid = connection.execute(
+        sa.text("SELECT indisvalid FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid WHERE relname = :name"),
+        {"name": name},
+    ).scalar()
+    if valid is False:
+        op.drop_index(name, postgresql_concurrently=True, if_exists=True)
+
+
+def create_indexes(indexes: list[tuple], unique: bool = False) -> None:
+    """
+    Builds the indexes with CREATE INDEX CONCURRENTLY on PostgreSQL, outside of a transaction, so the tables
+    stay writable during the build. A concurrent build that fails leaves an invalid index behind;
+    it is dropped and rebuilt on the next run.
+
+    :param indexes: list[tuple]: The name, table and columns of every index
+    :param unique: bool: Build unique indexes
+    """
+    with op.get_context().autocommit_block():
+        for name, table, columns in indexes:
+            drop_invalid_index(name)
+            op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True, if_not_exists=True)
+
+
+def drop_indexes(indexes: list[tuple]) -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(indexes):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+
+
+def recount_usage(tag_ids: list[int] | None = None) -> None:
+    """
+    Sets the usage_count of the given tags, or of all tags, to their number of rows in picture_tags.
+    """
+    usage = sa.select(sa.func.count()).where(picture_tags.c.tag_id == tags.c.id).scalar_subquery()
+    statement = sa.update(tags).values(usage_count=usage)
+    if tag_ids is not None:
+        statement = statement.where(tags.c.id.in_(tag_ids))
+    op.execute(statement)
+
+
+def rebuild_cooccurrence(tag_ids: list[int] | None = None) -> None:
+    """
+    Recounts the co-occurrence pairs involving the given tags, or all pairs, from picture_tags,
+    with one DELETE and one INSERT ... SELECT.
+    """
+    first, second = picture_tags.alias("first"), picture_tags.alias("second")
+    pairs = (
+        sa.select(first.c.tag_id, second.c.tag_id, sa.func.count())
+        .join(second, (second.c.picture_id == first.c.picture_id) & (second.c.tag_id != first.c.tag_id))
+        .group_by(first.c.tag_id, second.c.tag_id)
+    )
+    removed = sa.delete(tag_cooccurrence)
+    if tag_ids is not None:
+        pairs = pairs.where(first.c.tag_id.in_(tag_ids) | second.c.tag_id.in_(tag_ids))
+        removed = removed.where(tag_cooccurrence.c.tag_id.in_(tag_ids) | tag_cooccurrence.c.related_tag_id.in_(tag_ids))
+    op.execute(removed)
+    op.execute(sa.insert(tag_cooccurrence).from_select(["tag_id", "related_tag_id", "count"], pairs))
+
+
+def refresh_picture_buckets(connection: sa.Connection, picture_ids: list[int]) -> None:
+    """
+    Replaces the LSH band buckets of the given pictures with the buckets of their current tags.
+    """
+    tags_by_picture = {picture_id: [] for picture_id in picture_ids}
+    rows = connection.execute(
+        sa.select(picture_tags.c.picture_id, picture_tags.c.tag_id).where(picture_tags.c.picture_id.in_(picture_ids))
+    )
+    for picture_id, tag_id in rows:
+        tags_by_picture[picture_id].append(tag_id)
+    connection.execute(sa.delete(picture_lsh_buckets).where(picture_lsh_buckets.c.picture_id.in_(picture_ids)))
+    buckets = [
+        {"picture_id": picture_id, "band": band, "bucket": bucket}
+        for picture_id, tag_ids in tags_by_picture.items()
+        for band, bucket in enumerate(minhasher.buckets(tag_ids))
+    ]
+    if buckets:
+        connection.execute(sa.insert(picture_lsh_buckets), buckets)
+
+
+def rebuild_picture_buckets(picture_ids: list[int] | None = None) -> None:
+    """
+    Recomputes the LSH band buckets of the given pictures, or of all pictures, BATCH_SIZE pictures at a time.
+    All pictures are walked by keyset on their id, so no batch reads more than BATCH_SIZE pictures.
+    The buckets are computed in Python, so nothing is emitted in offline (--sql) mode.
+    """
+    if op.get_context().as_sql:
+        return
+    connection = op.get_bind()
+    if picture_ids is not None:
+        picture_ids = sorted(set(picture_ids))
+        for start in range(0, len(picture_ids), BATCH_SIZE):
+            refresh_picture_buckets(connection, picture_ids[start:start + BATCH_SIZE])
+        return
+    last_id = 0
+    while batch := connection.execute(
+        sa.select(pictures.c.id).where(pictures.c.id > last_id).order_by(pictures.c.id).limit(BATCH_SIZE)
+    ).scalars().all():
+        refresh_picture_buckets(connection, batch)
+        last_id = batch[-1]
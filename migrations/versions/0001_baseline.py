@@ -0,0 +1,101 @@
+"""baseline
+
+The schema of the application before the migrations were introduced, as create_all built it then:
+no counters, no moderation flags and no indexes besides the primary keys and unique constraints.
+A database created that way is brought under Alembic with `alembic stamp 0001` and then `alembic upgrade head`,
+which adds and backfills everything that came later. A database created by create_all from the current models
+already has the whole schema and is stamped with `alembic stamp head` instead.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 05:51:48.834074
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def timestamps() -> list[sa.Column]:
+    return [
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    ]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("username", sa.String(length=50), nullable=False),
+        sa.Column("email", sa.String(length=150), nullable=False),
+        sa.Column("confirmed", sa.Boolean(), nullable=False),
+        sa.Column("password", sa.String(length=255), nullable=False),
+        sa.Column("refresh_token", sa.String(length=255), nullable=True),
+        sa.Column("avatar", sa.String(length=255), nullable=True),
+        sa.Column("roles", sa.Enum("admin", "moderator", "user", name="role"), nullable=False),
+        sa.Column("is_active", sa.Boolean(), nullable=False),
+        *timestamps(),
+        sa.UniqueConstraint("email"),
+        sa.UniqueConstraint("username"),
+    )
+    op.create_table(
+        "tags",
+        sa.Column("tagname", sa.String(length=50), nullable=False),
+        *timestamps(),
+        sa.UniqueConstraint("tagname"),
+    )
+    op.create_table(
+        "invalid_tokens",
+        sa.Column("token", sa.String(length=250), nullable=False),
+        *timestamps(),
+    )
+    op.create_table(
+        "pictures",
+        sa.Column("name", sa.String(length=100), nullable=False),
+        sa.Column("description", sa.String(length=250), nullable=False),
+        sa.Column("picture_url", sa.String(length=200), nullable=False),
+        sa.Column("rating_average", sa.Float(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        *timestamps(),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+    )
+    op.create_table(
+        "comments",
+        sa.Column("text", sa.String(length=200), nullable=False),
+        sa.Column("picture_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        *timestamps(),
+        sa.ForeignKeyConstraint(["picture_id"], ["pictures.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+    )
+    op.create_table(
+        "ratings",
+        sa.Column("rating", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("picture_id", sa.Integer(), nullable=False),
+        *timestamps(),
+        sa.ForeignKeyConstraint(["picture_id"], ["pictures.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+    )
+    op.create_table(
+        "picture_tags",
+        sa.Column("picture_id", sa.Integer(), nullable=True),
+        sa.Column("tag_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["picture_id"], ["pictures.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["tag_id"], ["tags.id"], ondelete="CASCADE"),
+    )
+
+
+def downgrade() -> None:
+    for table in ("picture_tags", "ratings", "comments", "pictures", "invalid_tokens", "tags", "users"):
+        op.drop_table(table)
+    sa.Enum(name="role").drop(op.get_bind(), checkfirst=True)
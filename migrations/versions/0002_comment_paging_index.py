@@ -0,0 +1,28 @@
+"""comment paging index
+
+The (picture_id, created_at, id) index that serves every page of the keyset-paginated comments of a picture.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 05:55:00.000000
+
+"""
+from typing import Sequence, Union
+
+from migrations.helpers import create_indexes, drop_indexes
+
+
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [("ix_comments_picture_id_created_at_id", "comments", ["picture_id", "created_at", "id"])]
+
+
+def upgrade() -> None:
+    create_indexes(INDEXES)
+
+
+def downgrade() -> None:
+    drop_indexes(INDEXES)
@@ -0,0 +1,30 @@
+"""comment flags
+
+Comments whose text matches the moderation blocklist are stored with is_flagged set, under the flag policy.
+Existing comments are not flagged.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 05:56:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("comments") as batch_op:
+        batch_op.add_column(sa.Column("is_flagged", sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("comments") as batch_op:
+        batch_op.drop_column("is_flagged")
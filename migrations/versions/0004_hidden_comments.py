@@ -0,0 +1,29 @@
+"""hidden comments
+
+Comments hidden by the bulk moderation endpoint keep their row with is_hidden set. Existing comments are visible.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 05:57:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("comments") as batch_op:
+        batch_op.add_column(sa.Column("is_hidden", sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("comments") as batch_op:
+        batch_op.drop_column("is_hidden")
@@ -0,0 +1,34 @@
+"""comment counts
+
+The number of visible comments of every picture, kept by the writes of comments. The column is added with
+a default of 0 and filled for the existing pictures by one UPDATE with a correlated COUNT.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 05:58:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("pictures") as batch_op:
+        batch_op.add_column(sa.Column("comments_count", sa.Integer(), nullable=False, server_default="0"))
+    op.execute(
+        "UPDATE pictures SET comments_count = "
+        "(SELECT count(*) FROM comments WHERE comments.picture_id = pictures.id AND NOT comments.is_hidden)"
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("pictures") as batch_op:
+        batch_op.drop_column("comments_count")
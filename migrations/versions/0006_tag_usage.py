@@ -0,0 +1,55 @@
+"""tag usage
+
+The number of pictures of every tag, kept by the writes of picture_tags, and the indexes of the trending order
+and of both directions of picture_tags. Repeated (picture_id, tag_id) rows, which the unique index forbids,
+are removed first; the usage counts of the existing tags are then counted from picture_tags.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 05:59:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import create_indexes, drop_indexes, recount_usage
+
+
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+UNIQUE_INDEXES = [("ix_picture_tags_picture_id_tag_id", "picture_tags", ["picture_id", "tag_id"])]
+INDEXES = [
+    ("ix_picture_tags_tag_id_picture_id", "picture_tags", ["tag_id", "picture_id"]),
+    ("ix_tags_usage_count_id", "tags", ["usage_count", "id"]),
+]
+
+
+def remove_repeated_links() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            "DELETE FROM picture_tags AS repeated USING picture_tags AS kept "
+            "WHERE repeated.picture_id = kept.picture_id AND repeated.tag_id = kept.tag_id AND repeated.ctid > kept.ctid"
+        )
+    else:
+        op.execute("DELETE FROM picture_tags WHERE rowid NOT IN (SELECT min(rowid) FROM picture_tags GROUP BY picture_id, tag_id)")
+
+
+def upgrade() -> None:
+    remove_repeated_links()
+    with op.batch_alter_table("tags") as batch_op:
+        batch_op.add_column(sa.Column("usage_count", sa.Integer(), nullable=False, server_default="0"))
+    recount_usage()
+    create_indexes(UNIQUE_INDEXES, unique=True)
+    create_indexes(INDEXES)
+
+
+def downgrade() -> None:
+    drop_indexes(INDEXES)
+    drop_indexes(UNIQUE_INDEXES)
+    with op.batch_alter_table("tags") as batch_op:
+        batch_op.drop_column("usage_count")
@@ -0,0 +1,53 @@
+"""tag similarity
+
+tag_cooccurrence counts, in both directions, the pictures shared by every pair of tags, and picture_lsh_buckets
+holds the MinHash/LSH band buckets of the tags of every picture. Both are derived from picture_tags:
+the pairs are counted by one INSERT ... SELECT, the buckets are computed in batches of pictures.
+They are rebuilt the same way, after a change of the MinHash parameters, by `python -m src.cli rebuild-similarity`.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 06:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import rebuild_cooccurrence, rebuild_picture_buckets
+
+
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "tag_cooccurrence",
+        sa.Column("tag_id", sa.Integer(), nullable=False),
+        sa.Column("related_tag_id", sa.Integer(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["related_tag_id"], ["tags.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["tag_id"], ["tags.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("tag_id", "related_tag_id"),
+    )
+    op.create_index("ix_tag_cooccurrence_tag_id_count", "tag_cooccurrence", ["tag_id", "count"])
+    op.create_table(
+        "picture_lsh_buckets",
+        sa.Column("picture_id", sa.Integer(), nullable=False),
+        sa.Column("band", sa.Integer(), nullable=False),
+        sa.Column("bucket", sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(["picture_id"], ["pictures.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("picture_id", "band"),
+    )
+    op.create_index("ix_picture_lsh_buckets_band_bucket", "picture_lsh_buckets", ["band", "bucket"])
+    rebuild_cooccurrence()
+    rebuild_picture_buckets()
+
+
+def downgrade() -> None:
+    op.drop_table("picture_lsh_buckets")
+    op.drop_table("tag_cooccurrence")
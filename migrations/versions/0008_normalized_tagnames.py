@@ -0,0 +1,86 @@
+"""normalized tag names
+
+Tag names are unique in normalized form: the case-sensitive unique constraint on tags.tagname is replaced by
+a unique index on lower(tagname). Tags whose names are equal after normalization would break the new index,
+so every group of them is merged into its oldest tag first, which is renamed to the normalized name:
+the links of the other tags move to it, and the usage counts, co-occurrence pairs and LSH buckets
+of everything touched are recounted. This is what `python -m src.cli merge-duplicate-tags` does.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 06:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import (create_indexes, drop_indexes, picture_tags,
+                                rebuild_cooccurrence, rebuild_picture_buckets,
+                                recount_usage, tag_cooccurrence, tags)
+from src.schemas.tags import normalize_tagname
+
+
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The name PostgreSQL gives to the unnamed unique constraint of the baseline; SQLite gets the same name in batch mode.
+NAMING_CONVENTION = {"uq": "%(table_name)s_%(column_0_name)s_key"}
+
+INDEXES = [("ix_tags_tagname_lower", "tags", [sa.text("lower(tagname)")])]
+
+
+def merge_duplicate_tags() -> None:
+    connection = op.get_bind()
+    groups = {}
+    for tag_id, tagname in connection.execute(sa.select(tags.c.id, tags.c.tagname).order_by(tags.c.id)):
+        groups.setdefault(normalize_tagname(tagname), []).append((tag_id, tagname))
+    renames = [{"b_id": rows[0][0], "b_tagname": name} for name, rows in groups.items() if len(rows) > 1 or rows[0][1] != name]
+    targets = {tag_id: rows[0][0] for rows in groups.values() for tag_id, _ in rows[1:]}
+
+    if targets:
+        sources = list(targets)
+        picture_ids = connection.execute(
+            sa.select(picture_tags.c.picture_id).where(picture_tags.c.tag_id.in_(sources)).distinct()
+        ).scalars().all()
+        target_links = sa.select(picture_tags.c.picture_id).where(picture_tags.c.tag_id == sa.bindparam("b_target"))
+        moved = sa.select(picture_tags.c.picture_id, sa.bindparam("b_target", type_=sa.Integer)).where(
+            picture_tags.c.tag_id == sa.bindparam("b_source"), picture_tags.c.picture_id.not_in(target_links)
+        )
+        for source, target in targets.items():
+            connection.execute(
+                sa.insert(picture_tags).from_select(["picture_id", "tag_id"], moved), {"b_source": source, "b_target": target}
+            )
+        connection.execute(sa.delete(picture_tags).where(picture_tags.c.tag_id.in_(sources)))
+        connection.execute(
+            sa.delete(tag_cooccurrence).where(
+                tag_cooccurrence.c.tag_id.in_(sources) | tag_cooccurrence.c.related_tag_id.in_(sources)
+            )
+        )
+        connection.execute(sa.delete(tags).where(tags.c.id.in_(sources)))
+        target_ids = list(set(targets.values()))
+        recount_usage(target_ids)
+        rebuild_cooccurrence(target_ids)
+        rebuild_picture_buckets(picture_ids)
+
+    if renames:
+        connection.execute(
+            sa.update(tags).where(tags.c.id == sa.bindparam("b_id")).values(tagname=sa.bindparam("b_tagname")), renames
+        )
+
+
+def upgrade() -> None:
+    if not op.get_context().as_sql:
+        merge_duplicate_tags()
+    with op.batch_alter_table("tags", naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint("tags_tagname_key", type_="unique")
+    create_indexes(INDEXES, unique=True)
+
+
+def downgrade() -> None:
+    drop_indexes(INDEXES)
+    with op.batch_alter_table("tags", naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.create_unique_constraint("tags_tagname_key", ["tagname"])
@@ -0,0 +1,43 @@
+"""performance indexes
+
+Indexes on the foreign keys and the columns filtered on in the hot paths. On PostgreSQL they are built
+with CREATE INDEX CONCURRENTLY, outside of a transaction, so the tables stay writable during the build.
+A concurrent build that fails leaves an invalid index behind; it is dropped and rebuilt on the next run.
+
+Of the created_at columns only invalid_tokens.created_at is indexed, for the purge of expired tokens;
+comments.created_at is covered by the (picture_id, created_at, id) index of the comment pages.
+No query filters or sorts pictures or users by created_at (the listings sort by name, rating, id or username
+and the exports walk the tables by id), so an index there would only slow down the inserts.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19 06:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from migrations.helpers import create_indexes, drop_indexes
+
+
+revision: str = "0009"
+down_revision: Union[str, None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ("ix_pictures_user_id", "pictures", ["user_id"]),
+    ("ix_comments_user_id", "comments", ["user_id"]),
+    ("ix_ratings_picture_id_user_id", "ratings", ["picture_id", "user_id"]),
+    ("ix_ratings_user_id", "ratings", ["user_id"]),
+    ("ix_invalid_tokens_token", "invalid_tokens", ["token"]),
+    ("ix_invalid_tokens_created_at", "invalid_tokens", ["created_at"]),
+    ("ix_tag_cooccurrence_related_tag_id", "tag_cooccurrence", ["related_tag_id"]),
+]
+
+
+def upgrade() -> None:
+    create_indexes(INDEXES)
+
+
+def downgrade() -> None:
+    drop_indexes(INDEXES)
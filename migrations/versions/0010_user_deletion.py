@@ -0,0 +1,66 @@
+"""user deletion
+
+The foreign keys of ratings get ON DELETE CASCADE like those of comments, so deleting a user or a picture
+removes its ratings in the database instead of loading them through the ORM. On PostgreSQL the constraints are
+swapped with plain ALTER TABLE statements and the new ones are added NOT VALID, which only holds the
+ACCESS EXCLUSIVE lock for a moment. That transaction is committed before VALIDATE CONSTRAINT runs in autocommit mode:
+the validation checks the existing rows under a SHARE UPDATE EXCLUSIVE lock, which does not block writes.
+SQLite has no ALTER of constraints, so the table is rebuilt in batch mode there.
+The pending_deletions table queues the storage assets of deleted rows for removal from Cloudinary.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19 06:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0010"
+down_revision: Union[str, None] = "0009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The names PostgreSQL gives to the unnamed constraints of the baseline; SQLite gets the same names in batch mode.
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+FOREIGN_KEYS = [
+    ("ratings_user_id_fkey", "users", "user_id"),
+    ("ratings_picture_id_fkey", "pictures", "picture_id"),
+]
+
+
+def replace_foreign_keys(ondelete: str | None) -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        with op.batch_alter_table("ratings", naming_convention=NAMING_CONVENTION) as batch_op:
+            for name, table, column in FOREIGN_KEYS:
+                batch_op.drop_constraint(name, type_="foreignkey")
+                batch_op.create_foreign_key(name, table, [column], ["id"], ondelete=ondelete)
+        return
+    for name, table, column in FOREIGN_KEYS:
+        op.drop_constraint(name, "ratings", type_="foreignkey")
+        op.create_foreign_key(name, "ratings", table, [column], ["id"], ondelete=ondelete, postgresql_not_valid=True)
+    # Commits the swap, releasing its lock, before the rows are checked.
+    with op.get_context().autocommit_block():
+        for name, _, _ in FOREIGN_KEYS:
+            op.execute(f"ALTER TABLE ratings VALIDATE CONSTRAINT {name}")
+
+
+def upgrade() -> None:
+    replace_foreign_keys("CASCADE")
+    op.create_table(
+        "pending_deletions",
+        sa.Column("url", sa.String(length=255), nullable=False),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("pending_deletions")
+    replace_foreign_keys(None)
@@ -0,0 +1,38 @@
+"""storage gc
+
+Retry state of the pending_deletions queue: the number of attempts, the time of the next attempt, which is also
+the lease of a claimed row, and the last error. Existing rows get a next_attempt_at in the past, so they are due.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-19 06:45:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0011"
+down_revision: Union[str, None] = "0010"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("pending_deletions") as batch_op:
+        batch_op.add_column(sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.add_column(
+            sa.Column("next_attempt_at", sa.DateTime(), nullable=False, server_default="1970-01-01 00:00:00")
+        )
+        batch_op.add_column(sa.Column("last_error", sa.String(length=255), nullable=True))
+    op.create_index("ix_pending_deletions_next_attempt_at", "pending_deletions", ["next_attempt_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_pending_deletions_next_attempt_at", table_name="pending_deletions")
+    with op.batch_alter_table("pending_deletions") as batch_op:
+        batch_op.drop_column("last_error")
+        batch_op.drop_column("next_attempt_at")
+        batch_op.drop_column("attempts")
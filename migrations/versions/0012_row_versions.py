@@ -0,0 +1,34 @@
+"""row versions
+
+Version counters of pictures and comments for optimistic concurrency control. Existing rows start at version 1;
+on PostgreSQL 11 and later a column with a constant default is added without rewriting the table.
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-19 07:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0012"
+down_revision: Union[str, None] = "0011"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ["pictures", "comments"]
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column("version", sa.Integer(), nullable=False, server_default="1"))
+
+
+def downgrade() -> None:
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column("version")
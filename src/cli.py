@@ -0,0 +1,201 @@
+"""
+Management commands of the PhotoShare API.
+
+Usage:
+    python -m src.cli --help
+    python -m src.cli serve --workers 4
+    python -m src.cli merge-duplicate-tags --dry-run
+    python -m src.cli collect-storage
+    python -m src.cli reconcile-storage --dry-run
+    python -m src.cli recount-comments
+    python -m src.cli recount-tags
+    python -m src.cli rebuild-similarity
+"""
+import asyncio
+import glob
+import importlib.util
+import os
+import tempfile
+
+import click
+
+from src.database.db import sessionmanager
+from src.conf.config import settings
+from src.repository import comments as repository_comments
+from src.repository import tags as repository_tags
+from src.services.metrics import MULTIPROC_DIR_ENV
+from src.services.storage_gc import storage_collector
+
+
+@click.group()
+def cli():
+    """Management commands of the PhotoShare API."""
+
+
+def default_workers() -> int:
+    """
+    The default_workers function returns one worker per CPU available to the process,
+    which also honours the CPU affinity set by a container runtime or taskset.
+
+    :return: The number of worker processes
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return max(len(os.sched_getaffinity(0)), 1)
+    return os.cpu_count() or 1
+
+
+def prepare_metrics_dir() -> str:
+    """
+    The prepare_metrics_dir function sets up the directory the workers share their metrics through:
+    settings.metrics_multiproc_dir, emptied of the files of a previous run, or a new temporary directory.
+    It is passed to the workers in PROMETHEUS_MULTIPROC_DIR, unless that variable is already set.
+
+    :return: The path of the directory
+    """
+    path = os.environ.get(MULTIPROC_DIR_ENV) or settings.metrics_multiproc_dir
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for file in glob.glob(os.path.join(path, "*.db")):
+            os.remove(file)
+    else:
+        path = tempfile.mkdtemp(prefix="photoshare-metrics-")
+    os.environ[MULTIPROC_DIR_ENV] = path
+    return path
+
+
+@cli.command("serve")
+@click.option("--host", default=settings.web_host, show_default=True)
+@click.option("--port", type=int, default=settings.web_port, show_default=True)
+@click.option("--workers", type=int, default=None, help="Worker processes. Default: WEB_WORKERS, or one per CPU.")
+@click.option("--reload", is_flag=True, help="Development mode: one worker, restarted when the code changes.")
+def serve(host: str, port: int, workers: int | None, reload: bool):
+    """
+    Run the API with uvicorn. Every worker is a separate process with its own database pool and Redis client,
+    so the database must accept workers * (DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW) connections.
+    uvloop and httptools are used when they are installed. With several workers, /metrics sums the metrics
+    of all of them through the files of a shared directory.
+    """
+    import uvicorn
+
+    workers = 1 if reload else workers or settings.web_workers or default_workers()
+    if workers > 1 and settings.metrics_enabled:
+        click.echo(f"Sharing metrics through {prepare_metrics_dir()}")
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    click.echo(f"Starting {workers} workers on {host}:{port} with the {loop} loop and the {http} parser")
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        workers=None if reload else workers,
+        reload=reload,
+        loop=loop,
+        http=http,
+        lifespan="on",
+        proxy_headers=True,
+        timeout_graceful_shutdown=settings.web_shutdown_timeout,
+    )
+
+
+async def _merge_duplicate_tags(dry_run: bool) -> None:
+    async with sessionmanager.session() as db:
+        if dry_run:
+            groups = await repository_tags.find_duplicate_tags(db)
+        else:
+            groups = await repository_tags.merge_duplicate_tags(db)
+
+    for name, rows in groups.items():
+        sources = ", ".join(f"{row.tagname!r} (id={row.id}, used {row.usage_count})" for row in rows)
+        click.echo(f"{name!r} <- {sources}")
+    action = "would be merged or renamed" if dry_run else "merged or renamed"
+    click.echo(f"{len(groups)} tag names {action}")
+
+
+@cli.command("merge-duplicate-tags")
+@click.option("--dry-run", is_flag=True, help="Only list the tags that would be merged.")
+def merge_duplicate_tags(dry_run: bool):
+    """
+    Merge the tags whose names are equal after normalization (NFKC, case-folded, trimmed) into the oldest of them.
+    Run it before creating the ix_tags_tagname_lower unique index on an existing database.
+    """
+    asyncio.run(_merge_duplicate_tags(dry_run))
+
+
+@cli.command("collect-storage")
+def collect_storage():
+    """
+    Delete from Cloudinary the assets queued in pending_deletions until no row is due.
+    """
+    claimed = asyncio.run(storage_collector.drain())
+    click.echo(f"{claimed} queued deletions processed")
+
+
+async def _reconcile_storage(grace_seconds: float, dry_run: bool) -> None:
+    orphans = await storage_collector.reconcile(grace_seconds, dry_run)
+    for url in orphans:
+        click.echo(url)
+    action = "would be queued" if dry_run else "queued"
+    click.echo(f"{len(orphans)} orphaned assets {action} for deletion")
+
+
+@cli.command("reconcile-storage")
+@click.option("--dry-run", is_flag=True, help="Only list the orphaned assets.")
+@click.option("--grace-seconds", type=float, default=settings.storage_gc_orphan_grace_seconds, show_default=True,
+              help="Leave alone the assets younger than this.")
+def reconcile_storage(grace_seconds: float, dry_run: bool):
+    """
+    Find the assets under the Cloudinary folder of the app that no picture or avatar uses and queue them for deletion.
+    """
+    asyncio.run(_reconcile_storage(grace_seconds, dry_run))
+
+
+async def _recount_comments(batch_size: int) -> None:
+    async with sessionmanager.session() as db:
+        recounted = await repository_comments.recount_comments(batch_size, db)
+    click.echo(f"{recounted} pictures recounted")
+
+
+@cli.command("recount-comments")
+@click.option("--batch-size", type=int, default=1000, show_default=True, help="Pictures recounted per transaction.")
+def recount_comments(batch_size: int):
+    """
+    Set the comments_count of every picture to its number of visible comments.
+    Migration 0005 does the same when it adds the column; run it again if the counters ever drift.
+    """
+    asyncio.run(_recount_comments(batch_size))
+
+
+async def _recount_tags(batch_size: int) -> None:
+    async with sessionmanager.session() as db:
+        recounted = await repository_tags.recount_all_usage(batch_size, db)
+    click.echo(f"{recounted} tags recounted")
+
+
+@cli.command("recount-tags")
+@click.option("--batch-size", type=int, default=1000, show_default=True, help="Tags recounted per transaction.")
+def recount_tags(batch_size: int):
+    """
+    Set the usage_count of every tag to its number of pictures.
+    Migration 0006 does the same when it adds the column; run it again if the counters ever drift.
+    """
+    asyncio.run(_recount_tags(batch_size))
+
+
+async def _rebuild_similarity(batch_size: int) -> None:
+    async with sessionmanager.session() as db:
+        result = await repository_tags.rebuild_similarity(batch_size, db)
+    click.echo(f"Co-occurrence pairs of {result['tags']} tags and LSH buckets of {result['pictures']} pictures rebuilt")
+
+
+@cli.command("rebuild-similarity")
+@click.option("--batch-size", type=int, default=1000, show_default=True, help="Tags or pictures rebuilt per transaction.")
+def rebuild_similarity(batch_size: int):
+    """
+    Recount the co-occurrence pairs of all tags and recompute the LSH buckets of all pictures from their tags.
+    Migration 0007 does the same when it adds the tables; run it again after changing the MinHash parameters.
+    """
+    asyncio.run(_rebuild_similarity(batch_size))
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,34 +1,93 @@
+import functools
+import time
+from typing import Literal
+
 import redis.asyncio
-import cloudinary
 
 from dotenv import load_dotenv
 
 from pydantic_settings import BaseSettings
 
+from src.services import tracing
+from src.services.metrics import redis_command_duration
+
 load_dotenv()
 
+@functools.cache
 def init_cloudinary():
+    """
+    The init_cloudinary function imports and configures the Cloudinary SDK on first use,
+    so that workers which never upload or delete a picture do not load it.
+
+    :return: The cloudinary module
+    """
+    import cloudinary
+
     cloudinary.config(
         cloud_name=settings.cloudinary_name,
         api_key=settings.cloudinary_api_key,
         api_secret=settings.cloudinary_api_secret,
         secure=True,
     )
+    return cloudinary
+
+
+class TimedRedis(redis.asyncio.Redis):
+    """
+    A Redis client that measures its commands in the redis_command_duration_seconds metric, by command name,
+    and traces them.
+    """
+
+    async def execute_command(self, *args, **options):
+        command = str(args[0]).upper()
+        start = time.perf_counter()
+        try:
+            with tracing.span(f"redis {command}", {"db.system": "redis", "db.operation": command}):
+                return await super().execute_command(*args, **options)
+        finally:
+            redis_command_duration.labels(command).observe(time.perf_counter() - start)
+
+
+_redis_client: redis.asyncio.Redis | None = None
+
 
 async def init_async_redis():
-    return redis.asyncio.Redis(
-        host=settings.redis_host,
-        port=settings.redis_port,
-        db=0,
-        encoding="utf-8",
-    )
-    
+    """
+    The init_async_redis function returns the Redis client of the worker, created on first use.
+    All requests and background tasks of a worker share the connection pool of this client.
+
+    :return: The Redis client
+    """
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = TimedRedis(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=0,
+            encoding="utf-8",
+        )
+    return _redis_client
+
+
+async def close_async_redis() -> None:
+    """
+    The close_async_redis function closes the connections of the Redis client of the worker, if it was created.
+
+    :return: None
+    """
+    global _redis_client
+    if _redis_client is not None:
+        client, _redis_client = _redis_client, None
+        await client.close()
+
+
 class Settings(BaseSettings):
     postgres_user: str = "postgres"
     postgres_password: str = "secretPassword"
     postgres_db: str = "postgres"
     postgres_domain: str = "localhost"
     postgres_port: int = 5432
+    database_url: str | None = None
     
     secret_key: str = "secret_key"
     algorithm: str = "HS256"
@@ -39,12 +98,64 @@ class Settings(BaseSettings):
     mail_port: int = 465
     mail_server: str = "smtp.meta.ua"
 
+    db_pool_size: int = 5
+    db_pool_max_overflow: int = 10
+    db_pool_timeout: float = 10.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_pool_min_size: int = 2
+    db_statement_cache_size: int = 100
+    db_command_timeout: float | None = 30.0
+    db_statement_timeout_ms: int | None = None
+    db_replica_urls: str = ""
+    db_replica_check_seconds: float = 10.0
+    db_replica_max_lag_seconds: float = 5.0
+    db_read_your_writes_seconds: float = 5.0
+    db_slow_query_ms: float | None = 500.0
+    db_server_timing: bool = True
+    export_batch_size: int = 1000
+    user_delete_batch_size: int = 1000
+
     redis_host: str = "localhost"
     redis_port: int = 6379
 
     cloudinary_name: str = "name"
     cloudinary_api_key: str = "1234567890"
     cloudinary_api_secret: str = "secret"
+    cloudinary_folder: str = "photoshare"
+
+    storage_gc_enabled: bool = True
+    storage_gc_batch_size: int = 100
+    storage_gc_calls_per_second: float = 1.0
+    storage_gc_idle_seconds: float = 30.0
+    storage_gc_lease_seconds: float = 300.0
+    storage_gc_retry_seconds: float = 60.0
+    storage_gc_max_attempts: int = 10
+    storage_gc_orphan_grace_seconds: float = 86400.0
+
+    events_queue_size: int = 100
+    events_heartbeat_seconds: float = 15.0
+
+    moderation_blocklist_path: str | None = None
+    moderation_policy: Literal["reject", "flag"] = "reject"
+    moderation_reload_seconds: float = 30.0
+
+    tag_index_reload_seconds: float = 300.0
+
+    web_host: str = "0.0.0.0"
+    web_port: int = 8000
+    web_workers: int | None = None
+    web_shutdown_timeout: float = 30.0
+
+    metrics_enabled: bool = True
+    metrics_multiproc_dir: str | None = None
+
+    tracing_enabled: bool = False
+    tracing_exporter: str = "console"
+    tracing_file: str = "traces.jsonl"
+    tracing_otlp_endpoint: str | None = None
+    tracing_sample_ratio: float = 1.0
+    tracing_service_name: str = "photoshare"
 
     class ConfigDict:
         env_file = ".env"
@@ -52,7 +163,13 @@ class Settings(BaseSettings):
 
     @property
     def sqlalchemy_database_url(self) -> str:
+        if self.database_url:
+            return self.database_url
         return f"postgresql+asyncpg://{self.postgres_user}:{self.postgres_password}@{self.postgres_domain}:{self.postgres_port}/{self.postgres_db}"
 
+    @property
+    def replica_database_urls(self) -> list[str]:
+        return [url.strip() for url in self.db_replica_urls.split(",") if url.strip()]
+
 settings = Settings()  # type: ignore
 
@@ -21,6 +21,8 @@ class Message:
             "MY_PROFILE_WAS_SUCCESSFULLY_EDITED": "Мій профіль успішно відредаговано",
             "USER_NOT_FOUND": "Користувач не знайдений",
             "YOU_CANT_BAN_YOURSELF": "Ви не можете себе заборонити",
+            "YOU_CANT_DELETE_YOURSELF": "Ви не можете видалити себе",
+            "USER_HAS_BEEN_DELETED": "було видалено",
             "USER_HAS_ALREADY_BANNED": "Користувача вже забанили",
             "USER_HAS_BEEN_BANNED": "було забанено",
             "USER_HAS_BEEN_ACTIVATED": "був активован",
@@ -50,9 +52,11 @@ class Message:
             # COMMENTS
             "COMMENT_NOT_CREATED": "Коментар не створено",
             "COMMENTS_NOT_FOUND": "Коментарі не знайдено",
+            "RESOURCE_WAS_MODIFIED": "Дані вже змінив хтось інший. Завантажте їх знову та повторіть спробу",
             "COMMENT_NOT_FOUND": "Коментар не знайдено",
             "COMMENT_CANT_BE_EMPTY": "Коментар не може бути порожнім",
             "COMMENT_HAS_NOT_BEEN_UPDATED": "Коментар не оновлено",
+            "COMMENT_REJECTED_BY_MODERATION": "Коментар містить заборонені слова",
             
             # PICTURES
             "PICTURE_WAS_UPLOADED_TO_SERVER": "Світлина була завантажена на сервер",
@@ -75,6 +79,10 @@ class Message:
             # TAGS
             "TAGNAME_NOT_FOUND": "тег не знайдено",
             "TAGNAME_ALREADY_EXIST": "тег вже існує",
+            "TAG_CANNOT_BE_MERGED_INTO_ITSELF": "тег не можна об'єднати із самим собою",
+
+            # PAGINATION
+            "INVALID_CURSOR": "Недійсний курсор сторінки",
         },
         # ENGLISH
         "EN": {
@@ -92,6 +100,8 @@ class Message:
             "MY_PROFILE_WAS_SUCCESSFULLY_EDITED": "My profile was successfully edited",
             "USER_NOT_FOUND": "User not found",
             "YOU_CANT_BAN_YOURSELF": "You can't ban yourself",
+            "YOU_CANT_DELETE_YOURSELF": "You can't delete yourself",
+            "USER_HAS_BEEN_DELETED": "has been deleted",
             "USER_HAS_ALREADY_BANNED": "User has already been banned",
             "USER_HAS_BEEN_BANNED": "has been banned",
             "USER_HAS_BEEN_ACTIVATED": "has been activated",
@@ -121,9 +131,11 @@ class Message:
             # COMMENTS
             "COMMENT_NOT_CREATED": "Comment not created",
             "COMMENTS_NOT_FOUND": "Comments not found",
+            "RESOURCE_WAS_MODIFIED": "It has been changed by someone else. Reload it and try again",
             "COMMENT_NOT_FOUND": "Comment is not found",
             "COMMENT_CANT_BE_EMPTY": "Comment can't be empty",
             "COMMENT_HAS_NOT_BEEN_UPDATED": "Comment has been not updated",
+            "COMMENT_REJECTED_BY_MODERATION": "Comment contains blocked words",
             
             # PICTURES
             "PICTURE_WAS_UPLOADED_TO_SERVER": "The picture was uploaded to the server",
@@ -146,6 +158,10 @@ class Message:
             # TAGS
             "TAGNAME_NOT_FOUND": "tagname not found",
             "TAGNAME_ALREADY_EXIST": "tagname already exist",
+            "TAG_CANNOT_BE_MERGED_INTO_ITSELF": "a tag cannot be merged into itself",
+
+            # PAGINATION
+            "INVALID_CURSOR": "Invalid page cursor",
         },
     }
 
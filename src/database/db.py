@@ -1,13 +1,151 @@
+import asyncio
 import contextlib
-from typing import AsyncIterator
+import itertools
+import logging
+import time
+from typing import AsyncIterator, Sequence
 
+from sqlalchemy import Table, text
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from fastapi import Request
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from src.conf.config import settings
+from src.services import metrics
+from src.services.query_stats import instrument
+from src.services.read_your_writes import read_your_writes
+
+logger = logging.getLogger("uvicorn")
 
 SQLALCHEMY_DATABASE_URL = settings.sqlalchemy_database_url
 
 
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    An AsyncAdaptedQueuePool that measures how long checkouts wait for a connection,
+    in its own counters and in the db_pool_checkout_wait_seconds metric.
+
+    The wait includes opening a new connection when the pool has none idle,
+    so it shows both pool exhaustion and connection setup costs.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa_exc.TimeoutError:
+            self.timeouts += 1
+            metrics.db_pool_checkout_timeouts.inc()
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            metrics.db_pool_checkout_wait.observe(waited)
+            self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def stats(self) -> dict:
+        """
+        The stats function returns the current state of the pool and the checkout wait times since it was created.
+
+        :return: A dict with the pool size, the connections in use, idle and in overflow, and the checkout wait times
+        """
+        return {
+            "size": self.size(),
+            "in_use": self.checkedout(),
+            "idle": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_seconds_total": round(self.wait_seconds, 6),
+            "wait_seconds_max": round(self.max_wait_seconds, 6),
+        }
+
+
+def engine_options(url: str) -> dict:
+    """
+    The engine_options function returns the arguments of create_async_engine for the database url, taken from settings.
+    SQLite keeps the defaults of SQLAlchemy, which choose the pool suitable for file and memory databases.
+
+    :param url: str: The SQLAlchemy database url
+    :return: A dict of keyword arguments for create_async_engine
+    """
+    if url.startswith("sqlite"):
+        return {}
+
+    connect_args = {
+        "prepared_statement_cache_size": settings.db_statement_cache_size,
+        "command_timeout": settings.db_command_timeout,
+    }
+    if settings.db_statement_timeout_ms:
+        connect_args["server_settings"] = {"statement_timeout": str(settings.db_statement_timeout_ms)}
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_pool_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "connect_args": connect_args,
+    }
+
+
+REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class Replica:
+    """
+    A read replica: its engine, its session maker and the result of its last health check.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.engine = create_async_engine(url, **engine_options(url))
+        instrument(self.engine.sync_engine)
+        self.session_maker = async_sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=self.engine)
+        self.healthy = True
+        self.lag_seconds: float | None = None
+
+    async def check(self, max_lag_seconds: float, timeout: float) -> bool:
+        """
+        The check function runs a query on the replica and measures its replication lag.
+        The replica is healthy if the query succeeds within the timeout and the lag is at most max_lag_seconds.
+
+        :param max_lag_seconds: float: The largest acceptable replication lag
+        :param timeout: float: The time limit of the check
+        :return: True if the replica is healthy
+        """
+        try:
+            async with asyncio.timeout(timeout):
+                async with self.engine.connect() as connection:
+                    if connection.dialect.name == "postgresql":
+                        lag = (await connection.execute(REPLICA_LAG_QUERY)).scalar()
+                    else:
+                        lag = (await connection.execute(text("SELECT 0"))).scalar()
+            self.lag_seconds = float(lag or 0)
+            healthy = self.lag_seconds <= max_lag_seconds
+        except Exception as e:
+            logger.error(f"Error checking the database replica {self.engine.url.host}: {e}")
+            self.lag_seconds = None
+            healthy = False
+        if healthy != self.healthy:
+            logger.warning(f"Database replica {self.engine.url.host} is {'healthy' if healthy else 'unhealthy'}")
+        self.healthy = healthy
+        return healthy
+
+
 class DatabaseSessionManager:
     """
     A manager for creating and managing database sessions.
@@ -15,33 +153,161 @@ class DatabaseSessionManager:
     This class provides methods to create and manage asynchronous database sessions.
 
     Attributes:
-        _engine (AsyncEngine): The asynchronous SQLAlchemy engine.
-        _session_maker (async_sessionmaker): The asynchronous session maker.
+        _engine (AsyncEngine): The asynchronous SQLAlchemy engine of the primary.
+        _session_maker (async_sessionmaker): The asynchronous session maker of the primary.
+        _replicas (list[Replica]): The read replicas.
 
     Methods:
-        __init__(self, url: str):
-            Initializes the DatabaseSessionManager with a given database URL.
+        __init__(self, url: str, replica_urls: Sequence[str] = ()):
+            Initializes the DatabaseSessionManager with a given database URL and read replica URLs.
 
         session(self) -> AsyncIterator[AsyncSession]:
-            A context manager that yields an asynchronous database session.
+            A context manager that yields an asynchronous database session of the primary.
+
+        read_session(self, primary: bool = False) -> AsyncIterator[AsyncSession]:
+            A context manager that yields a session of a healthy replica, or of the primary.
+
+        check_replicas(self) -> None:
+            Checks the health and the replication lag of every replica.
+
+        warm_up(self, size: int) -> int:
+            Opens connections ahead of the first requests.
+
+        pool_stats(self) -> dict:
+            Returns the usage and checkout wait times of the connection pool.
+
+        close(self) -> None:
+            Closes all connections of the pool.
 
     Example:
-        sessionmanager = DatabaseSessionManager(settings.sqlalchemy_database_url)
+        sessionmanager = DatabaseSessionManager(settings.sqlalchemy_database_url, settings.replica_database_urls)
         async with sessionmanager.session() as session:
             # Use the session for database operations
     """
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, replica_urls: Sequence[str] = ()):
         """
         Initializes the DatabaseSessionManager with a given database URL.
+        The pool and driver options are taken from settings, see engine_options.
 
         :param url: The SQLAlchemy database URL.
         :type url: str
+        :param replica_urls: The SQLAlchemy database URLs of the read replicas.
+        :type replica_urls: Sequence[str]
         """
-        self._engine: AsyncEngine | None = create_async_engine(url)
+        self._engine: AsyncEngine | None = create_async_engine(url, **engine_options(url))
+        instrument(self._engine.sync_engine)
         self._session_maker: async_sessionmaker | None = async_sessionmaker(
             autocommit=False, autoflush=False, expire_on_commit=False, bind=self._engine
         )
+        self._replicas = [Replica(replica_url) for replica_url in replica_urls]
+        self._next_replica = itertools.count()
+        self._health_task: asyncio.Task | None = None
+
+    @property
+    def has_replicas(self) -> bool:
+        return bool(self._replicas)
+
+    def _read_session_maker(self, primary: bool) -> async_sessionmaker:
+        healthy = [replica for replica in self._replicas if replica.healthy]
+        if primary or not healthy:
+            return self._session_maker
+        return healthy[next(self._next_replica) % len(healthy)].session_maker
+
+    async def check_replicas(self) -> None:
+        """
+        Checks all replicas at the same time. Reads go only to the replicas found healthy,
+        and to the primary when there is none.
+
+        :return: None
+        """
+        await asyncio.gather(
+            *(replica.check(settings.db_replica_max_lag_seconds, settings.db_pool_timeout) for replica in self._replicas)
+        )
+
+    async def _watch_replicas(self) -> None:
+        while True:
+            await self.check_replicas()
+            await asyncio.sleep(settings.db_replica_check_seconds)
+
+    def start(self) -> None:
+        """
+        Starts the periodic health checks of the replicas, if there are any.
+
+        :return: None
+        """
+        if self._replicas and self._health_task is None:
+            self._health_task = asyncio.create_task(self._watch_replicas())
+
+    async def stop(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    async def warm_up(self, size: int) -> int:
+        """
+        Opens up to size connections to the primary and to every replica at the same time
+        and returns them to the pools, so the first requests after a start don't pay the connection setup.
+
+        :param size: The number of connections to open per engine, capped by the pool size.
+        :type size: int
+        :return: The number of connections opened.
+        :rtype: int
+        """
+        engines = [self._engine] + [replica.engine for replica in self._replicas]
+        engines = [engine for engine in engines if isinstance(engine.pool, TimedQueuePool)]
+
+        async def open_connection(engine: AsyncEngine):
+            connection = await engine.connect()
+            await connection.execute(text("SELECT 1"))
+            return connection
+
+        connections = await asyncio.gather(
+            *(open_connection(engine) for engine in engines for _ in range(min(size, engine.pool.size()))),
+            return_exceptions=True,
+        )
+        opened = [connection for connection in connections if not isinstance(connection, BaseException)]
+        for connection in opened:
+            await connection.close()
+        errors = [connection for connection in connections if isinstance(connection, BaseException)]
+        if errors:
+            raise errors[0]
+        return len(opened)
+
+    def pool_stats(self) -> dict:
+        """
+        Returns the statistics of the connection pool, or an empty dict if the pool doesn't collect them,
+        with the health, the replication lag and the pool statistics of every replica.
+
+        :return: The statistics of the pool.
+        :rtype: dict
+        """
+        pool = self._engine.pool
+        stats = pool.stats() if isinstance(pool, TimedQueuePool) else {}
+        if self._replicas:
+            stats["replicas"] = [
+                {
+                    "host": replica.engine.url.host,
+                    "healthy": replica.healthy,
+                    "lag_seconds": replica.lag_seconds,
+                    **(replica.engine.pool.stats() if isinstance(replica.engine.pool, TimedQueuePool) else {}),
+                }
+                for replica in self._replicas
+            ]
+        return stats
+
+    async def close(self) -> None:
+        """
+        Stops the replica health checks and closes all connections of the primary and the replicas.
+
+        :return: None
+        """
+        await self.stop()
+        if self._engine is not None:
+            await self._engine.dispose()
+        for replica in self._replicas:
+            await replica.engine.dispose()
 
     @contextlib.asynccontextmanager
     async def session(self) -> AsyncIterator[AsyncSession]:
@@ -61,13 +327,38 @@ class DatabaseSessionManager:
         try:
             yield session
         except Exception as err:
-            print(err)
+            logger.error(f"Error in session: {err}")
             await session.rollback()
+            raise
         finally:
             await session.close()
 
+    @contextlib.asynccontextmanager
+    async def read_session(self, primary: bool = False) -> AsyncIterator[AsyncSession]:
+        """
+        Provides an asynchronous context manager to yield a session for read-only queries.
+        The session is bound to one of the healthy replicas in turn, or to the primary
+        if primary is True or no replica is healthy.
+
+        :param primary: Read from the primary, e.g. right after the client wrote.
+        :type primary: bool
+        :return: An asynchronous database session.
+        :rtype: AsyncSession
+        """
+        if self._session_maker is None:
+            raise Exception("DatabaseSessionManager is not initialized")
+        session = self._read_session_maker(primary)()
+        try:
+            yield session
+        except Exception as err:
+            logger.error(f"Error in read session: {err}")
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
 
-sessionmanager = DatabaseSessionManager(settings.sqlalchemy_database_url)
+
+sessionmanager = DatabaseSessionManager(settings.sqlalchemy_database_url, settings.replica_database_urls)
 
 
 async def get_db():
@@ -83,3 +374,33 @@ async def get_db():
     """
     async with sessionmanager.session() as session:
         yield session
+
+
+async def get_read_db(request: Request):
+    """
+    Asynchronous generator function to get a database session for read-only routes.
+    It is bound to a healthy replica, unless the client wrote within the last
+    db_read_your_writes_seconds, in which case it is bound to the primary.
+
+    Yields:
+        AsyncSession: An asynchronous database session.
+    """
+    primary = True
+    if sessionmanager.has_replicas:
+        primary = await read_your_writes.is_pinned(read_your_writes.client_key(request.headers, request.client))
+    async with sessionmanager.read_session(primary) as session:
+        yield session
+
+
+def dialect_insert(db: AsyncSession, table: Table):
+    """
+    Returns an INSERT statement of the dialect of the session, which supports ON CONFLICT clauses.
+    PostgreSQL and SQLite are supported.
+
+    :param db: AsyncSession: The session the statement will be executed in
+    :param table: Table: The table to insert into
+    :return: A PostgreSQL or SQLite Insert
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
@@ -2,13 +2,15 @@ import enum
 from datetime import datetime, timedelta
 from typing import List
 
-from sqlalchemy import (Boolean, Column, DateTime, Enum, Float, Integer,
-                        String, Table, event, func)
+from sqlalchemy import (BigInteger, Boolean, Column, DateTime, Enum, Float,
+                        Index, Integer, String, Table, event, func)
 from sqlalchemy.ext.asyncio import AsyncAttrs
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, validates
 from sqlalchemy.sql.schema import ForeignKey
 
 from src.conf.constant import REFRESH_TOKEN_TTL
+from src.schemas.tags import normalize_tagname
 
 
 class Base(AsyncAttrs, DeclarativeBase):
@@ -44,6 +46,29 @@ picture_tags = Table(
     Base.metadata,
     Column("picture_id", Integer, ForeignKey("pictures.id", ondelete="CASCADE")),
     Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE")),
+    Index("ix_picture_tags_picture_id_tag_id", "picture_id", "tag_id", unique=True),
+    Index("ix_picture_tags_tag_id_picture_id", "tag_id", "picture_id"),
+)
+
+
+tag_cooccurrence = Table(
+    "tag_cooccurrence",
+    Base.metadata,
+    Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True),
+    Column("related_tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True),
+    Column("count", Integer, nullable=False, default=0),
+    Index("ix_tag_cooccurrence_tag_id_count", "tag_id", "count"),
+    Index("ix_tag_cooccurrence_related_tag_id", "related_tag_id"),
+)
+
+
+picture_lsh_buckets = Table(
+    "picture_lsh_buckets",
+    Base.metadata,
+    Column("picture_id", Integer, ForeignKey("pictures.id", ondelete="CASCADE"), primary_key=True),
+    Column("band", Integer, primary_key=True),
+    Column("bucket", BigInteger, nullable=False),
+    Index("ix_picture_lsh_buckets_band_bucket", "band", "bucket"),
 )
 
 
@@ -59,15 +84,21 @@ class User(Base, BaseWithTimestamps):
     roles: Mapped[Role] = mapped_column("roles", Enum(Role), default=Role.user)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
 
-    pictures: Mapped[list["Picture"]] = relationship("Picture", back_populates="user", cascade="all, delete")
-    comments_user: Mapped[list["Comment"]] = relationship("Comment", back_populates="user", cascade="all, delete")
-    ratings: Mapped[list["Rating"]] = relationship("Rating", back_populates="user")
+    pictures: Mapped[list["Picture"]] = relationship(
+        "Picture", back_populates="user", cascade="all, delete", passive_deletes=True
+    )
+    comments_user: Mapped[list["Comment"]] = relationship(
+        "Comment", back_populates="user", cascade="all, delete", passive_deletes=True
+    )
+    ratings: Mapped[list["Rating"]] = relationship("Rating", back_populates="user", passive_deletes=True)
 
 
 class Tag(Base, BaseWithTimestamps):
     __tablename__ = "tags"
+    __table_args__ = (Index("ix_tags_usage_count_id", "usage_count", "id"),)
 
-    tagname: Mapped[str] = mapped_column(String(50), nullable=False, unique=True)
+    tagname: Mapped[str] = mapped_column(String(50), nullable=False)
+    usage_count: Mapped[int] = mapped_column(Integer, default=0)
 
     pictures_teg: Mapped[List["Picture"]] = relationship(
         "Picture",
@@ -76,46 +107,102 @@ class Tag(Base, BaseWithTimestamps):
         passive_deletes=True,
     )
 
+    @validates("tagname")
+    def validate_tagname(self, key: str, tagname: str) -> str:
+        # NFKC can't be applied in SQL, so tagname holds the normalized name and the unique index
+        # on lower(tagname) can only be bypassed by core statements, which are given normalized names.
+        return normalize_tagname(tagname)
+
+    @hybrid_property
+    def normalized_tagname(self) -> str:
+        return self.tagname.lower()
+
+    @normalized_tagname.expression
+    def normalized_tagname(cls):
+        return func.lower(cls.tagname)
+
+
+Index("ix_tags_tagname_lower", func.lower(Tag.__table__.c.tagname), unique=True)
+
 
 class Comment(Base, BaseWithTimestamps):
     __tablename__ = "comments"
+    __table_args__ = (
+        Index("ix_comments_picture_id_created_at_id", "picture_id", "created_at", "id"),
+        Index("ix_comments_user_id", "user_id"),
+    )
 
     text: Mapped[str] = mapped_column(String(200), nullable=False)
     picture_id: Mapped[int] = mapped_column(Integer, ForeignKey("pictures.id", ondelete="CASCADE"), nullable=False)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    is_flagged: Mapped[bool] = mapped_column(Boolean, default=False)
+    is_hidden: Mapped[bool] = mapped_column(Boolean, default=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
 
     picture: Mapped["Picture"] = relationship("Picture", back_populates="comments_picture", lazy="joined")
     user: Mapped[int] = relationship("User", back_populates="comments_user", lazy="joined")
 
+    __mapper_args__ = {"version_id_col": version}
+
 
 class Picture(Base, BaseWithTimestamps):
     __tablename__ = "pictures"
+    __table_args__ = (Index("ix_pictures_user_id", "user_id"),)
 
     name: Mapped[str] = mapped_column(String(100), nullable=False)
     description: Mapped[str] = mapped_column(String(250), nullable=False)
     picture_url: Mapped[str] = mapped_column(String(200), nullable=False)
     rating_average: Mapped[float] = mapped_column(Float, default=0.0)
+    comments_count: Mapped[int] = mapped_column(Integer, default=0)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
 
     user: Mapped["User"] = relationship("User", back_populates="pictures", lazy="joined")
-    comments_picture: Mapped[list["Comment"]] = relationship("Comment", back_populates="picture", cascade="all, delete-orphan")
-    tags_picture: Mapped[List["Tag"]] = relationship("Tag", secondary=picture_tags, back_populates="pictures_teg")
-    ratings: Mapped["Rating"] = relationship("Rating", back_populates="picture", cascade="all, delete-orphan")
+    comments_picture: Mapped[list["Comment"]] = relationship(
+        "Comment", back_populates="picture", cascade="all, delete-orphan", passive_deletes=True
+    )
+    tags_picture: Mapped[List["Tag"]] = relationship(
+        "Tag", secondary=picture_tags, back_populates="pictures_teg", passive_deletes=True
+    )
+    ratings: Mapped["Rating"] = relationship(
+        "Rating", back_populates="picture", cascade="all, delete-orphan", passive_deletes=True
+    )
+
+    __mapper_args__ = {"version_id_col": version}
 
 
 class Rating(Base, BaseWithTimestamps):
     __tablename__ = "ratings"
+    __table_args__ = (
+        Index("ix_ratings_picture_id_user_id", "picture_id", "user_id"),
+        Index("ix_ratings_user_id", "user_id"),
+    )
 
     rating: Mapped[int] = mapped_column(Integer)
-    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"))
-    picture_id: Mapped[int] = mapped_column(Integer, ForeignKey("pictures.id"))
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    picture_id: Mapped[int] = mapped_column(Integer, ForeignKey("pictures.id", ondelete="CASCADE"))
 
     user: Mapped["User"] = relationship("User", back_populates="ratings", lazy="joined")
     picture: Mapped[int] = relationship("Picture", back_populates="ratings", lazy="joined")
 
 
+class PendingDeletion(Base, BaseWithTimestamps):
+    __tablename__ = "pending_deletions"
+    __table_args__ = (Index("ix_pending_deletions_next_attempt_at", "next_attempt_at"),)
+
+    url: Mapped[str] = mapped_column(String(255), nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    # Naive UTC, from the same clock as the claims and retries of the storage collector.
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_error: Mapped[str] = mapped_column(String(255), nullable=True)
+
+
 class InvalidToken(Base, BaseWithTimestamps):
     __tablename__ = "invalid_tokens"
+    __table_args__ = (
+        Index("ix_invalid_tokens_token", "token"),
+        Index("ix_invalid_tokens_created_at", "created_at"),
+    )
 
     token: Mapped[str] = mapped_column(String(250), nullable=False)
 
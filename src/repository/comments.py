@@ -1,66 +1,145 @@
+from datetime import datetime
 from typing import Sequence
-from sqlalchemy import select
+from sqlalchemy import Row, bindparam, delete, func, insert, select, tuple_, update
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import Comment, Picture
-from src.schemas.comments import CommentCreate, CommentUpdate
+from src.schemas.comments import CommentBulkAction, CommentBulkDelete, CommentCreate, CommentUpdate
 from fastapi import HTTPException, status
 from src.conf.messages import messages
+from src.services.events import event_broker, picture_channel
+from src.services.moderation import moderation_service
+from src.services import tracing
+from src.services.pagination import decode_cursor, encode_cursor, id_batches
+
+
+COMMENT_COLUMNS = (Comment.id, Comment.text, Comment.user_id, Comment.picture_id, Comment.version)
+
+
+def comment_event_data(comment: Comment | Row) -> dict:
+    return {"id": comment.id, "text": comment.text, "user_id": comment.user_id, "picture_id": comment.picture_id}
+
+
+async def change_comments_count(counts: dict[int, int], db: AsyncSession) -> None:
+    """
+    The change_comments_count function adds a delta to the comments_count of every given picture.
+    All pictures are changed by one executemany statement, in the transaction of the caller.
+
+    :param counts: dict[int, int]: The delta of comments_count by picture id
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    """
+    params = [{"b_picture_id": picture_id, "b_delta": delta} for picture_id, delta in counts.items() if delta]
+    if not params:
+        return
+    pictures = Picture.__table__
+    statement = (
+        update(pictures)
+        .where(pictures.c.id == bindparam("b_picture_id"))
+        .values(comments_count=pictures.c.comments_count + bindparam("b_delta"))
+    )
+    await db.execute(statement, params)
+
+
+async def recount_comments(batch_size: int, db: AsyncSession) -> int:
+    """
+    The recount_comments function sets the comments_count of every picture to its number of visible comments.
+    The pictures are walked by keyset on their id, batch_size pictures per UPDATE and per transaction,
+    so it can run on a live database. It repairs counters that drifted, or that predate the column.
+
+    :param batch_size: int: The number of pictures recounted per transaction
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The number of recounted pictures
+    """
+    visible = select(func.count()).where(Comment.picture_id == Picture.id, Comment.is_hidden.is_(False)).scalar_subquery()
+    recounted = 0
+    async for picture_ids in id_batches(Picture.id, batch_size, db):
+        await db.execute(
+            update(Picture).where(Picture.id.in_(picture_ids)).values(comments_count=visible)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        recounted += len(picture_ids)
+    return recounted
+
 
 async def create_comment(
     body: CommentCreate,
     picture_id,
     user_id,
     db: AsyncSession,
-) -> Comment:
+) -> Row:
     """
     The create_comment function creates a new comment in the database.
+    The text is checked against the moderation blocklist first: depending on the policy,
+    a comment with a blocked term is rejected or stored as flagged.
+    The INSERT returns the columns of the response, so the comment is not read back after the commit.
 
     :param body: CommentCreate: Validate the data sent to the api
     :param picture_id: Get the picture id from the database
     :param user_id: Identify the user who created the comment
     :param db: AsyncSession: Pass the database session to the function
     
-    :return: The newly created comment
+    :return: A row with the id, text, user_id and picture_id of the new comment
     """
 
-    new_comment = Comment(**body.model_dump(), picture_id=picture_id, user_id=user_id)
-    db.add(new_comment)
+    is_flagged = moderation_service.moderate(body.text)
+    statement = (
+        insert(Comment)
+        .values(**body.model_dump(), picture_id=picture_id, user_id=user_id, is_flagged=is_flagged, is_hidden=False)
+        .returning(*COMMENT_COLUMNS)
+    )
+    new_comment = (await db.execute(statement)).one()
+    await change_comments_count({picture_id: 1}, db)
     await db.commit()
-    await db.refresh(new_comment)
+    await event_broker.publish(picture_channel(picture_id), "comment_created", comment_event_data(new_comment))
     return new_comment
 
 
-async def update_comment(picture_id: int, comment_id: int, body: CommentUpdate, current_user: int, db: AsyncSession) -> Comment:
+async def update_comment(
+    picture_id: int, comment_id: int, body: CommentUpdate, current_user: int, db: AsyncSession, versions: list[int] | None = None
+) -> Row:
     """
     Update a comment in the database.
 
     This function updates a comment in the database with the provided comment_id and new text from the CommentUpdate object.
     It checks if the current user is authorized to update the comment by comparing the user_id.
+    The new text goes through the same moderation check as a new comment.
+    The check and the change are one UPDATE ... RETURNING statement: no row returned means
+    there is no such comment of the user to the picture, or, with versions, that it was changed since the client read it.
+    Every change increases the version of the comment.
 
     :param picture_id: int: The ID of the picture associated with the comment.
     :param comment_id: int: The ID of the comment to update.
     :param body: CommentUpdate: The updated comment text from the request body.
     :param current_user: int: The user_id of the current user.
     :param db: AsyncSession: The database session.
+    :param versions: list[int] | None: The versions accepted by the If-Match header, or None to change any version.
 
-    :return: Comment: The updated comment object.
+    :return: Row: The id, text, user_id, picture_id and version of the updated comment.
     """
 
-    comment_query = select(Comment).join(Picture).where(Comment.id == comment_id, Picture.id == picture_id, Comment.user_id == current_user)
-    existing_comment = await db.execute(comment_query)
-    comment = existing_comment.scalar()
-    if not comment:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("COMMENT_NOT_FOUND"))
-
     if body.text == "":
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=messages.get_message("COMMENT_CANT_BE_EMPTY"))
 
-    comment.text = body.text
-    db.add(comment)
+    conditions = [Comment.id == comment_id, Comment.picture_id == picture_id, Comment.user_id == current_user]
+    if versions is not None:
+        conditions.append(Comment.version.in_(versions))
+    statement = (
+        update(Comment)
+        .where(*conditions)
+        .values(text=body.text, is_flagged=moderation_service.moderate(body.text), version=Comment.version + 1)
+        .returning(*COMMENT_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    comment = (await db.execute(statement)).first()
+    if comment is None:
+        if versions is not None and await db.scalar(select(Comment.id).where(*conditions[:3])) is not None:
+            raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail=messages.get_message("RESOURCE_WAS_MODIFIED"))
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("COMMENT_NOT_FOUND"))
     await db.commit()
-    await db.refresh(comment)
+    await event_broker.publish(picture_channel(picture_id), "comment_updated", comment_event_data(comment))
     return comment
 
 
@@ -79,30 +158,115 @@ async def delete_comment(comment_id: int, picture_id: int, db: AsyncSession) ->
     if not comment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("COMMENT_NOT_FOUND"))
     try:
+        if not comment.is_hidden:
+            await change_comments_count({picture_id: -1}, db)
         await db.delete(comment)
         await db.commit()
-        return comment
     except Exception as error:
         await db.rollback()
         raise error
+    await event_broker.publish(picture_channel(picture_id), "comment_deleted", {"id": comment_id, "picture_id": picture_id})
+    return comment
 
 
-async def get_comments_to_picture(skip: int, limit: int, picture_id: int, db: AsyncSession) -> Sequence[Comment]:
+async def get_comments_to_picture(limit: int, cursor: str | None, picture_id: int, db: AsyncSession) -> tuple[Sequence[Row], str | None]:
     """
-    The get_comments_to_picture function returns a list of comments to the picture with id = picture_id.
-    The function takes three arguments: skip, limit and picture_id.
-    Skip is an integer that indicates how many comments should be skipped before returning the result.
-    Limit is an integer that indicates how many comments should be returned in total (after skipping).
-    Picture_id is an integer that represents the id of a particular picture.
+    The get_comments_to_picture function returns one page of comments to the picture with id = picture_id.
+    Comments are ordered by (created_at, id) and paged with a keyset instead of OFFSET, so the
+    ix_comments_picture_id_created_at_id index serves every page at the same cost as the first one.
+    Only the columns needed by CommentDB are selected, so the joined picture and user relationships are never loaded.
 
-    :param skip: int: Skip the first n comments
     :param limit: int: Limit the number of comments returned
+    :param cursor: str | None: The next_cursor of the previous page, or None for the first page
     :param picture_id: int: Get comments to a specific picture
     :param db: AsyncSession: Pass the database session to the function
-    :return: A list of comments
+    :return: A list of comment rows and the cursor of the next page, or None if this is the last page
     """
 
-    query = select(Comment).where(Comment.picture_id == picture_id).offset(skip).limit(limit)
+    query = (
+        select(Comment.id, Comment.text, Comment.user_id, Comment.version, Comment.created_at)
+        .where(Comment.picture_id == picture_id, Comment.is_hidden.is_(False))
+        .order_by(Comment.created_at, Comment.id)
+        .limit(limit + 1)
+    )
+    if cursor:
+        created_at, comment_id = decode_cursor(cursor, datetime, int)
+        query = query.where(tuple_(Comment.created_at, Comment.id) > tuple_(created_at, comment_id))
+
     comments = await db.execute(query)
-    result = comments.scalars().all()
-    return result
+    result = comments.all()
+
+    next_cursor = None
+    if len(result) > limit:
+        result = result[:limit]
+        next_cursor = encode_cursor(result[-1].created_at, result[-1].id)
+    return result, next_cursor
+
+
+async def bulk_delete_comments(body: CommentBulkDelete, db: AsyncSession) -> dict:
+    """
+    The bulk_delete_comments function deletes or hides every comment matching the filters of the body.
+    The comments are never loaded: each batch is a single DELETE ... RETURNING (or UPDATE ... RETURNING for hide)
+    of at most batch_size rows. The comments_count of the affected pictures is decreased by the number of removed
+    visible comments in the same transaction, and every batch is committed on its own, as delete_user does,
+    so no lock is held for the whole run. The events of a batch are published once it is committed,
+    so no event carries more than batch_size ids.
+
+    :param body: CommentBulkDelete: The filters, the action and the batch size
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A summary with the number of changed comments, batches and pictures
+    """
+    conditions = []
+    if body.user_id is not None:
+        conditions.append(Comment.user_id == body.user_id)
+    if body.picture_id is not None:
+        conditions.append(Comment.picture_id == body.picture_id)
+    if body.created_after is not None:
+        conditions.append(Comment.created_at >= body.created_after)
+    if body.created_before is not None:
+        conditions.append(Comment.created_at < body.created_before)
+    if body.text_pattern is not None:
+        conditions.append(Comment.text.ilike(body.text_pattern))
+    if body.flagged is not None:
+        conditions.append(Comment.is_flagged.is_(body.flagged))
+    if body.action == CommentBulkAction.hide:
+        conditions.append(Comment.is_hidden.is_(False))
+
+    batch = select(Comment.id).where(*conditions).limit(body.batch_size).scalar_subquery()
+    if body.action == CommentBulkAction.delete:
+        statement = delete(Comment).where(Comment.id.in_(batch))
+    else:
+        statement = update(Comment).where(Comment.id.in_(batch)).values(is_hidden=True)
+    statement = statement.returning(Comment.id, Comment.picture_id, Comment.is_hidden).execution_options(synchronize_session=False)
+
+    event = "comments_deleted" if body.action == CommentBulkAction.delete else "comments_hidden"
+    pictures: set[int] = set()
+    affected = batches = 0
+    while True:
+        try:
+            rows = (await db.execute(statement)).all()
+            changed: dict[int, list[int]] = {}
+            counts: dict[int, int] = {}
+            for row in rows:
+                changed.setdefault(row.picture_id, []).append(row.id)
+                if body.action == CommentBulkAction.hide or not row.is_hidden:
+                    counts[row.picture_id] = counts.get(row.picture_id, 0) - 1
+            await change_comments_count(counts, db)
+            await db.commit()
+        except Exception as error:
+            await db.rollback()
+            raise error
+        if not rows:
+            break
+        batches += 1
+        affected += len(rows)
+        pictures.update(changed)
+        for picture_id, comment_ids in changed.items():
+            await event_broker.publish(picture_channel(picture_id), event, {"ids": comment_ids, "picture_id": picture_id})
+        if len(rows) < body.batch_size:
+            break
+
+    return {"action": body.action, "affected": affected, "batches": batches, "pictures": len(pictures)}
+
+
+tracing.instrument_module(__name__)
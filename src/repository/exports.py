@@ -0,0 +1,77 @@
+from typing import AsyncIterator, Sequence
+
+from sqlalchemy import Row, Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import Comment, Picture, User
+from src.schemas.exports import ExportKind
+from src.services import tracing
+
+EXPORT_COLUMNS = {
+    ExportKind.pictures: (
+        Picture.id,
+        Picture.name,
+        Picture.description,
+        Picture.picture_url,
+        Picture.rating_average,
+        Picture.comments_count,
+        Picture.user_id,
+        Picture.created_at,
+    ),
+    ExportKind.comments: (
+        Comment.id,
+        Comment.picture_id,
+        Comment.user_id,
+        Comment.text,
+        Comment.is_flagged,
+        Comment.is_hidden,
+        Comment.created_at,
+    ),
+    ExportKind.users: (
+        User.id,
+        User.username,
+        User.email,
+        User.roles,
+        User.confirmed,
+        User.is_active,
+        User.created_at,
+    ),
+}
+
+
+def export_columns(kind: ExportKind) -> list[str]:
+    return [column.key for column in EXPORT_COLUMNS[kind]]
+
+
+def export_query(kind: ExportKind) -> Select:
+    """
+    The export_query function selects the exported columns of every row of a table, in primary key order.
+    Only plain columns are selected: no entity is built and no relationship is loaded.
+
+    :param kind: ExportKind: The table to export
+    :return: The select statement
+    """
+    columns = EXPORT_COLUMNS[kind]
+    return select(*columns).order_by(columns[0])
+
+
+async def stream_export(kind: ExportKind, batch_size: int, db: AsyncSession) -> AsyncIterator[Sequence[Row]]:
+    """
+    The stream_export function reads an export through a server-side cursor and yields it batch by batch,
+    so at most batch_size rows are held in memory whatever the size of the table.
+    The cursor is closed when the iteration ends, fails or is cancelled, e.g. when the client disconnects.
+
+    :param kind: ExportKind: The table to export
+    :param batch_size: int: The number of rows fetched from the cursor at a time
+    :param db: AsyncSession: Pass the database session to the function
+    :return: An async iterator over lists of rows
+    """
+    result = await db.stream(export_query(kind).execution_options(yield_per=batch_size))
+    try:
+        async for partition in result.partitions():
+            yield partition
+    finally:
+        await result.close()
+
+
+tracing.instrument_module(__name__)
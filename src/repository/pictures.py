@@ -1,21 +1,39 @@
+import asyncio
 from typing import Sequence
 
 from fastapi import HTTPException, status
-from sqlalchemy import join, outerjoin, select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import Integer, Row, and_, delete, func, insert, join, literal, outerjoin, select, true, update
+from sqlalchemy.orm import noload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.models import Picture, Role, Tag, User, picture_tags
+from src.database.models import (Comment, PendingDeletion, Picture, Role, Tag,
+                                 User, picture_lsh_buckets, picture_tags)
+from src.database.db import dialect_insert
+from src.repository.tags import (change_cooccurrence,
+                                 change_cooccurrence_pairs,
+                                 change_usage_count, save_picture_buckets)
 from src.schemas.filters import PictureFilter
 from src.schemas.pictures import (PictureDescrUpdate, PictureNameUpdate,
                                   PictureUpload)
+from src.schemas.tags import normalize_tagname
+from src.services import tracing
+from src.services.minhash import jaccard
 from src.services.qrcode_generator import qrcode_generator
+from src.services.tag_index import tag_index
 from src.conf.messages import messages
 
+PICTURE_COLUMNS = (Picture.id, Picture.name, Picture.description, Picture.picture_url, Picture.user_id, Picture.version)
+
 
 async def save_data_of_picture_to_db(body: PictureUpload, picture_url: str, user: User, db: AsyncSession, tag_names: list):
     """
     The save_data_of_picture_to_db function saves the data of a picture to the database.
+    Tags known to the tag index are linked by id without querying the tags table: one INSERT ... SELECT
+    links only the ids still present in it, so an id the index kept for a deleted tag is never inserted.
+    Such a stale id is dropped from the index and its name is resolved again from the database, like the names
+    unknown to the index, which go through get_or_create_tag. The usage_count and co-occurrence counts of the tags
+    are increased, and the LSH buckets of the picture are stored for similar picture queries.
 
     :param body: PictureUpload: Get the name and description of the picture
     :param picture_url: str: Save the url of the picture in the database
@@ -24,46 +42,209 @@ async def save_data_of_picture_to_db(body: PictureUpload, picture_url: str, user
     :param db: AsyncSession: Make sure that the function is able to access the database
     :return: A picture object
     """
-    tags = []
+    known: dict[int, str] = {}
+    created_ids = []
     if tag_names:
-        for tag_name in tag_names:
-            tag = await get_or_create_tag(db, tag_name)
-            tags.append(tag)
-
-    picture_data = Picture(
-        name=body.name, description=body.description, picture_url=picture_url, user_id=user.id, tags_picture=tags
-    )
+        await tag_index.ensure_loaded(db)
+        for tag_name in {normalize_tagname(tag_name) for tag_name in tag_names}:
+            tag_id = tag_index.get_id(tag_name)
+            if tag_id is None:
+                tag = await get_or_create_tag(db, tag_name)
+                created_ids.append(tag.id)
+            else:
+                known[tag_id] = tag_name
+
+    picture_data = Picture(name=body.name, description=body.description, picture_url=picture_url, user_id=user.id)
     db.add(picture_data)
+    await db.flush()
+    linked_ids, stale, found = [], [], []
+    if known:
+        existing = select(literal(picture_data.id, Integer), Tag.id).where(Tag.id.in_(known))
+        statement = insert(picture_tags).from_select(["picture_id", "tag_id"], existing).returning(picture_tags.c.tag_id)
+        linked_ids = (await db.execute(statement)).scalars().all()
+        stale = [tag_id for tag_id in known if tag_id not in set(linked_ids)]
+        for tag_id in stale:
+            tag = await find_or_add_tag(db, known[tag_id])
+            found.append((tag.id, tag.tagname))
+    new_ids = list(dict.fromkeys(created_ids + [tag_id for tag_id, _ in found]))
+    if new_ids:
+        await db.execute(insert(picture_tags), [{"picture_id": picture_data.id, "tag_id": tag_id} for tag_id in new_ids])
+    tag_ids = list(dict.fromkeys([*linked_ids, *new_ids]))
+    if tag_ids:
+        await change_usage_count({tag_id: 1 for tag_id in tag_ids}, db)
+        await change_cooccurrence(tag_ids, 1, db)
+        await save_picture_buckets({picture_data.id: tag_ids}, db)
     await db.commit()
     await db.refresh(picture_data)
+    for tag_id in stale:
+        await tag_index.publish("tag_deleted", tag_id)
+    for tag_id, tagname in found:
+        await tag_index.publish("tag_created", tag_id, tagname)
+    tag_index.use(tag_ids)
 
     return picture_data
 
 
+async def find_or_add_tag(db: AsyncSession, tag_name: str) -> Tag:
+    """
+    The find_or_add_tag function returns the tag with the normalized name, adding it to the session if there is none.
+    The new tag is flushed to get its id but not committed, so it belongs to the transaction of the caller.
+
+    :param db: AsyncSession: Pass in the database connection
+    :param tag_name: str: The normalized name of the tag
+    :return: A tag object
+    """
+    tag = (await db.execute(select(Tag).where(Tag.normalized_tagname == tag_name))).scalar_one_or_none()
+    if not tag:
+        tag = Tag(tagname=tag_name)
+        db.add(tag)
+        await db.flush()
+    return tag
+
+
 async def get_or_create_tag(db: AsyncSession, tag_name: str) -> Tag:
     """
     The get_or_create_tag function takes a database session and a tag name as arguments.
     It then queries the database for an existing tag with that name, returning it if found.
-    If no such tag exists, it creates one and returns that instead.
+    If no such tag exists, it creates one and returns that instead. The name is normalized first.
+    Either way the tag is added to the tag index of every worker.
 
     :param db: AsyncSession: Pass in the database connection
     :param tag_name: str: Specify the name of the tag that we want to create or retrieve
     :return: A tag object
     """
-    query = select(Tag).where(Tag.tagname == tag_name)
-    existing_tag = await db.execute(query)
-    tag = existing_tag.scalar_one_or_none()
+    tag = await find_or_add_tag(db, normalize_tagname(tag_name))
+    await db.commit()
+    await tag_index.publish("tag_created", tag.id, tag.tagname)
+    return tag
 
-    if not tag:
-        tag = Tag(tagname=tag_name)
-        db.add(tag)
-        await db.commit()
-        return tag
 
-    return tag
+async def bulk_update_picture_tags(
+    picture_ids: list[int], add: list[str], remove: list[str], current_user: User, db: AsyncSession
+) -> dict:
+    """
+    The bulk_update_picture_tags function adds tags to and removes tags from many pictures at once.
+    Users may only change their own pictures, moderators and administrators any picture; this is checked
+    by one query for all pictures. The current tags of all pictures are read by one query as well, so the limit
+    of 5 tags per picture and the changes of the counters are computed without touching picture_tags again.
+    The links are changed by one DELETE and one INSERT ... SELECT, and everything is committed together.
+
+    :param picture_ids: list[int]: The ids of the pictures to change
+    :param add: list[str]: The normalized names of the tags to add; missing tags are created
+    :param remove: list[str]: The normalized names of the tags to remove
+    :param current_user: User: The user changing the pictures
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A dict with the number of changed pictures, added links and removed links
+    """
+    picture_ids = set(picture_ids)
+    query = select(Picture.id).where(Picture.id.in_(picture_ids))
+    if current_user.roles not in (Role.admin, Role.moderator):
+        query = query.where(Picture.user_id == current_user.id)
+    allowed = set((await db.execute(query)).scalars().all())
+    if allowed != picture_ids:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("PICTURE_NOT_FOUND"))
+
+    names = set(add) | set(remove)
+    tags = {normalize_tagname(row.tagname): row.id for row in await db.execute(select(Tag.id, Tag.tagname).where(Tag.normalized_tagname.in_(names)))}
+    created = [Tag(tagname=name) for name in set(add) - set(tags)]
+    if created:
+        db.add_all(created)
+        await db.flush()
+        tags.update({tag.tagname: tag.id for tag in created})
+    add_ids = {tags[name] for name in add}
+    remove_ids = {tags[name] for name in remove if name in tags} - add_ids
+
+    old_tags = {picture_id: set() for picture_id in picture_ids}
+    for picture_id, tag_id in await db.execute(
+        select(picture_tags.c.picture_id, picture_tags.c.tag_id).where(picture_tags.c.picture_id.in_(picture_ids))
+    ):
+        old_tags[picture_id].add(tag_id)
+    new_tags = {picture_id: (tag_ids - remove_ids) | add_ids for picture_id, tag_ids in old_tags.items()}
+    if any(len(tag_ids) > 5 for tag_ids in new_tags.values()):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=messages.get_message("THE_NUMBER_OF_TAGS_SHOULD_NOT_EXCEED_5"))
+
+    usage = {}
+    pairs = {}
+    changed = {}
+    for picture_id in picture_ids:
+        old, new = old_tags[picture_id], new_tags[picture_id]
+        if old == new:
+            continue
+        changed[picture_id] = list(new)
+        for tag_id in new - old:
+            usage[tag_id] = usage.get(tag_id, 0) + 1
+        for tag_id in old - new:
+            usage[tag_id] = usage.get(tag_id, 0) - 1
+        for tag_ids, delta in ((old, -1), (new, 1)):
+            for pair in ((tag_id, related) for tag_id in tag_ids for related in tag_ids if tag_id != related):
+                pairs[pair] = pairs.get(pair, 0) + delta
+
+    if remove_ids:
+        await db.execute(
+            delete(picture_tags).where(picture_tags.c.picture_id.in_(picture_ids), picture_tags.c.tag_id.in_(remove_ids))
+        )
+    if add_ids:
+        links = select(Picture.id, Tag.id).join_from(Picture, Tag, true()).where(Picture.id.in_(picture_ids), Tag.id.in_(add_ids))
+        await db.execute(
+            dialect_insert(db, picture_tags)
+            .from_select(["picture_id", "tag_id"], links)
+            .on_conflict_do_nothing(index_elements=[picture_tags.c.picture_id, picture_tags.c.tag_id])
+        )
+    await change_usage_count(usage, db)
+    await change_cooccurrence_pairs({pair: delta for pair, delta in pairs.items() if delta}, db)
+    await save_picture_buckets(changed, db)
+    await db.commit()
+
+    for tag in created:
+        await tag_index.publish("tag_created", tag.id, tag.tagname)
+    for tag_id, delta in usage.items():
+        tag_index.use([tag_id], count=delta)
+    return {
+        "pictures": len(changed),
+        "added": sum(len(new_tags[picture_id] - old_tags[picture_id]) for picture_id in changed),
+        "removed": sum(len(old_tags[picture_id] - new_tags[picture_id]) for picture_id in changed),
+    }
 
 
-async def update_picture_name(id: int, body: PictureNameUpdate, current_user: int, db: AsyncSession) -> Picture:
+async def update_picture_columns(
+    id: int, values: dict, current_user: int, db: AsyncSession, versions: list[int] | None = None
+) -> Row:
+    """
+    The update_picture_columns function changes the given columns of a picture of the current user
+    with one UPDATE ... RETURNING statement and commits. The statement returns the columns of PictureDB,
+    so the picture is not read before the change nor refreshed after it.
+    Every change increases the version of the picture. With versions, the change is made only if the picture
+    is still at one of them, which is checked in the same statement, so no lock is held between reading and writing.
+
+    :param id: int: The id of the picture
+    :param values: dict: The new values by column name
+    :param current_user: int: The id of the user, who must own the picture
+    :param db: AsyncSession: Access the database
+    :param versions: list[int] | None: The versions the client has seen, from If-Match, or None to change any version
+    :return: A row with the id, name, description, picture_url, user_id and version of the picture
+    """
+    conditions = [Picture.id == id, Picture.user_id == current_user]
+    if versions is not None:
+        conditions.append(Picture.version.in_(versions))
+    statement = (
+        update(Picture)
+        .where(*conditions)
+        .values(**values, version=Picture.version + 1)
+        .returning(*PICTURE_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    picture = (await db.execute(statement)).first()
+    if picture is None:
+        if versions is not None and await db.scalar(select(Picture.id).where(*conditions[:2])) is not None:
+            raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail=messages.get_message("RESOURCE_WAS_MODIFIED"))
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("PICTURE_NOT_FOUND"))
+    await db.commit()
+    return picture
+
+
+async def update_picture_name(
+    id: int, body: PictureNameUpdate, current_user: int, db: AsyncSession, versions: list[int] | None = None
+) -> Row:
     """
     The update_picture_name function updates the name of a picture.
         Args:
@@ -74,29 +255,21 @@ async def update_picture_name(id: int, body: PictureNameUpdate, current_user: in
     :param body: PictureNameUpdate: Update the name of a picture
     :param current_user: int: Check if the user is authorized to delete a picture
     :param db: AsyncSession: Access the database
-    :return: The updated picture name
+    :param versions: list[int] | None: The versions accepted by the If-Match header, if any
+    :return: The updated picture
     """
 
-    picture_query = select(Picture).where(Picture.id == id, Picture.user_id == current_user)
-    existing_name = await db.execute(picture_query)
-    picture_name = existing_name.scalar()
-    if not picture_name:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("PICTURE_NOT_FOUND"))
-
     if body.name == "":
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=messages.get_message("NAME_OF_PICTURE_CANT_BE_EMPTY"),
         )
-
-    picture_name.name = body.name
-    db.add(picture_name)
-    await db.commit()
-    await db.refresh(picture_name)
-    return picture_name
+    return await update_picture_columns(id, {"name": body.name}, current_user, db, versions)
 
 
-async def update_picture_description(id: int, body: PictureDescrUpdate, current_user: int, db: AsyncSession) -> Picture:
+async def update_picture_description(
+    id: int, body: PictureDescrUpdate, current_user: int, db: AsyncSession, versions: list[int] | None = None
+) -> Row:
     """
     The update_picture_description function updates the description of a picture.
 
@@ -104,26 +277,16 @@ async def update_picture_description(id: int, body: PictureDescrUpdate, current_
     :param body: PictureDescrUpdate: Get the new description of picture
     :param current_user: int: Check that the user is authorized to make changes
     :param db: AsyncSession: Access the database
+    :param versions: list[int] | None: The versions accepted by the If-Match header, if any
     :return: The updated picture
     """
 
-    picture_query = select(Picture).where(Picture.id == id, Picture.user_id == current_user)
-    existing_descr = await db.execute(picture_query)
-    picture_descr = existing_descr.scalar()
-    if not picture_descr:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("PICTURE_NOT_FOUND"))
-
     if body.description == "":
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=messages.get_message("DESCRIPTION_OF_PICTURE_CANT_BE_EMPTY"),
         )
-
-    picture_descr.description = body.description
-    db.add(picture_descr)
-    await db.commit()
-    await db.refresh(picture_descr)
-    return picture_descr
+    return await update_picture_columns(id, {"description": body.description}, current_user, db, versions)
 
 
 async def get_picture_by_id(id: int, db: AsyncSession) -> Sequence[Picture]:
@@ -147,6 +310,8 @@ async def remove_picture(picture_id: int, current_user: User, db: AsyncSession):
     The remove_picture function is used to remove a picture from the database.
     It takes in a picture_id and current_user as parameters, and returns the removed
     picture if successful. If not successful, it returns None.
+    The usage_count and co-occurrence counts of the tags of the picture are decreased,
+    its LSH buckets are removed and its asset is queued for deletion from storage in the same transaction.
 
     :param picture_id: int: Identify the picture to be removed
     :param current_user: User: Check if the user is an admin or not
@@ -162,8 +327,15 @@ async def remove_picture(picture_id: int, current_user: User, db: AsyncSession):
         return None
 
     if current_user.roles == Role.admin or result.user_id == current_user.id:
+        tags = await db.execute(select(picture_tags.c.tag_id).where(picture_tags.c.picture_id == picture_id))
+        tag_ids = tags.scalars().all()
+        await change_usage_count({tag_id: -1 for tag_id in tag_ids}, db)
+        await change_cooccurrence(tag_ids, -1, db)
+        await db.execute(delete(picture_lsh_buckets).where(picture_lsh_buckets.c.picture_id == picture_id))
+        db.add(PendingDeletion(url=result.picture_url))
         await db.delete(result)
         await db.commit()
+        tag_index.use(tag_ids, count=-1)
         return result
     else:
         return None
@@ -173,6 +345,7 @@ async def get_qrcode(picture_id: int, db: AsyncSession):
     """
     The get_qrcode function takes in a picture_id and returns the qrcode for that picture.
         If no such picture exists, it returns None.
+        The picture is fetched in a thread, so the event loop keeps serving other requests meanwhile.
 
     :param picture_id: int: Specify the id of the picture
     :param db: AsyncSession: Pass the database session into the function
@@ -186,7 +359,7 @@ async def get_qrcode(picture_id: int, db: AsyncSession):
     if result is None:
         return None
 
-    return qrcode_generator.generate_qrcode(result.picture_url)
+    return await asyncio.to_thread(qrcode_generator.generate_qrcode, result.picture_url)
 
 
 async def retrieve_tags_for_picture(picture_id: int, db: AsyncSession):
@@ -206,15 +379,50 @@ async def retrieve_tags_for_picture(picture_id: int, db: AsyncSession):
         
     return tags
 
-async def search_pictures(picture_filter: PictureFilter, db: AsyncSession):
+async def get_comments_preview(picture_ids: list[int], size: int, db: AsyncSession) -> dict[int, list[Comment]]:
+    """
+    The get_comments_preview function returns the latest comments of every given picture.
+    A single query ranks the comments of each picture with a row_number() window function and keeps the first ones,
+    so the work depends on the number of pictures and the preview size, not on the number of comments.
+
+    :param picture_ids: list[int]: The ids of the pictures
+    :param size: int: The maximum number of comments per picture
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A dict with the list of the latest comments by picture id
+    """
+    previews: dict[int, list[Comment]] = {picture_id: [] for picture_id in picture_ids}
+    if size <= 0 or not picture_ids:
+        return previews
+
+    position = func.row_number().over(partition_by=Comment.picture_id, order_by=(Comment.created_at.desc(), Comment.id.desc()))
+    ranked = (
+        select(Comment.id, Comment.text, Comment.picture_id, position.label("position"))
+        .where(Comment.picture_id.in_(picture_ids), Comment.is_hidden.is_(False))
+        .subquery()
+    )
+    query = (
+        select(ranked.c.id, ranked.c.text, ranked.c.picture_id)
+        .where(ranked.c.position <= size)
+        .order_by(ranked.c.picture_id, ranked.c.position)
+    )
+    result = await db.execute(query)
+    for row in result:
+        previews[row.picture_id].append(Comment(id=row.id, text=row.text, picture_id=row.picture_id))
+    return previews
+
+
+async def search_pictures(picture_filter: PictureFilter, comments_preview: int, db: AsyncSession):
     """
     The search_pictures function takes a PictureFilter object and an AsyncSession object as arguments.
-    The function then creates a query that selects all pictures, joins them with their tags, and loads the comments_picture,
-    tags_picture, and ratings attributes of each picture. The query is then filtered by the filter method of the PictureFilter
+    The function then creates a query that selects all pictures, joins them with their tags and loads the tags_picture
+    attribute of each picture. The query is then filtered by the filter method of the PictureFilter
     object passed to it as an argument. Finally, the sort method of this same PictureFilter object is called on this query to
     sort it in some way (if applicable). The result is returned.
+    Comments are not loaded with the pictures: each picture carries its comments_count, and comments_picture
+    holds only the latest comments_preview comments, fetched by get_comments_preview.
 
     :param picture_filter: PictureFilter: Filter the pictures
+    :param comments_preview: int: The number of the latest comments to return with each picture
     :param db: AsyncSession: Pass the database session to the function
     :return: A list of picture objects
     """
@@ -222,12 +430,63 @@ async def search_pictures(picture_filter: PictureFilter, db: AsyncSession):
     query = (
         select(Picture)
         .select_from(outerjoin(Picture, picture_tags.join(Tag)))
-        .options(selectinload(Picture.comments_picture))
+        .options(noload(Picture.comments_picture))
         .options(selectinload(Picture.tags_picture))
-        .options(selectinload(Picture.ratings))
+        .options(noload(Picture.ratings))
     )
 
     query = picture_filter.filter(query)
     query = picture_filter.sort(query)
     result = (await db.execute(query)).unique()
-    return result.scalars().all()
\ No newline at end of file
+    pictures = result.scalars().all()
+
+    previews = await get_comments_preview([picture.id for picture in pictures], comments_preview, db)
+    for picture in pictures:
+        set_committed_value(picture, "comments_picture", previews[picture.id])
+    return pictures
+
+
+async def get_similar_pictures(picture_id: int, limit: int, db: AsyncSession) -> list[Picture]:
+    """
+    The get_similar_pictures function returns the pictures whose tags are most similar to the tags of the given picture.
+    Candidates are the pictures sharing at least one LSH band bucket with it, found through the (band, bucket) index,
+    so the pictures table is never scanned. The candidates with the most shared bands are ranked by the exact
+    Jaccard similarity of their tag sets.
+
+    :param picture_id: int: The id of the picture
+    :param limit: int: The maximum number of similar pictures
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A list of pictures with their tags, the most similar first
+    """
+    own = select(picture_lsh_buckets.c.band, picture_lsh_buckets.c.bucket).where(
+        picture_lsh_buckets.c.picture_id == picture_id
+    ).subquery()
+    shared = func.count().label("shared")
+    candidates = (
+        select(picture_lsh_buckets.c.picture_id, shared)
+        .join(own, and_(picture_lsh_buckets.c.band == own.c.band, picture_lsh_buckets.c.bucket == own.c.bucket))
+        .where(picture_lsh_buckets.c.picture_id != picture_id)
+        .group_by(picture_lsh_buckets.c.picture_id)
+        .order_by(shared.desc(), picture_lsh_buckets.c.picture_id.desc())
+        .limit(limit * 3)
+    )
+    shared_bands = {row.picture_id: row.shared for row in await db.execute(candidates)}
+    if not shared_bands:
+        return []
+
+    tag_ids = (await db.execute(select(picture_tags.c.tag_id).where(picture_tags.c.picture_id == picture_id))).scalars().all()
+    query = (
+        select(Picture)
+        .where(Picture.id.in_(shared_bands))
+        .options(noload(Picture.comments_picture), noload(Picture.ratings), selectinload(Picture.tags_picture))
+    )
+    pictures = (await db.execute(query)).unique().scalars().all()
+    pictures = sorted(
+        pictures,
+        key=lambda picture: (jaccard(tag_ids, [tag.id for tag in picture.tags_picture]), shared_bands[picture.id], picture.id),
+        reverse=True,
+    )
+    return pictures[:limit]
+
+
+tracing.instrument_module(__name__)
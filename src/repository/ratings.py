@@ -1,9 +1,11 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
-from sqlalchemy import func, select
+from sqlalchemy import func, select, update
 
 from src.database.models import User, Rating, Picture
 from src.conf.messages import messages
+from src.services import tracing
+from src.services.events import event_broker, picture_channel
 
 
 async def create_picture_rating(
@@ -43,9 +45,20 @@ async def create_picture_rating(
 
     average_rating = await calculate_average_rating(picture_id, db)
     if average_rating:
-        picture.rating_average = average_rating
+        # Not through the ORM, so a rating does not bump the version of the picture and never conflicts with its editors.
+        await db.execute(
+            update(Picture)
+            .where(Picture.id == picture_id)
+            .values(rating_average=average_rating)
+            .execution_options(synchronize_session=False)
+        )
         await db.commit()
 
+    await event_broker.publish(
+        picture_channel(picture_id),
+        "rating_created",
+        {"id": new_rating.id, "rating": new_rating.rating, "user_id": new_rating.user_id, "rating_average": average_rating or picture.rating_average},
+    )
     return new_rating
 
 
@@ -103,3 +116,6 @@ async def remove_rating(
     await db.delete(rating)
     await db.commit()
     return rating
+
+
+tracing.instrument_module(__name__)
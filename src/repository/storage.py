@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Sequence
+
+from sqlalchemy import Row, bindparam, delete, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import PendingDeletion, Picture, User
+from src.services import tracing
+from src.services.cloud_picture import CloudPicture
+
+
+async def enqueue_deletions(urls: list[str], db: AsyncSession) -> None:
+    """
+    The enqueue_deletions function queues the assets at the given urls for removal from storage.
+    Nothing is committed: the caller commits the queue rows with the change that made the assets unused.
+
+    :param urls: list[str]: The urls of the assets
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    """
+    if urls:
+        await db.execute(insert(PendingDeletion), [{"url": url} for url in urls])
+
+
+async def claim_deletions(batch_size: int, lease_seconds: float, max_attempts: int, db: AsyncSession) -> Sequence[Row]:
+    """
+    The claim_deletions function takes at most batch_size due rows of the queue with one UPDATE ... RETURNING and commits.
+    Claiming counts an attempt and moves next_attempt_at a lease ahead, so a worker that dies halfway lets the rows
+    come due again. On PostgreSQL the rows are selected with FOR UPDATE SKIP LOCKED, so workers never claim the same rows.
+    Rows that used up max_attempts are not claimed anymore and stay in the queue with their last error.
+
+    :param batch_size: int: The maximum number of rows claimed
+    :param lease_seconds: float: How long the rows stay claimed
+    :param max_attempts: int: The number of attempts after which a row is given up
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The id, url and attempts of the claimed rows
+    """
+    now = datetime.utcnow()
+    due = (
+        select(PendingDeletion.id)
+        .where(PendingDeletion.next_attempt_at <= now, PendingDeletion.attempts < max_attempts)
+        .order_by(PendingDeletion.next_attempt_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    statement = (
+        update(PendingDeletion)
+        .where(PendingDeletion.id.in_(due))
+        .values(attempts=PendingDeletion.attempts + 1, next_attempt_at=now + timedelta(seconds=lease_seconds))
+        .returning(PendingDeletion.id, PendingDeletion.url, PendingDeletion.attempts)
+        .execution_options(synchronize_session=False)
+    )
+    rows = (await db.execute(statement)).all()
+    await db.commit()
+    return rows
+
+
+async def count_deletions(db: AsyncSession) -> int:
+    """
+    The count_deletions function returns the number of assets waiting in the queue, given up ones included.
+
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The number of rows of the queue
+    """
+    return await db.scalar(select(func.count()).select_from(PendingDeletion))
+
+
+async def complete_deletions(ids: list[int], db: AsyncSession) -> None:
+    """
+    The complete_deletions function removes the rows of the deleted assets from the queue.
+
+    :param ids: list[int]: The ids of the rows
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    """
+    if ids:
+        await db.execute(delete(PendingDeletion).where(PendingDeletion.id.in_(ids)).execution_options(synchronize_session=False))
+
+
+async def retry_deletions(retries: list[tuple[int, datetime, str]], db: AsyncSession) -> None:
+    """
+    The retry_deletions function sets the time of the next attempt and the error of every failed row,
+    with one executemany statement.
+
+    :param retries: list[tuple[int, datetime, str]]: The id, the time of the next attempt and the error of every row
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    """
+    if not retries:
+        return
+    table = PendingDeletion.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        .values(next_attempt_at=bindparam("b_next_attempt_at"), last_error=bindparam("b_last_error"))
+    )
+    await db.execute(
+        statement,
+        [{"b_id": id, "b_next_attempt_at": next_attempt_at, "b_last_error": error[:255]} for id, next_attempt_at, error in retries],
+    )
+
+
+async def referenced_urls(public_ids: list[str], db: AsyncSession) -> Sequence[str]:
+    """
+    The referenced_urls function returns the urls of pictures and avatars that still use one of the given public_ids.
+    Pictures uploaded before every upload got its own public_id share one asset per user, so the asset of a deleted
+    picture may still be shown by another one. Only those legacy public_ids are looked up: the suffix match scans
+    the pictures and the users, and a public_id made by generate_public_id is never used by another row.
+
+    :param public_ids: list[str]: The public_ids about to be deleted
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The urls that end with one of the legacy public_ids
+    """
+    public_ids = [public_id for public_id in public_ids if not CloudPicture.is_single_upload(public_id)]
+    if not public_ids:
+        return []
+    pictures = select(Picture.picture_url).where(or_(*(Picture.picture_url.endswith("/" + public_id) for public_id in public_ids)))
+    avatars = select(User.avatar).where(or_(*(User.avatar.endswith("/" + public_id) for public_id in public_ids)))
+    return (await db.execute(pictures.union(avatars))).scalars().all()
+
+
+async def stream_stored_urls(batch_size: int, db: AsyncSession) -> AsyncIterator[Sequence[str]]:
+    """
+    The stream_stored_urls function yields the urls of every picture, every avatar and every queued deletion,
+    batch by batch through a server-side cursor.
+
+    :param batch_size: int: The number of urls fetched from the cursor at a time
+    :param db: AsyncSession: Pass the database session to the function
+    :return: An async iterator over lists of urls
+    """
+    for column in (Picture.picture_url, User.avatar, PendingDeletion.url):
+        result = await db.stream_scalars(select(column).where(column.is_not(None)).execution_options(yield_per=batch_size))
+        try:
+            async for partition in result.partitions():
+                yield partition
+        finally:
+            await result.close()
+
+
+tracing.instrument_module(__name__)
@@ -1,23 +1,370 @@
+from typing import Sequence
+
+from fastapi import HTTPException, status
+from sqlalchemy import Integer, Row, bindparam, case, delete, func, insert, tuple_, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import select
 
-from src.database.models import Picture, Tag
-from src.schemas.tags import TagModel, TagResponse
+from src.conf.messages import messages
+from src.database.db import dialect_insert
+from src.database.models import (Picture, Tag, picture_lsh_buckets,
+                                 picture_tags, tag_cooccurrence)
+from src.schemas.tags import (TagModel, TagOrder, TagResponse,
+                              normalize_tagname)
+from src.services import tracing
+from src.services.minhash import minhasher
+from src.services.pagination import decode_cursor, encode_cursor, id_batches
+from src.services.tag_index import tag_index
+
+TAG_ORDER_COLUMNS = {
+    TagOrder.id: (Tag.id, False),
+    TagOrder.tagname: (Tag.tagname, False),
+    TagOrder.usage_count: (Tag.usage_count, False),
+    TagOrder.usage_count_desc: (Tag.usage_count, True),
+}
 
 
-async def get_tags(db: AsyncSession):
+async def get_tags(db: AsyncSession, order_by: TagOrder = TagOrder.id, limit: int = 50, cursor: str | None = None) -> tuple[Sequence[Tag], str | None]:
     """
-    The get_tags function is a coroutine that returns all tags in the database.
-    It takes an AsyncSession object as its only argument, and it uses this session to execute a query on the Tag table.
-    The result of this query is returned as a list of strings.
+    The get_tags function returns one page of tags ordered by the given column, with the id as a tie-breaker.
+    Pages are selected with a keyset on (column, id) instead of OFFSET, and usage_count is a stored counter,
+    so listing the trending tags never reads the picture_tags table.
 
     :param db: AsyncSession: Pass the database session to the function
-    :return: A list of tags
-    :doc-author: Trelent
+    :param order_by: TagOrder: The column to order by; a leading minus means descending order
+    :param limit: int: The maximum number of tags on the page
+    :param cursor: str | None: The next_cursor of the previous page with the same order, or None for the first page
+    :return: A list of tags and the cursor of the next page, or None if this is the last page
+    """
+    column, descending = TAG_ORDER_COLUMNS[order_by]
+    query = select(Tag).limit(limit + 1)
+    if descending:
+        query = query.order_by(column.desc(), Tag.id.desc())
+    else:
+        query = query.order_by(column, Tag.id)
+
+    if cursor:
+        cursor_order, value, tag_id = decode_cursor(cursor, str, column.type.python_type, int)
+        if cursor_order != order_by.value:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=messages.get_message("INVALID_CURSOR"))
+        key = tuple_(column, Tag.id)
+        query = query.where(key < tuple_(value, tag_id) if descending else key > tuple_(value, tag_id))
+
+    result = await db.execute(query)
+    tags = result.scalars().all()
+
+    next_cursor = None
+    if len(tags) > limit:
+        tags = tags[:limit]
+        next_cursor = encode_cursor(order_by.value, getattr(tags[-1], column.key), tags[-1].id)
+    return tags, next_cursor
+
+
+async def change_usage_count(counts: dict[int, int], db: AsyncSession) -> None:
+    """
+    The change_usage_count function adds a delta to the usage_count of every given tag.
+    All tags are changed by one executemany statement, in the transaction of the caller.
+    The count never goes below zero, even for a tag whose counter was not backfilled.
+
+    :param counts: dict[int, int]: The delta of usage_count by tag id
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    """
+    params = [{"b_tag_id": tag_id, "b_delta": delta} for tag_id, delta in counts.items() if delta]
+    if not params:
+        return
+    tags = Tag.__table__
+    usage_count = tags.c.usage_count + bindparam("b_delta")
+    statement = (
+        update(tags)
+        .where(tags.c.id == bindparam("b_tag_id"))
+        .values(usage_count=case((usage_count < 0, 0), else_=usage_count))
+    )
+    await db.execute(statement, params)
+
+
+async def change_cooccurrence(tag_ids: list[int], delta: int, db: AsyncSession) -> None:
+    """
+    The change_cooccurrence function adds a delta to the co-occurrence count of every pair of the given tags.
+
+    :param tag_ids: list[int]: The ids of the tags of one picture
+    :param delta: int: 1 when the tags were linked to a picture, -1 when they were unlinked
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    """
+    tag_ids = set(tag_ids)
+    pairs = {(tag_id, related_tag_id): delta for tag_id in tag_ids for related_tag_id in tag_ids if tag_id != related_tag_id}
+    await change_cooccurrence_pairs(pairs, db)
+
+
+async def change_cooccurrence_pairs(deltas: dict[tuple[int, int], int], db: AsyncSession) -> None:
+    """
+    The change_cooccurrence_pairs function adds a delta to the co-occurrence count of every given pair of tags.
+    Every pair is stored in both directions, so the related tags of a tag are one index range scan; the caller
+    passes both directions. Increased pairs are upserted by one executemany statement, decreased pairs are updated
+    by another, and the pairs that reach zero are dropped. Everything runs in the transaction of the caller.
+
+    :param deltas: dict[tuple[int, int], int]: The delta of the count by (tag_id, related_tag_id)
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    """
+    increases = [{"tag_id": pair[0], "related_tag_id": pair[1], "count": delta} for pair, delta in deltas.items() if delta > 0]
+    decreases = [{"b_tag_id": pair[0], "b_related_tag_id": pair[1], "b_delta": delta} for pair, delta in deltas.items() if delta < 0]
+
+    if increases:
+        statement = dialect_insert(db, tag_cooccurrence)
+        statement = statement.on_conflict_do_update(
+            index_elements=[tag_cooccurrence.c.tag_id, tag_cooccurrence.c.related_tag_id],
+            set_={"count": tag_cooccurrence.c.count + statement.excluded.count},
+        )
+        await db.execute(statement, increases)
+
+    if decreases:
+        statement = (
+            update(tag_cooccurrence)
+            .where(tag_cooccurrence.c.tag_id == bindparam("b_tag_id"), tag_cooccurrence.c.related_tag_id == bindparam("b_related_tag_id"))
+            .values(count=tag_cooccurrence.c.count + bindparam("b_delta"))
+        )
+        await db.execute(statement, decreases)
+        tag_ids = {row["b_tag_id"] for row in decreases}
+        await db.execute(delete(tag_cooccurrence).where(tag_cooccurrence.c.tag_id.in_(tag_ids), tag_cooccurrence.c.count <= 0))
+
+
+async def rebuild_cooccurrence(tag_ids: list[int], db: AsyncSession) -> None:
+    """
+    The rebuild_cooccurrence function recounts all co-occurrence pairs involving the given tags from picture_tags,
+    with one DELETE and one INSERT ... SELECT.
+
+    :param tag_ids: list[int]: The ids of the tags whose pairs are recounted
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    """
+    await db.execute(
+        delete(tag_cooccurrence).where(
+            tag_cooccurrence.c.tag_id.in_(tag_ids) | tag_cooccurrence.c.related_tag_id.in_(tag_ids)
+        )
+    )
+    first, second = picture_tags.alias("first"), picture_tags.alias("second")
+    pairs = (
+        select(first.c.tag_id, second.c.tag_id, func.count())
+        .join(second, (second.c.picture_id == first.c.picture_id) & (second.c.tag_id != first.c.tag_id))
+        .where(first.c.tag_id.in_(tag_ids) | second.c.tag_id.in_(tag_ids))
+        .group_by(first.c.tag_id, second.c.tag_id)
+    )
+    await db.execute(insert(tag_cooccurrence).from_select(["tag_id", "related_tag_id", "count"], pairs))
+
+
+async def recount_usage(tag_ids: list[int], db: AsyncSession) -> None:
+    """
+    The recount_usage function sets the usage_count of the given tags to their number of rows in picture_tags.
+
+    :param tag_ids: list[int]: The ids of the tags to recount
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    """
+    usage = select(func.count()).where(picture_tags.c.tag_id == Tag.id).scalar_subquery()
+    await db.execute(
+        update(Tag).where(Tag.id.in_(tag_ids)).values(usage_count=usage).execution_options(synchronize_session=False)
+    )
+
+
+async def recount_all_usage(batch_size: int, db: AsyncSession) -> int:
     """
-    query = await db.execute(select(Tag))
-    tags = query.scalars().all()
-    return tags
+    The recount_all_usage function sets the usage_count of every tag to its number of rows in picture_tags,
+    batch_size tags per UPDATE and per transaction.
+
+    :param batch_size: int: The number of tags recounted per transaction
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The number of recounted tags
+    """
+    recounted = 0
+    async for tag_ids in id_batches(Tag.id, batch_size, db):
+        await recount_usage(tag_ids, db)
+        await db.commit()
+        recounted += len(tag_ids)
+    return recounted
+
+
+async def rebuild_similarity(batch_size: int, db: AsyncSession) -> dict:
+    """
+    The rebuild_similarity function recounts the co-occurrence pairs of every tag and recomputes the LSH buckets
+    of every picture from picture_tags, batch_size tags or pictures per transaction.
+    A pair of tags from two batches is recounted with each of them, and the last count is the right one.
+
+    :param batch_size: int: The number of tags or pictures rebuilt per transaction
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The number of rebuilt tags and pictures
+    """
+    result = {"tags": 0, "pictures": 0}
+    async for tag_ids in id_batches(Tag.id, batch_size, db):
+        await rebuild_cooccurrence(tag_ids, db)
+        await db.commit()
+        result["tags"] += len(tag_ids)
+    async for picture_ids in id_batches(Picture.id, batch_size, db):
+        await refresh_picture_buckets(picture_ids, db)
+        await db.commit()
+        result["pictures"] += len(picture_ids)
+    return result
+
+
+async def save_picture_buckets(tags_by_picture: dict[int, list[int]], db: AsyncSession) -> None:
+    """
+    The save_picture_buckets function replaces the LSH band buckets of the given pictures with the buckets of their tag sets.
+
+    :param tags_by_picture: dict[int, list[int]]: The ids of all tags of every picture, by picture id
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    """
+    if not tags_by_picture:
+        return
+    await db.execute(delete(picture_lsh_buckets).where(picture_lsh_buckets.c.picture_id.in_(tags_by_picture)))
+    rows = [
+        {"picture_id": picture_id, "band": band, "bucket": bucket}
+        for picture_id, tag_ids in tags_by_picture.items()
+        for band, bucket in enumerate(minhasher.buckets(tag_ids))
+    ]
+    if rows:
+        await db.execute(insert(picture_lsh_buckets), rows)
+
+
+async def refresh_picture_buckets(picture_ids: list[int], db: AsyncSession) -> None:
+    """
+    The refresh_picture_buckets function recomputes the LSH band buckets of the given pictures from picture_tags.
+
+    :param picture_ids: list[int]: The ids of the pictures whose tags changed
+    :param db: AsyncSession: Pass the database session to the function
+    :return: None
+    """
+    tags_by_picture = {picture_id: [] for picture_id in picture_ids}
+    rows = await db.execute(
+        select(picture_tags.c.picture_id, picture_tags.c.tag_id).where(picture_tags.c.picture_id.in_(picture_ids))
+    )
+    for picture_id, tag_id in rows:
+        tags_by_picture[picture_id].append(tag_id)
+    await save_picture_buckets(tags_by_picture, db)
+
+
+async def merge_tags(targets: dict[int, int], db: AsyncSession) -> int:
+    """
+    The merge_tags function merges every source tag into its target tag and deletes the source tags.
+    The picture_tags rows of all sources are moved by one INSERT ... SELECT ... ON CONFLICT DO NOTHING per source,
+    so a picture already tagged with the target keeps a single row, and then removed by one DELETE.
+    The usage counts, co-occurrence pairs and LSH buckets of everything touched are recounted.
+    Nothing is committed: the caller owns the transaction.
+
+    :param targets: dict[int, int]: The id of the target tag by the id of the source tag
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The number of pictures whose tags changed
+    """
+    targets = {source: target for source, target in targets.items() if source != target}
+    if not targets:
+        return 0
+    sources = list(targets)
+
+    picture_ids = (
+        await db.execute(select(picture_tags.c.picture_id).where(picture_tags.c.tag_id.in_(sources)).distinct())
+    ).scalars().all()
+
+    moved = select(picture_tags.c.picture_id, bindparam("b_target", type_=Integer)).where(
+        picture_tags.c.tag_id == bindparam("b_source")
+    )
+    statement = (
+        dialect_insert(db, picture_tags)
+        .from_select(["picture_id", "tag_id"], moved)
+        .on_conflict_do_nothing(index_elements=[picture_tags.c.picture_id, picture_tags.c.tag_id])
+    )
+    await db.execute(statement, [{"b_source": source, "b_target": target} for source, target in targets.items()])
+    await db.execute(delete(picture_tags).where(picture_tags.c.tag_id.in_(sources)))
+    await db.execute(
+        delete(tag_cooccurrence).where(
+            tag_cooccurrence.c.tag_id.in_(sources) | tag_cooccurrence.c.related_tag_id.in_(sources)
+        )
+    )
+    await db.execute(delete(Tag).where(Tag.id.in_(sources)).execution_options(synchronize_session=False))
+
+    target_ids = list(set(targets.values()))
+    await recount_usage(target_ids, db)
+    await rebuild_cooccurrence(target_ids, db)
+    await refresh_picture_buckets(picture_ids, db)
+    return len(picture_ids)
+
+
+async def merge_tag_into(tag_id: int, target_id: int, db: AsyncSession) -> Tag:
+    """
+    The merge_tag_into function moves all pictures of a tag to the target tag and deletes the tag,
+    in one transaction whatever the number of pictures. The tag is removed from the tag index of every worker.
+
+    :param tag_id: int: The id of the tag to merge
+    :param target_id: int: The id of the tag that receives its pictures
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The target tag with its new usage_count
+    """
+    await merge_tags({tag_id: target_id}, db)
+    await db.commit()
+
+    target = await db.get(Tag, target_id, populate_existing=True)
+    await tag_index.publish("tag_deleted", tag_id)
+    tag_index.add(target.id, target.tagname, target.usage_count)
+    return target
+
+
+async def find_duplicate_tags(db: AsyncSession) -> dict[str, list[Row]]:
+    """
+    The find_duplicate_tags function groups the tags by their normalized name.
+    Names can't be normalized in SQL (NFKC), so the id and name of every tag are read and grouped in Python.
+
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The groups of tags with more than one tag or with a name that is not normalized, by normalized name
+    """
+    groups = {}
+    for row in await db.execute(select(Tag.id, Tag.tagname, Tag.usage_count).order_by(Tag.id)):
+        groups.setdefault(normalize_tagname(row.tagname), []).append(row)
+    return {name: rows for name, rows in groups.items() if len(rows) > 1 or rows[0].tagname != name}
+
+
+async def merge_duplicate_tags(db: AsyncSession) -> dict[str, list[Row]]:
+    """
+    The merge_duplicate_tags function merges the tags whose names are equal after normalization
+    into the oldest of them, renames it to the normalized name and commits.
+
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The merged groups of tags, by normalized name
+    """
+    groups = await find_duplicate_tags(db)
+    targets = {row.id: rows[0].id for rows in groups.values() for row in rows[1:]}
+    await merge_tags(targets, db)
+    if groups:
+        statement = update(Tag.__table__).where(Tag.__table__.c.id == bindparam("b_id")).values(tagname=bindparam("b_tagname"))
+        await db.execute(statement, [{"b_id": rows[0].id, "b_tagname": name} for name, rows in groups.items()])
+    await db.commit()
+
+    for source in targets:
+        await tag_index.publish("tag_deleted", source)
+    for name, rows in groups.items():
+        await tag_index.publish("tag_renamed", rows[0].id, name)
+    return groups
+
+
+async def get_related_tags(tag_id: int, limit: int, db: AsyncSession) -> Sequence[Row]:
+    """
+    The get_related_tags function returns the tags used most often together with the given tag.
+    It reads the first limit rows of the tag in the (tag_id, count) index of tag_cooccurrence,
+    so its cost does not depend on the number of pictures.
+
+    :param tag_id: int: The id of the tag
+    :param limit: int: The maximum number of related tags
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A list of rows with the id, tagname and count of the related tags
+    """
+    query = (
+        select(Tag.id, Tag.tagname, tag_cooccurrence.c.count)
+        .join(tag_cooccurrence, tag_cooccurrence.c.related_tag_id == Tag.id)
+        .where(tag_cooccurrence.c.tag_id == tag_id)
+        .order_by(tag_cooccurrence.c.count.desc(), Tag.id)
+        .limit(limit)
+    )
+    result = await db.execute(query)
+    return result.all()
 
 
 async def get_tag_by_id(tag_id: int, db: AsyncSession):
@@ -41,14 +388,14 @@ async def get_tag_by_tagname(tagname: str, db: AsyncSession):
     """
     The get_tag_by_tagname function takes in a tagname and an AsyncSession object.
     It then queries the database for a Tag with that tagname, and returns it as a
-    TagModel object.
+    TagModel object. Names are compared in normalized form, through the ix_tags_tagname_lower index.
 
     :param tagname: str: Filter the query by tagname
     :param db: AsyncSession: Pass the database session to the function
     :return: A tag object that has the given tagname
     :doc-author: Trelent
     """
-    query = select(Tag).filter(Tag.tagname == tagname)
+    query = select(Tag).filter(Tag.normalized_tagname == normalize_tagname(tagname))
     tag = await db.execute(query)
     result = tag.scalar()
     return result
@@ -58,7 +405,8 @@ async def update_tag(tag_id: int, body: TagModel, db: AsyncSession):
     """
     The update_tag function takes in a tag_id, body, and db.
         It then gets the tag by id from the database. If it exists,
-        it updates the tagname to what is passed in through body.
+        it updates the tagname to what is passed in through body
+        and renames the tag in the tag index of every worker.
 
     :param tag_id: int: Get the tag by id
     :param body: TagModel: Pass in the new tagname to update the tag with
@@ -70,15 +418,20 @@ async def update_tag(tag_id: int, body: TagModel, db: AsyncSession):
 
     if tag:
         tag.tagname = body.tagname
+        await db.commit()
+        await db.refresh(tag)
+        await tag_index.publish("tag_renamed", tag.id, tag.tagname)
 
-        tag_response = TagResponse(id=tag.id, tagname=tag.tagname, created_at=tag.created_at, updated_at=tag.updated_at)
+        tag_response = TagResponse(
+            id=tag.id, tagname=tag.tagname, usage_count=tag.usage_count, created_at=tag.created_at, updated_at=tag.updated_at
+        )
 
         return tag_response
 
 
 async def remove_tag(tag_id: int, db: AsyncSession):
     """
-    The remove_tag function removes a tag from the database.
+    The remove_tag function removes a tag from the database and from the tag index of every worker.
 
     :param tag_id: int: Specify the id of the tag to be removed
     :param db: AsyncSession: Pass the database session to the function
@@ -90,6 +443,7 @@ async def remove_tag(tag_id: int, db: AsyncSession):
     if tag:
         await db.delete(tag)
         await db.commit()
+        await tag_index.publish("tag_deleted", tag_id)
 
 
-
+tracing.instrument_module(__name__)
@@ -1,15 +1,24 @@
 
 from fastapi import UploadFile
-from libgravatar import Gravatar
-from sqlalchemy import func, select,  outerjoin
+from sqlalchemy import Row, case, delete, func, insert, literal, outerjoin, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
 
-from src.database.models import Comment, InvalidToken, Picture, Role, User
+from src.conf.config import settings
+from src.database.models import (Comment, InvalidToken, PendingDeletion, Picture,
+                                 Rating, Role, User, picture_tags)
+from src.repository.comments import change_comments_count
+from src.repository.tags import change_cooccurrence_pairs, change_usage_count
 from src.schemas.filters import UserFilter
 from src.schemas.users import UserModel, UserProfile
+from src.services import tracing
 from src.services.cloud_picture import CloudPicture
+from src.services.events import event_broker, picture_channel
+from src.services.tag_index import tag_index
+
+USER_COLUMNS = (User.id, User.username, User.email, User.avatar, User.roles)
 
 
 async def get_user_by_email(email: str, db: AsyncSession) -> User | None:
@@ -31,35 +40,38 @@ async def get_user_by_email(email: str, db: AsyncSession) -> User | None:
 
     result = await db.execute(query)
     user = result.scalars().first()
+    if user is not None:
+        # Filtered here rather than with loader criteria: the user is pickled into the cache with its load options.
+        set_committed_value(user, "comments_user", [comment for comment in user.comments_user if not comment.is_hidden])
     return user
 
 
-async def create_user(body: UserModel, db: AsyncSession) -> User:
+async def create_user(body: UserModel, db: AsyncSession) -> Row:
     """
     The create_user function takes a UserModel object and a database session as arguments.
     It then creates an instance of the Gravatar class, passing in the user's email address.
     The get_image() method is called on this instance to retrieve the user's avatar image from Gravatar.com,
-    and it is assigned to the avatar variable. The model_dump() method of UserModel returns a dictionary containing all
-    the fields that are required for creating an instance of User (except for id). This dictionary is unpacked into
-    keyword arguments for creating new_user using Python's ** operator.
+    and it is assigned to the avatar variable. The first user gets the admin role, every other one the user role:
+    the choice is a CASE WHEN EXISTS in the INSERT itself, which returns the columns of UserDb,
+    so creating a user is a single statement.
 
     :param body: UserModel: Create a new user
     :param db: AsyncSession: Pass the database session to the function
-    :return: A user object
+    :return: A row with the id, username, email, avatar and roles of the new user
     """
+    from libgravatar import Gravatar
+
     g = Gravatar(body.email)
     avatar = g.get_image()
 
-    existing_user = (await db.execute(select(User).limit(1))).scalar()
-
-    if existing_user is None:
-        new_user = User(**body.model_dump(), avatar=avatar, roles="admin")
-    else:
-        new_user = User(**body.model_dump(), avatar=avatar)
-
-    db.add(new_user)
+    roles_type = User.__table__.c.roles.type
+    roles = case(
+        (select(User.id).exists(), literal(Role.user, roles_type)),
+        else_=literal(Role.admin, roles_type),
+    )
+    statement = insert(User).values(**body.model_dump(), avatar=avatar, roles=roles).returning(*USER_COLUMNS)
+    new_user = (await db.execute(statement)).one()
     await db.commit()
-    await db.refresh(new_user)
     return new_user
 
 
@@ -100,8 +112,8 @@ async def edit_my_profile(email: str, file: UploadFile, name: str, db: AsyncSess
     If there is a user with that given email address, it sets their username to be equal to the name parameter if one was
     provided.
     Then it initializes cloudinary and uploads the file using cloudinary's uploader module (which uses Cloudinary's API).
-    The public_id of this image will be &quot;avatar/{user's username}&quot;. This means that all images uploaded for each
-    individual avatar will have unique
+    Every avatar gets a new public_id in the folder of the user, and the previous avatar, if it is stored in Cloudinary,
+    is queued for deletion from storage in the same transaction as the new url.
 
     :param email: str: Get the user from the database
     :param file: UploadFile: Upload the file to cloudinary
@@ -114,11 +126,12 @@ async def edit_my_profile(email: str, file: UploadFile, name: str, db: AsyncSess
         if name:
             user.username = name
         if file:
-            init_cloudinary = CloudPicture()
-            public_id = init_cloudinary.generate_folder_name(user.username)
-            file_info = init_cloudinary.upload_picture(file.file, public_id)
-            src_url = init_cloudinary.get_url_for_picture(public_id, file_info)
+            public_id = CloudPicture.generate_public_id(user.username)
+            file_info = CloudPicture.upload_picture(file.file, public_id)
+            src_url = CloudPicture.get_url_for_picture(public_id, file_info)
 
+            if CloudPicture.is_stored(user.avatar) and user.avatar != src_url:
+                db.add(PendingDeletion(url=user.avatar))
             user.avatar = src_url
         try:
             await db.commit()
@@ -187,7 +200,7 @@ async def get_user_profile(user: User, db: AsyncSession):
         pictures_result = await db.execute(pictures)
         pictures_count = pictures_result.scalar()
 
-        comments = select(func.count()).where(Comment.user_id == user.id)
+        comments = select(func.count()).where(Comment.user_id == user.id, Comment.is_hidden.is_(False))
         comments_result = await db.execute(comments)
         comments_count = comments_result.scalar()
 
@@ -208,63 +221,73 @@ async def get_user_profile(user: User, db: AsyncSession):
     return None
 
 
-async def ban_user(email: str, db: AsyncSession) -> User | None:
-    user = await get_user_by_email(email, db)
-    if user:
-        user.is_active = False
+async def update_user_columns(email: str, values: dict, db: AsyncSession) -> Row | None:
+    """
+    The update_user_columns function changes the given columns of the user with the given email
+    with one UPDATE ... RETURNING statement and commits.
 
-        try:
+    :param email: str: The email of the user
+    :param values: dict: The new values by column name
+    :param db: AsyncSession: Pass in the database session
+    :return: A row with the id, username, email, avatar and roles of the user, or None if there is no such user
+    """
+    statement = (
+        update(User)
+        .where(User.email == email)
+        .values(**values)
+        .returning(*USER_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        user = (await db.execute(statement)).first()
+        if user is not None:
             await db.commit()
-            await db.refresh(user)
-            return user
-        except Exception as e:
-            await db.rollback()
-            raise e
-    return None
+        return user
+    except Exception as e:
+        await db.rollback()
+        raise e
+
+
+async def ban_user(email: str, db: AsyncSession) -> Row | None:
+    """
+    The ban_user function sets is_active to False for the user with the given email.
+
+    :param email: str: Find the user in the database
+    :param db: AsyncSession: Pass in the database session
+    :return: The banned user or None
+    """
+    return await update_user_columns(email, {"is_active": False}, db)
 
 
-async def activate_user(email: str, db: AsyncSession) -> User | None:
+async def activate_user(email: str, db: AsyncSession) -> Row | None:
     """
     The activate_user function takes an email and a database session as arguments.
-    It then queries the database for a user with that email address, and if it finds one,
-    it sets its is_active attribute to True. It then commits the change to the database
-    and returns the updated user object.
+    It sets is_active to True for the user with that email address in one UPDATE ... RETURNING statement,
+    commits the change and returns the columns of the updated user.
 
     :param email: Find the user in the database
     :param db: AsyncSession: Pass in the database session so that we can use it to query the database
     :return: A user or none
     """
-    user = await get_user_by_email(email, db)
-    if user:
-        user.is_active = True
-
-        try:
-            await db.commit()
-            await db.refresh(user)
-            return user
-        except Exception as e:
-            await db.rollback()
-            raise e
-    return None
+    return await update_user_columns(email, {"is_active": True}, db)
 
 
 async def invalidate_token(token: str, db: AsyncSession) -> None:
     """
     The invalidate_token function takes a token and an AsyncSession object as arguments.
-    It creates an InvalidToken object with the given token, adds it to the database, commits
-    the changes to the database, and refreshes invalid_token. If any of these steps fail for
+    It creates an InvalidToken object with the given token, adds it to the database and commits
+    the changes to the database. Nothing is read back, as nothing is returned. If any of these steps fail for
     any reason (e.g., if there is already a row in the invalid_tokens table with that token),
     then all of them are rolled back.
 
     :param token: str: Specify the token that is to be invalidated
     :param db: AsyncSession: Pass the database session to the function
-    :return: The invalid_token object
+    :return: None
     """
     invalid_token = InvalidToken(token=token)
     try:
         db.add(invalid_token)
         await db.commit()
-        await db.refresh(invalid_token)
     except Exception as e:
         await db.rollback()
         raise e
@@ -291,7 +314,7 @@ async def is_validate_token(token: str, db: AsyncSession) -> bool:
     return False
 
 
-async def change_role(email: str, role: Role, db: AsyncSession) -> User | None:
+async def change_role(email: str, role: Role, db: AsyncSession) -> Row | None:
     """
     The change_role function takes in an email and a role, and changes the user's role to that of the given role.
         If no user is found with that email, None is returned.
@@ -299,20 +322,9 @@ async def change_role(email: str, role: Role, db: AsyncSession) -> User | None:
     :param email: str: Get the user by email
     :param role: Role: Specify the role of the user
     :param db: AsyncSession: Pass in the database session to the function
-    :return: A user object or none
+    :return: The user or none
     """
-    user = await get_user_by_email(email, db)
-    if user:
-        user.roles = role
-
-        try:
-            await db.commit()
-            await db.refresh(user)
-            return user
-        except Exception as e:
-            await db.rollback()
-            raise e
-    return None
+    return await update_user_columns(email, {"roles": role}, db)
 
 
 async def search_users(user_filter: UserFilter, db: AsyncSession):
@@ -331,7 +343,7 @@ async def search_users(user_filter: UserFilter, db: AsyncSession):
         select(User)
         .select_from(outerjoin(User, Comment))
         .options(selectinload(User.pictures))
-        .options(selectinload(User.comments_user))
+        .options(selectinload(User.comments_user.and_(Comment.is_hidden.is_(False))))
         .options(selectinload(User.ratings))
       
     )
@@ -342,3 +354,162 @@ async def search_users(user_filter: UserFilter, db: AsyncSession):
     users = result.scalars().all()
 
     return users
+
+
+async def delete_user_ratings(user_id: int, batch_size: int, db: AsyncSession) -> int:
+    """
+    The delete_user_ratings function deletes at most batch_size ratings of the user with one DELETE ... RETURNING
+    and recomputes the rating_average of the rated pictures with one UPDATE, then commits.
+
+    :param user_id: int: The id of the user
+    :param batch_size: int: The maximum number of ratings deleted
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The number of deleted ratings
+    """
+    batch = select(Rating.id).where(Rating.user_id == user_id).limit(batch_size).scalar_subquery()
+    statement = delete(Rating).where(Rating.id.in_(batch)).returning(Rating.picture_id).execution_options(synchronize_session=False)
+    picture_ids = (await db.execute(statement)).scalars().all()
+    if picture_ids:
+        average = select(func.coalesce(func.avg(Rating.rating), 0.0)).where(Rating.picture_id == Picture.id).scalar_subquery()
+        await db.execute(
+            update(Picture)
+            .where(Picture.id.in_(set(picture_ids)))
+            .values(rating_average=average)
+            .execution_options(synchronize_session=False)
+        )
+    await db.commit()
+    return len(picture_ids)
+
+
+async def delete_user_comments(user_id: int, batch_size: int, db: AsyncSession) -> int:
+    """
+    The delete_user_comments function deletes at most batch_size comments of the user with one DELETE ... RETURNING,
+    decreases the comments_count of their pictures by the number of removed visible comments and commits.
+
+    :param user_id: int: The id of the user
+    :param batch_size: int: The maximum number of comments deleted
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The number of deleted comments
+    """
+    batch = select(Comment.id).where(Comment.user_id == user_id).limit(batch_size).scalar_subquery()
+    statement = (
+        delete(Comment)
+        .where(Comment.id.in_(batch))
+        .returning(Comment.id, Comment.picture_id, Comment.is_hidden)
+        .execution_options(synchronize_session=False)
+    )
+    rows = (await db.execute(statement)).all()
+    deleted: dict[int, list[int]] = {}
+    counts: dict[int, int] = {}
+    for row in rows:
+        deleted.setdefault(row.picture_id, []).append(row.id)
+        if not row.is_hidden:
+            counts[row.picture_id] = counts.get(row.picture_id, 0) - 1
+    await change_comments_count(counts, db)
+    await db.commit()
+
+    for picture_id, comment_ids in deleted.items():
+        await event_broker.publish(picture_channel(picture_id), "comments_deleted", {"ids": comment_ids, "picture_id": picture_id})
+    return len(rows)
+
+
+async def delete_user_pictures(user_id: int, batch_size: int, db: AsyncSession) -> int:
+    """
+    The delete_user_pictures function deletes at most batch_size pictures of the user and commits.
+    The usage_count and co-occurrence counts of their tags are decreased, their urls are queued in pending_deletions
+    with one INSERT ... SELECT, and one DELETE removes the pictures. Their comments, ratings, tag links and LSH buckets
+    go with them through ON DELETE CASCADE, without being loaded.
+
+    :param user_id: int: The id of the user
+    :param batch_size: int: The maximum number of pictures deleted
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The number of deleted pictures
+    """
+    picture_ids = (
+        await db.execute(select(Picture.id).where(Picture.user_id == user_id).order_by(Picture.id).limit(batch_size))
+    ).scalars().all()
+    if not picture_ids:
+        return 0
+
+    tags_by_picture: dict[int, list[int]] = {}
+    rows = await db.execute(
+        select(picture_tags.c.picture_id, picture_tags.c.tag_id).where(picture_tags.c.picture_id.in_(picture_ids))
+    )
+    for picture_id, tag_id in rows:
+        tags_by_picture.setdefault(picture_id, []).append(tag_id)
+    usage: dict[int, int] = {}
+    pairs: dict[tuple[int, int], int] = {}
+    for tag_ids in tags_by_picture.values():
+        for tag_id in tag_ids:
+            usage[tag_id] = usage.get(tag_id, 0) - 1
+            for related_tag_id in tag_ids:
+                if related_tag_id != tag_id:
+                    pairs[(tag_id, related_tag_id)] = pairs.get((tag_id, related_tag_id), 0) - 1
+    await change_usage_count(usage, db)
+    await change_cooccurrence_pairs(pairs, db)
+
+    await db.execute(
+        insert(PendingDeletion).from_select(["url"], select(Picture.picture_url).where(Picture.id.in_(picture_ids)))
+    )
+    await db.execute(delete(Picture).where(Picture.id.in_(picture_ids)).execution_options(synchronize_session=False))
+    await db.commit()
+
+    for tag_id, delta in usage.items():
+        tag_index.use([tag_id], count=delta)
+    return len(picture_ids)
+
+
+async def delete_user(user_id: int, db: AsyncSession, batch_size: int | None = None) -> dict | None:
+    """
+    The delete_user function deletes a user with everything they own, in bounded memory whatever their number of rows.
+    The user is banned first, so they cannot add anything while being deleted. Then their ratings, their comments and
+    their pictures are deleted by batches of batch_size rows, each batch in its own transaction and without loading
+    any ORM object, and finally the user row itself. The urls of the pictures and of an avatar stored in Cloudinary
+    are queued in pending_deletions, in the same transactions as the rows, for asynchronous removal from storage.
+    A deletion that fails halfway leaves the user banned, and can be run again.
+
+    :param user_id: int: The id of the user to delete
+    :param db: AsyncSession: Pass the database session to the function
+    :param batch_size: int: The maximum number of rows deleted per transaction, settings.user_delete_batch_size by default
+    :return: The number of deleted pictures, comments and ratings and of transactions, or None if there is no such user
+    """
+    batch_size = batch_size or settings.user_delete_batch_size
+    result = {"pictures": 0, "comments": 0, "ratings": 0, "batches": 0}
+    try:
+        avatar = (
+            await db.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(is_active=False)
+                .returning(User.avatar)
+                .execution_options(synchronize_session=False)
+            )
+        ).first()
+        if avatar is None:
+            await db.rollback()
+            return None
+        await db.commit()
+
+        for key, delete_batch in (
+            ("ratings", delete_user_ratings),
+            ("comments", delete_user_comments),
+            ("pictures", delete_user_pictures),
+        ):
+            while deleted := await delete_batch(user_id, batch_size, db):
+                result[key] += deleted
+                result["batches"] += 1
+                if deleted < batch_size:
+                    break
+
+        if CloudPicture.is_stored(avatar.avatar):
+            await db.execute(insert(PendingDeletion).values(url=avatar.avatar))
+        await db.execute(delete(User).where(User.id == user_id).execution_options(synchronize_session=False))
+        await db.commit()
+        result["batches"] += 1
+    except Exception as e:
+        await db.rollback()
+        raise e
+    return result
+
+
+tracing.instrument_module(__name__)
@@ -1,12 +1,12 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
-from src.schemas.comments import CommentCreate, CommentDB, CommentUpdate
+from src.database.db import get_db, get_read_db
+from src.schemas.comments import CommentBulkDelete, CommentBulkResult, CommentCreate, CommentDB, CommentPage, CommentUpdate
 from src.services.roles import admin_moderator_user, admin_moderator
 from src.repository import comments as repository_comments
 from src.services.auth import auth_service
+from src.services.etag import etag, parse_if_match
 from src.database.models import User
 from src.conf.messages import messages
 
@@ -16,6 +16,7 @@ router = APIRouter(tags=["comments"])
 
 @router.post(
     "/{picture_id}/comments",
+    response_model=CommentDB,
     dependencies=[Depends(admin_moderator_user)],
     description="User, Moderator and Administrator have access",
 )
@@ -42,6 +43,7 @@ async def create_comment(
 
 @router.patch(
     "/{picture_id}/comments/{comment_id}",
+    response_model=CommentDB,
     dependencies=[Depends(admin_moderator_user)],
     description="User, Moderator and Administrator have access",
 )
@@ -49,6 +51,8 @@ async def update_comment(
     comment_id: int,
     picture_id: int,
     body: CommentUpdate,
+    response: Response,
+    if_match: str | None = Header(default=None),
     current_user: User = Depends(auth_service.get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
@@ -57,18 +61,24 @@ async def update_comment(
         The function takes an id of the comment to be updated, and a CommentUpdate object containing
         the new values for each field. It then checks if there is already a comment with that id, and if so it updates it with
         the new values from CommentUpdate. If not, it raises an HTTPException indicating that no such comment exists.
+        With an If-Match header, the comment is changed only if its ETag still matches, otherwise the status code is 412.
 
     :param comment_id: int: Identify the comment that is being updated
     :param body: CommentUpdate: Get the data from the request body
+    :param response: Response: Set the ETag of the new version
+    :param if_match: str | None: The ETags of the versions the client has seen
     :param current_user: User: Get the current user from the auth_service
     :param db: AsyncSession: Get the database session
 
     :return: A comment object
     """
 
-    comment = await repository_comments.update_comment(picture_id, comment_id, body, current_user.id, db)
+    comment = await repository_comments.update_comment(
+        picture_id, comment_id, body, current_user.id, db, parse_if_match(if_match)
+    )
     if comment is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("COMMENT_NOT_CREATED"))
+    response.headers["ETag"] = etag(comment.version)
     return comment
 
 
@@ -100,29 +110,51 @@ async def remove_comment(
 
 @router.get(
     "/{picture_id}/comments",
-    response_model=List[CommentDB],
+    response_model=CommentPage,
     dependencies=[Depends(admin_moderator_user)],
     description="User, Moderator and Administrator have access",
 )
 async def comments_to_picture(
     picture_id: int,
-    skip: int = 0,
-    limit: int = 10,
-    db: AsyncSession = Depends(get_db),
+    limit: int = Query(default=10, ge=1, le=100),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_read_db),
 ):
     """
-    The comments_to_picture function returns a list of comments to the picture with the given picture_id.
-    The skip and limit parameters are used for pagination, where skip is how many comments to skip and limit is how many
-    comments to return.
+    The comments_to_picture function returns one page of comments to the picture with the given picture_id.
+    The first page is requested without a cursor; every next page is requested with the next_cursor
+    returned by the previous one. The last page has next_cursor set to None.
 
     :param picture_id: int: Get the comments to a specific picture
-    :param skip: int: Skip the first n comments
     :param limit: int: Limit the number of comments returned
+    :param cursor: str | None: The opaque cursor of the page to return
     :param db: AsyncSession: Get the database session
-    :return: A list of comments to a picture
+    :return: A page of comments to a picture
     """
 
-    comments = await repository_comments.get_comments_to_picture(skip, limit, picture_id, db)
-    if not comments:
+    comments, next_cursor = await repository_comments.get_comments_to_picture(limit, cursor, picture_id, db)
+    if not comments and cursor is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("COMMENTS_NOT_FOUND"))
-    return comments
+    return {"items": comments, "next_cursor": next_cursor}
+
+
+@router.post(
+    "/comments/bulk-delete",
+    response_model=CommentBulkResult,
+    dependencies=[Depends(admin_moderator)],
+    description="Moderator and Administrator have access",
+)
+async def bulk_delete_comments(
+    body: CommentBulkDelete,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    The bulk_delete_comments function deletes or hides all comments matching the given filters in one request.
+    Filters are combined with AND, and at least one of them is required.
+
+    :param body: CommentBulkDelete: The filters, the action (delete or hide) and the batch size
+    :param db: AsyncSession: Get the database session
+    :return: A summary of the changed comments
+    """
+    result = await repository_comments.bulk_delete_comments(body, db)
+    return result
@@ -0,0 +1,108 @@
+import asyncio
+import contextlib
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+
+from src.conf.config import settings
+from src.database.db import sessionmanager
+from src.services.auth import auth_service
+from src.services.events import Subscription, event_broker, picture_channel
+from src.services.roles import admin_moderator_user
+
+router = APIRouter(tags=["events"])
+
+
+async def next_event(subscription: Subscription) -> str | None:
+    """
+    The next_event function waits for the next event of a subscription.
+    It returns None when no event arrived during the heartbeat interval, so the caller can send a keep-alive.
+
+    :param subscription: Subscription: The subscription of the client
+    :return: The message of the event or None
+    """
+    try:
+        return await asyncio.wait_for(subscription.queue.get(), timeout=settings.events_heartbeat_seconds)
+    except asyncio.TimeoutError:
+        return None
+
+
+async def wait_disconnect(websocket: WebSocket) -> None:
+    with contextlib.suppress(WebSocketDisconnect):
+        while True:
+            await websocket.receive_text()
+
+
+async def sse_stream(picture_id: int, request: Request):
+    async with event_broker.subscribe(picture_channel(picture_id)) as subscription:
+        while not await request.is_disconnected():
+            message = await next_event(subscription)
+            dropped = subscription.take_dropped()
+            if dropped:
+                yield f"event: overflow\ndata: {json.dumps({'dropped': dropped})}\n\n"
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+            event = json.loads(message)
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+@router.get(
+    "/{picture_id}/events",
+    dependencies=[Depends(admin_moderator_user)],
+    description="User, Moderator and Administrator have access",
+)
+async def picture_events(picture_id: int, request: Request):
+    """
+    The picture_events function streams new comments and ratings of a picture as server-sent events.
+    Every event has the type of the change (comment_created, comment_updated, comment_deleted, rating_created)
+    and its data as JSON. If the client reads too slowly, the oldest events are dropped and an overflow event
+    tells the client how many were lost, so it can refetch the comments and ratings.
+
+    :param picture_id: int: The id of the picture to listen to
+    :param request: Request: Detect that the client has disconnected
+    :return: A text/event-stream response
+    """
+    return StreamingResponse(
+        sse_stream(picture_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/{picture_id}/events/ws")
+async def picture_events_ws(websocket: WebSocket, picture_id: int, token: str):
+    """
+    The picture_events_ws function is the WebSocket variant of picture_events.
+    Browsers can't set the Authorization header on a WebSocket, so the access token is passed as a query parameter.
+
+    :param websocket: WebSocket: The connection with the client
+    :param picture_id: int: The id of the picture to listen to
+    :param token: str: The access token of the user
+    :return: None
+    """
+    async with sessionmanager.session() as db:
+        try:
+            await auth_service.get_current_user(token, db)
+        except HTTPException:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+
+    await websocket.accept()
+    receiver = asyncio.create_task(wait_disconnect(websocket))
+    try:
+        async with event_broker.subscribe(picture_channel(picture_id)) as subscription:
+            while not receiver.done():
+                message = await next_event(subscription)
+                dropped = subscription.take_dropped()
+                if dropped:
+                    await websocket.send_json({"event": "overflow", "data": {"dropped": dropped}})
+                if message is not None:
+                    await websocket.send_text(message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await receiver
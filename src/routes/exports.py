@@ -0,0 +1,65 @@
+import contextlib
+from typing import AsyncIterator
+
+from fastapi import APIRouter, Depends, Query
+
+from src.conf.config import settings
+from src.database.db import sessionmanager
+from src.repository import exports as repository_exports
+from src.schemas.exports import ExportFormat, ExportKind
+from src.services.export import ExportResponse, encode_csv, encode_ndjson, gzip_chunks
+from src.services.roles import admin
+
+router = APIRouter(tags=["exports"])
+
+MEDIA_TYPES = {ExportFormat.ndjson: "application/x-ndjson", ExportFormat.csv: "text/csv; charset=utf-8"}
+
+
+async def export_body(kind: ExportKind, export_format: ExportFormat, gzip: bool) -> AsyncIterator[bytes]:
+    """
+    The export_body function streams an export from its own read session, because the response body
+    is sent after the request dependencies are closed. Closing the generator closes the cursor and the session.
+
+    :param kind: ExportKind: The table to export
+    :param export_format: ExportFormat: NDJSON or CSV
+    :param gzip: bool: Compress the body
+    :return: An async iterator over the chunks of the body
+    """
+    async with sessionmanager.read_session() as db:
+        async with contextlib.aclosing(repository_exports.stream_export(kind, settings.export_batch_size, db)) as partitions:
+            if export_format == ExportFormat.csv:
+                chunks = encode_csv(repository_exports.export_columns(kind), partitions)
+            else:
+                chunks = encode_ndjson(partitions)
+            if gzip:
+                chunks = gzip_chunks(chunks)
+            async with contextlib.aclosing(chunks):
+                async for chunk in chunks:
+                    yield chunk
+
+
+@router.get(
+    "/{kind}",
+    dependencies=[Depends(admin)],
+    response_class=ExportResponse,
+    description="Administrator has access",
+)
+async def export(
+    kind: ExportKind,
+    export_format: ExportFormat = Query(default=ExportFormat.ndjson, alias="format"),
+    gzip: bool = False,
+) -> ExportResponse:
+    """
+    The export function streams every picture, comment or user as NDJSON (one JSON object per line) or CSV.
+    Rows are read from a server-side cursor and sent batch by batch, so the memory used by the export
+    does not depend on its size. With gzip=true the body is sent with Content-Encoding: gzip.
+
+    :param kind: ExportKind: pictures, comments or users
+    :param export_format: ExportFormat: ndjson or csv
+    :param gzip: bool: Compress the body
+    :return: A streaming response
+    """
+    headers = {"Content-Disposition": f'attachment; filename="{kind.value}.{export_format.value}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return ExportResponse(export_body(kind, export_format, gzip), media_type=MEDIA_TYPES[export_format], headers=headers)
@@ -1,18 +1,20 @@
 from typing import List
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, Response, UploadFile, status
 from fastapi_filter import FilterDepends
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.database.db import get_db, get_read_db
 from src.database.models import User
 from src.repository import pictures as repository_pictures
 from src.schemas.filters import PictureFilter, PictureOut
-from src.schemas.pictures import (PictureDescrUpdate, PictureNameUpdate,
-                                  PictureResponse, PictureTransform,
+from src.schemas.pictures import (PictureDB, PictureDescrUpdate, PictureNameUpdate,
+                                  PictureResponse, PictureTagsBulk,
+                                  PictureTagsBulkResult, PictureTransform,
                                   PictureUpload)
-from src.schemas.tags import TagResponse
+from src.schemas.tags import TagResponse, normalize_tagname
 from src.services.auth import auth_service
 from src.services.cloud_picture import CloudPicture
+from src.services.etag import etag, parse_if_match
 from src.services.roles import admin_moderator_user, admin_moderator
 from src.conf.messages import messages
 
@@ -46,7 +48,7 @@ async def upload_picture_to_cloudinary(
 
     :return: A dictionary with the picture data and a detail message
     """
-    public_id = CloudPicture.generate_folder_name(current_user.email)
+    public_id = CloudPicture.generate_public_id(current_user.email)
     transformation = {
         "height": transf.height,
         "width": transf.width,
@@ -63,7 +65,7 @@ async def upload_picture_to_cloudinary(
     
     tag_names = []
     if len(body.tags[0]) > 0:
-        tag_names = list(set(body.tags[0].split(",")))
+        tag_names = list({normalize_tagname(tag) for tag in body.tags[0].split(",")} - {""})
         if len(tag_names) > 5:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=messages.get_message("THE_NUMBER_OF_TAGS_SHOULD_NOT_EXCEED_5"))
 
@@ -78,14 +80,50 @@ async def upload_picture_to_cloudinary(
     }
 
 
+@router.post(
+    "/tags/bulk",
+    response_model=PictureTagsBulkResult,
+    dependencies=[Depends(admin_moderator_user)],
+    description="User, Moderator and Administrator have access",
+)
+async def bulk_update_picture_tags(
+    body: PictureTagsBulk,
+    current_user: User = Depends(auth_service.get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    The bulk_update_picture_tags function adds tags to and removes tags from many pictures in one request.
+    Users can change only their own pictures. The limits of the upload apply: at most 5 tags per picture
+    and 25 characters per tag.
+
+    :param body: PictureTagsBulk: The ids of the pictures and the names of the tags to add and to remove
+    :param current_user: User: Get the current user
+    :param db: AsyncSession: Get the database session
+    :return: The number of changed pictures, added tags and removed tags
+    """
+    add = list({normalize_tagname(tag) for tag in body.add} - {""})
+    remove = list({normalize_tagname(tag) for tag in body.remove} - {""})
+    if len(add) > 5:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=messages.get_message("THE_NUMBER_OF_TAGS_SHOULD_NOT_EXCEED_5"))
+    for tag in add:
+        if len(tag) > 25:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=messages.get_message("THE_LENGTH_OF_TAGS_SHOULD_NOT_EXCEED_25"))
+
+    result = await repository_pictures.bulk_update_picture_tags(body.picture_ids, add, remove, current_user, db)
+    return result
+
+
 @router.patch(
     "/{picture_id}/name",
+    response_model=PictureDB,
     dependencies=[Depends(admin_moderator_user)],
     description="User, Moderator and Administrator have access",
 )
 async def update_name_of_picture(
     picture_id: int,
     body: PictureNameUpdate,
+    response: Response,
+    if_match: str | None = Header(default=None),
     current_user: User = Depends(auth_service.get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
@@ -93,29 +131,38 @@ async def update_name_of_picture(
     The update_name_of_picture function updates the name of a picture.
         The function takes in an id, body, current_user and db as parameters.
         It then calls the update_picture_name function from repository/pictures.py to update the name of a picture.
+        With an If-Match header, the picture is changed only if its ETag still matches, otherwise the status code is 412.
 
     :param id: int: Specify the id of the picture that we want to update
     :param body: PictureNameUpdate: Get the new name of the picture from the request body
+    :param response: Response: Set the ETag of the new version
+    :param if_match: str | None: The ETags of the versions the client has seen
     :param current_user: User: Get the current user from the database
     :param db: AsyncSession: Get the database session
 
     :return: An updated name of the picture
     """
 
-    updated_name = await repository_pictures.update_picture_name(picture_id, body, current_user.id, db)
+    updated_name = await repository_pictures.update_picture_name(
+        picture_id, body, current_user.id, db, parse_if_match(if_match)
+    )
     if updated_name is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("COMMENT_HAS_NOT_BEEN_UPDATED"))
+    response.headers["ETag"] = etag(updated_name.version)
     return updated_name
 
 
 @router.patch(
     "/{picture_id}/description",
+    response_model=PictureDB,
     dependencies=[Depends(admin_moderator_user)],
     description="User, Moderator and Administrator have access",
 )
 async def update_description_of_picture(
     picture_id: int,
     body: PictureDescrUpdate,
+    response: Response,
+    if_match: str | None = Header(default=None),
     current_user: User = Depends(auth_service.get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
@@ -123,40 +170,49 @@ async def update_description_of_picture(
     The update_description_of_picture function updates the description of a picture.
         The function takes in an id, body and current_user as parameters.
         It then calls the update_picture_description function from repository/pictures.py to update the description of a picture.
+        With an If-Match header, the picture is changed only if its ETag still matches, otherwise the status code is 412.
 
     :param id: int: Get the id of the picture that we want to update
     :param body: PictureDescrUpdate: Pass the new description of the picture
+    :param response: Response: Set the ETag of the new version
+    :param if_match: str | None: The ETags of the versions the client has seen
     :param current_user: User: Get the current user
     :param db: AsyncSession: Get the database session
 
     :return: The updated_descr object
     """
 
-    updated_descr = await repository_pictures.update_picture_description(picture_id, body, current_user.id, db)
+    updated_descr = await repository_pictures.update_picture_description(
+        picture_id, body, current_user.id, db, parse_if_match(if_match)
+    )
     if updated_descr is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=messages.get_message("DESCRIPTION_HAS_NOT_BEEN_UPDATED"),
         )
+    response.headers["ETag"] = etag(updated_descr.version)
     return updated_descr
 
 
 @router.get("/", dependencies=[Depends(admin_moderator_user)], response_model=List[PictureOut])
 async def search_pictures(
-    picture_filter: PictureFilter = FilterDepends(PictureFilter), 
-    db: AsyncSession = Depends(get_db)):
+    picture_filter: PictureFilter = FilterDepends(PictureFilter),
+    comments_preview: int = Query(default=0, ge=0, le=20, description="Number of the latest comments to return with each picture"),
+    db: AsyncSession = Depends(get_read_db)):
     """
     The search_pictures function searches for pictures in the database.
         It takes a PictureFilter object as an argument, which is used to filter the search results.
-        The function returns a list of PictureOut objects.
+        The function returns a list of PictureOut objects with the number of comments of each picture
+        and, if comments_preview is set, its latest comments.
 
     :param picture_filter: PictureFilter: Filter the pictures
+    :param comments_preview: int: The number of the latest comments to return with each picture
     :param db: AsyncSession: Get the database session
     
     :return: A list of pictures
     """
 
-    pictures = await repository_pictures.search_pictures(picture_filter, db)
+    pictures = await repository_pictures.search_pictures(picture_filter, comments_preview, db)
     if not pictures:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("PICTURES_NOT_FOUND"))
     return pictures
@@ -169,13 +225,15 @@ async def search_pictures(
 )
 async def get_picture_by_id(
     picture_id: int,
+    response: Response,
     db: AsyncSession = Depends(get_db),
 ):
     """
-    The get_picture_by_id function returns a picture by its id.
+    The get_picture_by_id function returns a picture by its id, with its version in the ETag header.
         If the picture does not exist, it raises an HTTP 404 error.
 
     :param id: int: Specify the id of the picture to be returned
+    :param response: Response: Set the ETag of the picture
     :param db: AsyncSession: Pass the database connection to the function
 
     :return: A single picture
@@ -184,6 +242,7 @@ async def get_picture_by_id(
     pictures = await repository_pictures.get_picture_by_id(picture_id, db)
     if not pictures:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("PICTURE_NOT_FOUND"))
+    response.headers["ETag"] = etag(pictures[0].version)
     return pictures
 
 
@@ -229,6 +288,31 @@ async def get_qrcode_on_transformed_picture(picture_id: int, db: AsyncSession =
     return qrcode
 
 
+@router.get(
+    "/{picture_id}/similar",
+    response_model=List[PictureOut],
+    dependencies=[Depends(admin_moderator_user)],
+    description="User, Moderator and Administrator have access",
+)
+async def get_similar_pictures(
+    picture_id: int,
+    limit: int = Query(default=10, ge=1, le=50),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    The get_similar_pictures function returns the pictures with the tags most similar to the tags of the given picture.
+
+    :param picture_id: int: Get the picture id from the url
+    :param limit: int: The maximum number of similar pictures
+    :param db: AsyncSession: Get the database session
+    :return: A list of similar pictures, the most similar first
+    """
+    pictures = await repository_pictures.get_picture_by_id(picture_id, db)
+    if not pictures:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("PICTURE_NOT_FOUND"))
+    return await repository_pictures.get_similar_pictures(picture_id, limit, db)
+
+
 @router.get(
     "{picture_id}/tags",
     response_model=List[TagResponse],
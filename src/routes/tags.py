@@ -1,12 +1,13 @@
 from typing import List
 
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, Query, status, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.repository import tags as repository_tags
-from src.database.db import get_db
-from src.schemas.tags import TagResponse, TagModel
-from src.services.roles import admin_moderator
+from src.database.db import get_db, get_read_db
+from src.schemas.tags import RelatedTag, TagOrder, TagPage, TagResponse, TagModel, TagSuggestion
+from src.services.roles import admin_moderator, admin_moderator_user
+from src.services.tag_index import tag_index
 from src.conf.messages import messages
 
 router = APIRouter(tags=["tags"])
@@ -14,20 +15,52 @@ router = APIRouter(tags=["tags"])
 
 @router.get(
     "/",
-    response_model=List[TagResponse],
+    response_model=TagPage,
     dependencies=[Depends(admin_moderator)],
 )
-async def get_tags(db: AsyncSession = Depends(get_db)):
+async def get_tags(
+    order_by: TagOrder = TagOrder.id,
+    limit: int = Query(default=50, ge=1, le=200),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_read_db),
+):
     """
-    The get_tags function returns a list of all tags in the database.
+    The get_tags function returns one page of tags in the given order, e.g. order_by=-usage_count for trending tags.
+    Every next page is requested with the next_cursor of the previous one and the same order_by.
 
+    :param order_by: TagOrder: The column to order by; a leading minus means descending order
+    :param limit: int: The maximum number of tags on the page
+    :param cursor: str | None: The opaque cursor of the page to return
     :param db: AsyncSession: Get a database connection from the dependency injection container
-    
-    :return: A list of all tags in the database
+    :return: A page of tags
     """
 
-    tags = await repository_tags.get_tags(db)
-    return tags
+    tags, next_cursor = await repository_tags.get_tags(db, order_by, limit, cursor)
+    return {"items": tags, "next_cursor": next_cursor}
+
+
+@router.get(
+    "/suggest",
+    response_model=List[TagSuggestion],
+    dependencies=[Depends(admin_moderator_user)],
+    description="User, Moderator and Administrator have access",
+)
+async def suggest_tags(
+    prefix: str = Query(default="", max_length=50),
+    limit: int = Query(default=10, ge=1, le=50),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    The suggest_tags function returns the most popular tags starting with the given prefix, for autocomplete.
+    The tags come from the in-memory tag index of the worker; the database is only read if the index isn't loaded yet.
+
+    :param prefix: str: The beginning of the tag name, case-insensitive
+    :param limit: int: The maximum number of suggestions
+    :param db: AsyncSession: Get the database session to load the index
+    :return: A list of tags ordered by popularity
+    """
+    await tag_index.ensure_loaded(db)
+    return tag_index.suggest(prefix, limit)
 
 
 @router.get("/{tag_id}", dependencies=[Depends(admin_moderator)], response_model=TagResponse)
@@ -45,6 +78,31 @@ async def get_tag(tag_id: int, db: AsyncSession = Depends(get_db)):
     return tag
 
 
+@router.get(
+    "/{tag_id}/related",
+    response_model=List[RelatedTag],
+    dependencies=[Depends(admin_moderator_user)],
+    description="User, Moderator and Administrator have access",
+)
+async def get_related_tags(
+    tag_id: int,
+    limit: int = Query(default=10, ge=1, le=50),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    The get_related_tags function returns the tags most often used on the same pictures as the given tag.
+
+    :param tag_id: int: Get the tag_id from the url
+    :param limit: int: The maximum number of related tags
+    :param db: AsyncSession: Get the database session
+    :return: A list of related tags with the number of pictures they share with the tag
+    """
+    tag = await repository_tags.get_tag_by_id(tag_id, db)
+    if tag is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("TAGNAME_NOT_FOUND"))
+    return await repository_tags.get_related_tags(tag_id, limit, db)
+
+
 @router.patch("/{tag_id}", dependencies=[Depends(admin_moderator)], response_model=TagResponse)
 async def update_tag(tag_id: int, body: TagModel, db: AsyncSession = Depends(get_db)):
     """
@@ -62,7 +120,7 @@ async def update_tag(tag_id: int, body: TagModel, db: AsyncSession = Depends(get
     exist_tag = await repository_tags.get_tag_by_tagname(str(body.tagname), db)
 
     if tag:
-        if exist_tag is None:
+        if exist_tag is None or exist_tag.id == tag_id:
             updated_tag = await repository_tags.update_tag(tag_id, body, db)
             return updated_tag
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=messages.get_message("TAGNAME_ALREADY_EXIST"))
@@ -70,6 +128,27 @@ async def update_tag(tag_id: int, body: TagModel, db: AsyncSession = Depends(get
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("TAGNAME_NOT_FOUND"))
 
 
+@router.post("/{tag_id}/merge-into/{target_id}", dependencies=[Depends(admin_moderator)], response_model=TagResponse)
+async def merge_tag_into(tag_id: int, target_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    The merge_tag_into function merges a tag into another one: every picture tagged with tag_id is tagged
+    with target_id instead, and the tag with tag_id is deleted.
+
+    :param tag_id: int: The id of the tag to merge
+    :param target_id: int: The id of the tag to keep
+    :param db: AsyncSession: Get the database session
+    :return: The target tag
+    """
+    if tag_id == target_id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=messages.get_message("TAG_CANNOT_BE_MERGED_INTO_ITSELF"))
+    tag = await repository_tags.get_tag_by_id(tag_id, db)
+    target = await repository_tags.get_tag_by_id(target_id, db)
+    if tag is None or target is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("TAGNAME_NOT_FOUND"))
+
+    return await repository_tags.merge_tag_into(tag_id, target_id, db)
+
+
 @router.delete("/{tag_id}", dependencies=[Depends(admin_moderator)], status_code=status.HTTP_204_NO_CONTENT)
 async def delete_tag(tag_id: int, db: AsyncSession = Depends(get_db)):
     """
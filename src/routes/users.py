@@ -5,12 +5,12 @@ from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.conf.config import init_async_redis
-from src.database.db import get_db
+from src.database.db import get_db, get_read_db
 from src.database.models import Role, User
 from src.repository import users as repository_users
 from src.schemas.comments import CommentDB
 from src.schemas.filters import UserFilter, UserOut
-from src.schemas.users import Action, UserDb, UserInfo, UserProfile, UserResponse
+from src.schemas.users import Action, UserDb, UserDeleteResult, UserInfo, UserProfile, UserResponse
 from src.services.auth import auth_service
 from src.services.roles import admin, admin_moderator, admin_moderator_user
 from src.conf.messages import messages
@@ -65,7 +65,7 @@ async def edit_my_profile(
 @router.get("/", dependencies=[Depends(admin_moderator_user)], response_model=List[UserOut])
 async def search_users(
     user_filter: UserFilter = FilterDepends(UserFilter), 
-    db: AsyncSession = Depends(get_db)):
+    db: AsyncSession = Depends(get_read_db)):
     """
     The search_users function searches for users in the database.
 
@@ -102,6 +102,36 @@ async def user_profile(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("USER_NOT_FOUND"))
 
 
+@router.delete("/{username}", dependencies=[Depends(admin)], response_model=UserDeleteResult)
+async def delete_user(
+    username: str,
+    current_user: User = Depends(auth_service.get_current_user),
+    redis_client: Redis = Depends(init_async_redis),
+    db: AsyncSession = Depends(get_db),
+) -> dict:
+    """
+    The delete_user function deletes a user with their pictures, comments and ratings. Only administrators have access.
+    The rows are deleted by batches, and the stored pictures and avatar are queued for removal from Cloudinary.
+
+    :param username: str: The username of the user to delete
+    :param current_user: User: The administrator performing the deletion
+    :param redis_client: Redis: The Redis client used for caching (dependency)
+    :param db: AsyncSession: The database session (dependency)
+    :return: The number of deleted pictures, comments and ratings, and a message
+    """
+    user_delete = await repository_users.get_user_username(username, db)
+    if not user_delete:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("USER_NOT_FOUND"))
+    if user_delete.id == current_user.id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=messages.get_message("YOU_CANT_DELETE_YOURSELF"))
+
+    result = await repository_users.delete_user(user_delete.id, db)
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.get_message("USER_NOT_FOUND"))
+    await redis_client.delete(f"user:{user_delete.email}")
+    return {**result, "detail": f"{username} " + messages.get_message("USER_HAS_BEEN_DELETED")}
+
+
 @router.patch("/{username}", dependencies=[Depends(admin_moderator)], response_model=UserResponse)
 async def manage_user(
     username: str,
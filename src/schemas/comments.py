@@ -1,4 +1,8 @@
-from pydantic import BaseModel, ConfigDict
+import enum
+from datetime import datetime
+from typing import List
+
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
 
 class CommentCreate(BaseModel):
@@ -12,4 +16,54 @@ class CommentDB(CommentCreate):
     model_config = ConfigDict(from_attributes=True)
     id: int
     text: str
-    user_id: int
\ No newline at end of file
+    user_id: int
+    version: int
+
+
+class CommentPage(BaseModel):
+    items: List[CommentDB]
+    next_cursor: str | None = None
+
+
+class CommentBulkAction(enum.Enum):
+    delete: str = "delete"
+    hide: str = "hide"
+
+
+class CommentBulkDelete(BaseModel):
+    """
+    Selects the comments for a bulk moderation action.
+
+    Attributes:
+        user_id (int): Comments of this user.
+        picture_id (int): Comments to this picture.
+        created_after (datetime): Comments created at or after this time.
+        created_before (datetime): Comments created before this time.
+        text_pattern (str): A case-insensitive LIKE pattern for the text, e.g. "%buy now%".
+        flagged (bool): Comments flagged (or not flagged) by the moderation filter.
+        action (CommentBulkAction): Delete the comments or hide them.
+        batch_size (int): The maximum number of comments changed by one statement.
+    """
+
+    user_id: int | None = None
+    picture_id: int | None = None
+    created_after: datetime | None = None
+    created_before: datetime | None = None
+    text_pattern: str | None = None
+    flagged: bool | None = None
+    action: CommentBulkAction = CommentBulkAction.delete
+    batch_size: int = Field(default=500, ge=1, le=5000)
+
+    @model_validator(mode="after")
+    def check_filter(self):
+        filters = (self.user_id, self.picture_id, self.created_after, self.created_before, self.text_pattern, self.flagged)
+        if all(value is None for value in filters):
+            raise ValueError("At least one filter must be specified")
+        return self
+
+
+class CommentBulkResult(BaseModel):
+    action: CommentBulkAction
+    affected: int
+    batches: int
+    pictures: int
@@ -0,0 +1,12 @@
+import enum
+
+
+class ExportKind(str, enum.Enum):
+    pictures: str = "pictures"
+    comments: str = "comments"
+    users: str = "users"
+
+
+class ExportFormat(str, enum.Enum):
+    ndjson: str = "ndjson"
+    csv: str = "csv"
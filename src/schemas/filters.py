@@ -3,9 +3,10 @@ from typing import List, Optional
 from fastapi import Query
 from fastapi_filter import FilterDepends, with_prefix
 from fastapi_filter.contrib.sqlalchemy import Filter
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 from src.database.models import Comment, Picture, Role, Tag, User
+from src.schemas.tags import normalize_tagname
 
 
 class CommentOut(BaseModel):
@@ -23,6 +24,7 @@ class PictureOutBase(BaseModel):
     picture_url: str
     description: str
     rating_average: float
+    comments_count: int = 0
 
 class PictureOut(PictureOutBase):
     model_config = ConfigDict(from_attributes=True)
@@ -54,8 +56,14 @@ class CommentFilter(Filter):
 
 class TagFilter(Filter):
     id: Optional[int] = None
+    normalized_tagname: Optional[str] = None
     tagname__ilike: Optional[str] = None
 
+    @field_validator("normalized_tagname")
+    @classmethod
+    def normalize(cls, tagname: Optional[str]) -> Optional[str]:
+        return normalize_tagname(tagname) if tagname is not None else None
+
     class Constants(Filter.Constants):
         model = Tag
 
@@ -2,7 +2,7 @@ import enum
 from typing import List
 
 from fastapi import File, Query, UploadFile
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 
 class TagBase(BaseModel):
@@ -39,6 +39,7 @@ class PictureDB(PictureBase):
     id: int
     picture_url: str
     user_id: int
+    version: int
 
 
 class PictureResponse(BaseModel):
@@ -46,6 +47,24 @@ class PictureResponse(BaseModel):
     detail: str
 
 
+class PictureTagsBulk(BaseModel):
+    picture_ids: List[int] = Field(min_length=1, max_length=1000)
+    add: List[str] = []
+    remove: List[str] = []
+
+    @model_validator(mode="after")
+    def check_tags(self) -> "PictureTagsBulk":
+        if not self.add and not self.remove:
+            raise ValueError("at least one tag to add or remove is required")
+        return self
+
+
+class PictureTagsBulkResult(BaseModel):
+    pictures: int
+    added: int
+    removed: int
+
+
 class PictureNameUpdate(BaseModel):
     name: str
 
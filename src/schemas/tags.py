@@ -1,14 +1,62 @@
+import enum
+import unicodedata
 from datetime import datetime
+from typing import List
 
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
+
+
+def normalize_tagname(tagname: str) -> str:
+    """
+    The normalize_tagname function returns the form in which tag names are stored and compared:
+    Unicode NFKC, case-folded, with surrounding whitespace trimmed and inner whitespace collapsed.
+
+    :param tagname: str: The tag name as entered by the user
+    :return: The normalized tag name
+    """
+    tagname = unicodedata.normalize("NFKC", unicodedata.normalize("NFKC", tagname).casefold())
+    return " ".join(tagname.split())
 
 
 class TagModel(BaseModel):
     tagname: str
 
+    @field_validator("tagname")
+    @classmethod
+    def normalize(cls, tagname: str) -> str:
+        tagname = normalize_tagname(tagname)
+        if not tagname:
+            raise ValueError("tagname must not be blank")
+        return tagname
+
 
 class TagResponse(BaseModel):
     id: int
     tagname: str
+    usage_count: int = 0
     created_at: datetime
     updated_at: datetime
+
+
+class TagOrder(str, enum.Enum):
+    id: str = "id"
+    tagname: str = "tagname"
+    usage_count: str = "usage_count"
+    usage_count_desc: str = "-usage_count"
+
+
+class TagPage(BaseModel):
+    items: List[TagResponse]
+    next_cursor: str | None = None
+
+
+class RelatedTag(BaseModel):
+    id: int
+    tagname: str
+    count: int
+
+
+class TagSuggestion(BaseModel):
+    id: int
+    tagname: str
+    popularity: int
@@ -141,6 +141,26 @@ class UserProfile(BaseModel):
     created_at: datetime | None
     updated_at: datetime | None
     
+
+
+class UserDeleteResult(BaseModel):
+    """
+    Summarizes the deletion of a user.
+
+    Attributes:
+        pictures (int): The number of deleted pictures of the user, with their comments and ratings.
+        comments (int): The number of deleted comments of the user.
+        ratings (int): The number of deleted ratings of the user.
+        batches (int): The number of transactions the deletion took.
+        detail (str): A message.
+    """
+
+    pictures: int
+    comments: int
+    ratings: int
+    batches: int
+    detail: str
+
         
 class Action(enum.Enum):
     ban: str = "ban"
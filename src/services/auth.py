@@ -1,3 +1,4 @@
+import functools
 import pickle
 from datetime import datetime, timedelta
 from typing import Optional, Union
@@ -5,17 +6,16 @@ from typing import Optional, Union
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.conf.config import init_async_redis, settings
 from src.database.db import get_db
 from src.database.models import User
 from src.repository import users as repository_users
+from src.services import metrics
 
 
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
@@ -23,6 +23,19 @@ class Auth:
     def __init__(self):
         self._redis_cache = None
 
+    @functools.cached_property
+    def pwd_context(self):
+        """
+        The pwd_context property imports passlib and builds the bcrypt context on the first password
+        hashed or verified, instead of on import.
+
+        :param self: Represent the instance of the class
+        :return: A CryptContext instance
+        """
+        from passlib.context import CryptContext
+
+        return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
     @property
     async def redis_cache(self):
         if self._redis_cache is None:
@@ -150,6 +163,7 @@ class Auth:
             raise credentials_exception
 
         user_r = await (await self.redis_cache).get(f"user:{email}")
+        metrics.user_cache_requests.labels("miss" if user_r is None else "hit").inc()
         if user_r is None:
             user = await repository_users.get_user_by_email(email, db)
             if user is None:
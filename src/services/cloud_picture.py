@@ -1,19 +1,22 @@
 import hashlib
+import re
+import uuid
 
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
+from src.conf.config import init_cloudinary, settings
+from src.services import metrics, tracing
 
-from src.conf.config import settings
+UPLOAD_PATH = re.compile(r"/(?:image|video|raw)/upload/([^?#]+)")
+VERSION = re.compile(r"v\d+")
+TRANSFORMATION = re.compile(r"[a-z]{1,3}_[^/]*")
+EXTENSION = re.compile(r"\.[A-Za-z0-9]+$")
+UPLOAD_NAME = re.compile(r"[0-9a-f]{32}")
 
 
 class CloudPicture:
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True,
-    )
+    """
+    The Cloudinary SDK is imported and configured by the first method that calls the API,
+    the url helpers work without it.
+    """
 
     @staticmethod
     def generate_folder_name(email: str):
@@ -28,6 +31,28 @@ class CloudPicture:
         folder_name = hashlib.sha256(email.encode("utf-8")).hexdigest()[12]
         return folder_name
 
+    @staticmethod
+    def generate_public_id(email: str) -> str:
+        """
+        The generate_public_id function returns a new public_id in the folder of the user under settings.cloudinary_folder.
+        Every upload gets its own asset, so deleting the asset of one picture never touches another picture.
+
+        :param email: str: The email (or username) the folder name is generated from
+        :return: A string like "photoshare/a/3f2b..."
+        """
+        return f"{settings.cloudinary_folder}/{CloudPicture.generate_folder_name(email)}/{uuid.uuid4().hex}"
+
+    @staticmethod
+    def is_single_upload(public_id: str) -> bool:
+        """
+        The is_single_upload function tells whether a public_id was made by generate_public_id, so its asset
+        belongs to one upload only. Older public_ids were the folder name of the user, shared by all of their uploads.
+
+        :param public_id: str: The public_id of an asset
+        :return: True if no other picture or avatar can use the asset
+        """
+        return UPLOAD_NAME.fullmatch(public_id.rsplit("/", 1)[-1]) is not None
+
     @staticmethod
     def upload_picture(file, public_id: str, transformation: dict = {}):
         """
@@ -41,7 +66,14 @@ class CloudPicture:
         :return: A dict with the image's url, id and more
         """
 
-        r = cloudinary.uploader.upload(file, public_id=public_id, overwrite=True, transformation=transformation)
+        init_cloudinary()
+        import cloudinary.uploader
+
+        size = metrics.upload_size(file)
+        with metrics.storage_request_duration.labels("upload").time(), tracing.span("cloudinary upload", {"public_id": public_id}):
+            r = cloudinary.uploader.upload(file, public_id=public_id, overwrite=True, transformation=transformation)
+        if size:
+            metrics.storage_upload_bytes.inc(size)
         return r
 
     @staticmethod
@@ -56,5 +88,72 @@ class CloudPicture:
         :return: A url for a picture
         """
 
+        cloudinary = init_cloudinary()
         src_url = cloudinary.CloudinaryImage(public_id).build_url(width=350, height=350, crop="fill", version=r.get("version"))
         return src_url
+
+    @staticmethod
+    def is_stored(url: str | None) -> bool:
+        """
+        The is_stored function tells whether a url points to an asset in our Cloudinary cloud,
+        as opposed to e.g. a Gravatar avatar.
+
+        :param url: str | None: The url of a picture or an avatar
+        :return: True if the asset is stored in Cloudinary
+        """
+        return bool(url) and url.startswith(f"https://res.cloudinary.com/{settings.cloudinary_name}/")
+
+    @staticmethod
+    def public_id_from_url(url: str | None) -> str | None:
+        """
+        The public_id_from_url function extracts the public_id from the url of an asset stored in our Cloudinary cloud.
+        The transformations, the version and the file extension in the url are skipped.
+
+        :param url: str | None: The url of a picture or an avatar
+        :return: The public_id, or None if the url is not one of our assets
+        """
+        if not CloudPicture.is_stored(url):
+            return None
+        match = UPLOAD_PATH.search(url)
+        if match is None:
+            return None
+        segments = match.group(1).split("/")
+        versions = [index for index, segment in enumerate(segments) if VERSION.fullmatch(segment)]
+        if versions:
+            segments = segments[versions[0] + 1:]
+        else:
+            while len(segments) > 1 and ("," in segments[0] or TRANSFORMATION.fullmatch(segments[0])):
+                segments = segments[1:]
+        return EXTENSION.sub("", "/".join(segments)) or None
+
+    @staticmethod
+    def delete_pictures(public_ids: list[str]) -> dict:
+        """
+        The delete_pictures function deletes up to 100 assets with one call of the Admin API.
+
+        :param public_ids: list[str]: The public_ids of the assets
+        :return: A dict with the status of every public_id under "deleted": "deleted", "not_found" or an error
+        """
+        init_cloudinary()
+        import cloudinary.api
+
+        with metrics.storage_request_duration.labels("delete").time(), tracing.span("cloudinary delete", {"count": len(public_ids)}):
+            return cloudinary.api.delete_resources(public_ids)
+
+    @staticmethod
+    def list_pictures(prefix: str, next_cursor: str | None = None) -> dict:
+        """
+        The list_pictures function returns one page of the uploaded assets whose public_id starts with the prefix.
+
+        :param prefix: str: The folder to list, e.g. "photoshare/"
+        :param next_cursor: str | None: The cursor returned with the previous page
+        :return: A dict with the "resources" of the page and the "next_cursor" of the next one, if any
+        """
+        init_cloudinary()
+        import cloudinary.api
+
+        options = {"type": "upload", "prefix": prefix, "max_results": 500}
+        if next_cursor:
+            options["next_cursor"] = next_cursor
+        with metrics.storage_request_duration.labels("list").time(), tracing.span("cloudinary list", {"prefix": prefix}):
+            return cloudinary.api.resources(**options)
@@ -1,25 +1,37 @@
+import functools
 from pathlib import Path
 
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
-from fastapi_mail.errors import ConnectionErrors
 from pydantic import EmailStr
 
 from src.conf.config import settings
+from src.services import metrics, tracing
 from src.services.auth import auth_service
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=settings.mail_from,
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="Desired Name",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / "templates",
-)
+
+@functools.cache
+def get_mail():
+    """
+    The get_mail function imports fastapi_mail and builds the mail client on the first email sent,
+    so that importing the app neither loads the mail stack nor validates the mail settings.
+
+    :return: A FastMail instance
+    """
+    from fastapi_mail import ConnectionConfig, FastMail
+
+    conf = ConnectionConfig(
+        MAIL_USERNAME=settings.mail_username,
+        MAIL_PASSWORD=settings.mail_password,
+        MAIL_FROM=settings.mail_from,
+        MAIL_PORT=settings.mail_port,
+        MAIL_SERVER=settings.mail_server,
+        MAIL_FROM_NAME="Desired Name",
+        MAIL_STARTTLS=False,
+        MAIL_SSL_TLS=True,
+        USE_CREDENTIALS=True,
+        VALIDATE_CERTS=True,
+        TEMPLATE_FOLDER=Path(__file__).parent / "templates",
+    )
+    return FastMail(conf)
 
 
 async def send_email(email: EmailStr, username: str, host: str, subject: str, template: str):
@@ -38,6 +50,9 @@ async def send_email(email: EmailStr, username: str, host: str, subject: str, te
     :param template: str: Specify the template to use for sending the email
     :return: A coroutine that is not awaited
     """
+    from fastapi_mail import MessageSchema, MessageType
+    from fastapi_mail.errors import ConnectionErrors
+
     try:
         token_verification = auth_service.create_email_token({"sub": email})
         message = MessageSchema(
@@ -47,7 +62,8 @@ async def send_email(email: EmailStr, username: str, host: str, subject: str, te
             subtype=MessageType.html,
         )
 
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name=template)
+        fm = get_mail()
+        with metrics.background_tasks_in_progress.labels("send_email").track_inprogress(), tracing.span("send_email", {"template": template}):
+            await fm.send_message(message, template_name=template)
     except ConnectionErrors as err:
         print(err)
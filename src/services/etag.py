@@ -0,0 +1,33 @@
+from fastapi import HTTPException, status
+
+from src.conf.messages import messages
+
+
+def etag(version: int) -> str:
+    """
+    The etag function returns the ETag header of a picture or a comment, which is its version number.
+
+    :param version: int: The version column of the row
+    :return: A strong entity tag, e.g. "3"
+    """
+    return f'"{version}"'
+
+
+def parse_if_match(if_match: str | None) -> list[int] | None:
+    """
+    The parse_if_match function reads the versions accepted by an If-Match header.
+    A missing header and "*" accept any version. Weak and malformed tags never match,
+    as If-Match uses the strong comparison, so they fail with status code 412.
+
+    :param if_match: str | None: The value of the If-Match header
+    :return: The accepted versions, or None if any version is accepted
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    versions = []
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if len(tag) < 3 or tag[0] != '"' or tag[-1] != '"' or not tag[1:-1].isdigit():
+            raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail=messages.get_message("RESOURCE_WAS_MODIFIED"))
+        versions.append(int(tag[1:-1]))
+    return versions
@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+import json
+import logging
+from typing import AsyncIterator
+
+import redis.asyncio as redis_async
+
+from src.conf.config import init_async_redis, settings
+
+logger = logging.getLogger("uvicorn")
+
+
+def picture_channel(picture_id: int) -> str:
+    """
+    The picture_channel function returns the name of the Redis channel with the events of a picture.
+
+    :param picture_id: int: The id of the picture
+    :return: The name of the channel
+    """
+    return f"picture:{picture_id}:events"
+
+
+class Subscription:
+    """
+    A bounded queue of events for one connected client.
+
+    When the client reads slower than events arrive, the oldest events are dropped instead of
+    letting the queue grow, and the number of dropped events is kept so the client can be told to refetch.
+    """
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, message: str) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    def take_dropped(self) -> int:
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class EventBroker:
+    """
+    Publishes events to Redis and fans them out to the clients connected to this worker.
+
+    Every worker holds a single Redis pub/sub connection and subscribes to a channel once,
+    no matter how many of its clients listen to that channel. The subscription is dropped
+    when the last client of the channel disconnects.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._redis: redis_async.Redis | None = None
+        self._pubsub = None
+        self._listener: asyncio.Task | None = None
+        self._subscribers: dict[str, set[Subscription]] = {}
+        self._lock = asyncio.Lock()
+
+    async def redis(self) -> redis_async.Redis:
+        if self._redis is None:
+            self._redis = await init_async_redis()
+        return self._redis
+
+    async def publish(self, channel: str, event: str, data: dict) -> None:
+        """
+        The publish function sends an event to every worker listening to the channel.
+        A failure to reach Redis is logged and never breaks the write that produced the event.
+
+        :param channel: str: The name of the channel
+        :param event: str: The type of the event, e.g. comment_created
+        :param data: dict: The payload of the event
+        :return: None
+        """
+        message = json.dumps({"event": event, "data": data}, default=str)
+        try:
+            await (await self.redis()).publish(channel, message)
+        except redis_async.RedisError as e:
+            logger.error(f"Error publishing event to {channel}: {e}")
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, channel: str) -> AsyncIterator[Subscription]:
+        """
+        Provides an asynchronous context manager that registers a client for the events of a channel.
+
+        Usage:
+            async with event_broker.subscribe(picture_channel(picture_id)) as subscription:
+                message = await subscription.queue.get()
+
+        :param channel: str: The name of the channel
+        :return: The subscription of the client
+        """
+        subscription = Subscription(self.queue_size)
+        async with self._lock:
+            subscribers = self._subscribers.setdefault(channel, set())
+            subscribers.add(subscription)
+            if len(subscribers) == 1:
+                if self._pubsub is None:
+                    self._pubsub = (await self.redis()).pubsub()
+                await self._pubsub.subscribe(channel)
+            if self._listener is None or self._listener.done():
+                self._listener = asyncio.create_task(self._listen())
+        try:
+            yield subscription
+        finally:
+            async with self._lock:
+                subscribers = self._subscribers.get(channel, set())
+                subscribers.discard(subscription)
+                if not subscribers:
+                    self._subscribers.pop(channel, None)
+                    with contextlib.suppress(redis_async.RedisError):
+                        await self._pubsub.unsubscribe(channel)
+
+    def dispatch(self, channel: str, message: str) -> None:
+        """
+        The dispatch function puts a message received from Redis into the queue of every client of the channel.
+
+        :param channel: str: The name of the channel
+        :param message: str: The message received from Redis
+        :return: None
+        """
+        for subscription in self._subscribers.get(channel, ()):
+            subscription.put(message)
+
+    async def _listen(self) -> None:
+        while self._subscribers:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except redis_async.RedisError as e:
+                logger.error(f"Error reading events from Redis: {e}")
+                await asyncio.sleep(1)
+                continue
+            if message is None:
+                continue
+            channel = message["channel"]
+            data = message["data"]
+            self.dispatch(
+                channel.decode("utf-8") if isinstance(channel, bytes) else channel,
+                data.decode("utf-8") if isinstance(data, bytes) else data,
+            )
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._listener
+        if self._pubsub is not None:
+            await self._pubsub.close()
+        # The client is shared by the worker and closed with close_async_redis.
+        self._redis = None
+
+
+event_broker = EventBroker(queue_size=settings.events_queue_size)
@@ -0,0 +1,85 @@
+import csv
+import enum
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Sequence
+
+import anyio
+from sqlalchemy import Row
+from starlette.responses import StreamingResponse
+from starlette.types import Send
+
+
+def plain_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+
+async def encode_ndjson(partitions: AsyncIterator[Sequence[Row]]) -> AsyncIterator[bytes]:
+    """
+    The encode_ndjson function encodes batches of rows as newline-delimited JSON, one object per row
+    and one chunk per batch.
+
+    :param partitions: AsyncIterator[Sequence[Row]]: The batches of rows
+    :return: An async iterator over the encoded chunks
+    """
+    async for rows in partitions:
+        lines = (json.dumps({key: plain_value(value) for key, value in row._mapping.items()}) for row in rows)
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+async def encode_csv(columns: list[str], partitions: AsyncIterator[Sequence[Row]]) -> AsyncIterator[bytes]:
+    """
+    The encode_csv function encodes batches of rows as CSV with a header line, one chunk per batch.
+
+    :param columns: list[str]: The names of the columns for the header line
+    :param partitions: AsyncIterator[Sequence[Row]]: The batches of rows
+    :return: An async iterator over the encoded chunks
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for rows in partitions:
+        writer.writerows([plain_value(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """
+    The gzip_chunks function compresses a stream into a single gzip member, flushing the compressor
+    after every chunk so the client receives data as soon as it is read.
+
+    :param chunks: AsyncIterator[bytes]: The uncompressed chunks
+    :param level: int: The compression level
+    :return: An async iterator over the compressed chunks
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class ExportResponse(StreamingResponse):
+    """
+    A StreamingResponse that always closes its body iterator, so the database cursor behind it is released
+    as soon as the response ends, including when the client disconnects in the middle of it.
+    On http.disconnect Starlette cancels the streaming task, so the cleanup is shielded from that cancellation.
+    """
+
+    async def stream_response(self, send: Send) -> None:
+        try:
+            await super().stream_response(send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
@@ -0,0 +1,156 @@
+"""
+Prometheus metrics of the API, exposed at /metrics in the Prometheus text format.
+
+With several workers, the serve command points PROMETHEUS_MULTIPROC_DIR at a directory shared by the workers
+before they start. Every worker then writes its samples to memory-mapped files in that directory, and the worker
+that answers a scrape aggregates the files of all of them. The variable must be set before prometheus_client
+is imported, which is why the workers read it from their environment instead of from settings.
+"""
+import functools
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from starlette.routing import Match, Mount
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+HTTP_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+
+http_requests = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Duration of HTTP requests", ["method", "route"], buckets=LATENCY_BUCKETS
+)
+http_requests_in_progress = Gauge(
+    "http_requests_in_progress", "HTTP requests being served", ["method", "route"], multiprocess_mode="livesum"
+)
+
+db_pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a database connection", buckets=FAST_BUCKETS
+)
+db_pool_checkout_timeouts = Counter("db_pool_checkout_timeouts_total", "Checkouts that timed out waiting for a connection")
+db_query_duration = Histogram("db_query_duration_seconds", "Duration of SQL statements", buckets=FAST_BUCKETS)
+db_queries_per_request = Histogram(
+    "db_queries_per_request", "Number of SQL statements per HTTP request", buckets=QUERY_COUNT_BUCKETS
+)
+
+redis_command_duration = Histogram(
+    "redis_command_duration_seconds", "Duration of Redis commands", ["command"], buckets=FAST_BUCKETS
+)
+user_cache_requests = Counter("user_cache_requests_total", "Lookups of the user: cache in Redis", ["result"])
+
+storage_request_duration = Histogram(
+    "storage_request_duration_seconds", "Duration of Cloudinary API calls", ["operation"], buckets=LATENCY_BUCKETS
+)
+storage_upload_bytes = Counter("storage_upload_bytes_total", "Bytes uploaded to Cloudinary")
+storage_gc_queue_depth = Gauge(
+    "storage_gc_queue_depth", "Assets waiting in pending_deletions", multiprocess_mode="livemax"
+)
+background_tasks_in_progress = Gauge(
+    "background_tasks_in_progress", "Background tasks being run", ["task"], multiprocess_mode="livesum"
+)
+
+
+def multiprocess_enabled() -> bool:
+    return bool(os.environ.get(MULTIPROC_DIR_ENV))
+
+
+def render() -> tuple[bytes, str]:
+    """
+    The render function returns the current value of every metric in the Prometheus text format,
+    summed over all the workers in multi-worker mode.
+
+    :return: The body and the content type of the response
+    """
+    registry = REGISTRY
+    if multiprocess_enabled():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """
+    The mark_process_dead function removes the live gauges of the current worker from the shared directory
+    when the worker stops, so that its requests in progress are not counted anymore.
+
+    :return: None
+    """
+    if multiprocess_enabled():
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def upload_size(file) -> int | None:
+    """
+    The upload_size function returns the size of a seekable file without reading it, and rewinds it.
+
+    :param file: A file object
+    :return: The size in bytes, or None if the file is not seekable
+    """
+    try:
+        position = file.tell()
+        size = file.seek(0, os.SEEK_END)
+        file.seek(position)
+        return size - position
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class MetricsMiddleware:
+    """
+    An ASGI middleware that measures the latency, the status and the number in progress of the HTTP requests
+    by route template, e.g. /api/pictures/{picture_id}, so that the number of series does not grow with the ids.
+    The template of a method and path is looked up in the routes of the app once and cached, as the router does:
+    a route of the method wins over an earlier route of the same path with other methods, which only serves
+    as the template of a 405. The paths that match no route are counted together as "unmatched",
+    and the methods other than the standard ones as "OTHER".
+    """
+
+    def __init__(self, app: ASGIApp, routes: list, cache_size: int = 4096):
+        self.app = app
+        self.routes = routes
+        self.route_template = functools.lru_cache(maxsize=cache_size)(self._route_template)
+
+    def _route_template(self, method: str, path: str) -> str:
+        scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+        partial = None
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                partial = route
+                break
+            if match == Match.PARTIAL and partial is None:
+                partial = route
+        if partial is None:
+            return "unmatched"
+        return partial.path + "/{path}" if isinstance(partial, Mount) else partial.path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"] if scope["method"] in HTTP_METHODS else "OTHER"
+        route = self.route_template(method, scope["path"])
+        status = 500
+        in_progress = http_requests_in_progress.labels(method, route)
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_request_duration.labels(method, route).observe(time.perf_counter() - start)
+            http_requests.labels(method, route, str(status)).inc()
+            in_progress.dec()
@@ -0,0 +1,68 @@
+import random
+from functools import lru_cache
+from typing import Iterable
+
+MERSENNE_PRIME = (1 << 61) - 1
+BUCKET_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+class MinHasher:
+    """
+    MinHash signatures of tag sets and their LSH band buckets.
+
+    Two tag sets with Jaccard similarity s share a band with probability 1 - (1 - s ** rows) ** bands,
+    so pictures with similar tags land in at least one common bucket, and unrelated pictures rarely do.
+    The hash functions are derived from a fixed seed: buckets are stored in the database and must not change
+    between processes. The hash values of every tag are cached, so a signature is an element-wise minimum.
+    Changing seed, bands or rows requires rebuilding the stored buckets.
+    """
+
+    def __init__(self, bands: int = 16, rows: int = 2, seed: int = 1):
+        self.bands = bands
+        self.rows = rows
+        rng = random.Random(seed)
+        self._hashes = [
+            (rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(bands * rows)
+        ]
+        self._tag_hashes = lru_cache(maxsize=65536)(self._hash_tag)
+
+    def _hash_tag(self, tag_id: int) -> tuple[int, ...]:
+        return tuple((a * tag_id + b) % MERSENNE_PRIME for a, b in self._hashes)
+
+    def signature(self, tag_ids: Iterable[int]) -> list[int]:
+        """
+        The signature function returns the MinHash signature of a set of tag ids.
+
+        :param tag_ids: Iterable[int]: The ids of the tags of a picture
+        :return: A list of bands * rows minimum hash values, or an empty list for an empty set
+        """
+        hashes = [self._tag_hashes(tag_id) for tag_id in set(tag_ids)]
+        if not hashes:
+            return []
+        return list(map(min, *hashes)) if len(hashes) > 1 else list(hashes[0])
+
+    def band_buckets(self, signature: list[int]) -> list[int]:
+        """
+        The band_buckets function hashes every band of a signature to a bucket number below 2 ** 61.
+
+        :param signature: list[int]: A signature returned by signature
+        :return: A list with one bucket per band, or an empty list for an empty signature
+        """
+        rows = [signature[row::self.rows] for row in range(self.rows)]
+        buckets = rows[0]
+        for values in rows[1:]:
+            buckets = [(bucket * BUCKET_MULTIPLIER + value) % MERSENNE_PRIME for bucket, value in zip(buckets, values)]
+        return buckets
+
+    def buckets(self, tag_ids: Iterable[int]) -> list[int]:
+        return self.band_buckets(self.signature(tag_ids))
+
+
+def jaccard(first: Iterable[int], second: Iterable[int]) -> float:
+    first, second = set(first), set(second)
+    if not first and not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+minhasher = MinHasher()
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import unicodedata
+from collections import deque
+from typing import Iterable, Iterator, Literal
+
+from fastapi import HTTPException, status
+
+from src.conf.config import settings
+from src.conf.messages import messages
+
+logger = logging.getLogger("uvicorn")
+
+
+def normalize_text(text: str) -> str:
+    """
+    The normalize_text function brings text to the form the blocklist is matched in:
+    Unicode NFKC (so look-alike characters collapse), case-folded and with runs of whitespace replaced by one space.
+
+    :param text: str: The text to normalize
+    :return: The normalized text
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+class AhoCorasick:
+    """
+    An Aho–Corasick automaton over a list of terms.
+
+    The automaton is compiled once, after which a scan walks the text a single time,
+    so its cost depends on the length of the text and not on the number of terms.
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        self.terms: list[str] = []
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[tuple[int, ...]] = [()]
+
+        for term in dict.fromkeys(normalize_text(term).strip() for term in terms):
+            if term:
+                self._add(term)
+        self._build()
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def _add(self, term: str) -> None:
+        node = 0
+        for char in term:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            node = next_node
+        self._output[node] = (len(self.terms),)
+        self.terms.append(term)
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+                queue.append(child)
+
+    def iter_matches(self, text: str) -> Iterator[tuple[int, int]]:
+        """
+        The iter_matches function yields every occurrence of a term in an already normalized text.
+
+        :param text: str: The normalized text to scan
+        :return: Pairs of (start index, term index)
+        """
+        goto, fail, output, terms = self._goto, self._fail, self._output, self.terms
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for term_index in output[node]:
+                yield index - len(terms[term_index]) + 1, term_index
+
+    def find(self, text: str, whole_words: bool = True) -> list[str]:
+        """
+        The find function returns the terms found in a text.
+        With whole_words, a term only matches when it isn't part of a longer word, so "ass" doesn't match "class".
+
+        :param text: str: The text to scan
+        :param whole_words: bool: Match whole words only
+        :return: The list of the found terms without duplicates
+        """
+        text = normalize_text(text)
+        found = {}
+        for start, term_index in self.iter_matches(text):
+            end = start + len(self.terms[term_index])
+            if whole_words and ((start > 0 and text[start - 1].isalnum()) or (end < len(text) and text[end].isalnum())):
+                continue
+            found[self.terms[term_index]] = None
+        return list(found)
+
+
+class ModerationService:
+    """
+    Checks comment text against the blocklist file configured by moderation_blocklist_path.
+
+    Every worker compiles the same file into an automaton. The lifespan loads it in a thread before the worker
+    serves requests, and a background task then watches the modification time of the file and rebuilds the
+    automaton in a thread, then swaps it in, so requests keep using the previous automaton while a large list
+    is being compiled. The automaton is never compiled on the event loop: until the first load has finished,
+    no term is blocked.
+    """
+
+    def __init__(self, path: str | None, policy: Literal["reject", "flag"] = "reject", reload_seconds: float = 30.0):
+        self.path = path
+        self.policy = policy
+        self.reload_seconds = reload_seconds
+        self._automaton = AhoCorasick([])
+        self._mtime: float | None = None
+        self._watcher: asyncio.Task | None = None
+
+    @staticmethod
+    def read_terms(path: str) -> list[str]:
+        with open(path, encoding="utf-8") as file:
+            return [line for line in (line.strip() for line in file) if line and not line.startswith("#")]
+
+    def load(self) -> bool:
+        """
+        The load function compiles the blocklist file if it has changed since the last load.
+
+        :return: True if a new automaton was built
+        """
+        if not self.path:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            logger.error(f"Error reading moderation blocklist: {e}")
+            self._mtime = -1.0
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            terms = self.read_terms(self.path)
+        except (OSError, ValueError) as e:
+            # The previous automaton stays in use; the file is read again once it changes.
+            logger.error(f"Error reading moderation blocklist: {e}")
+            self._mtime = mtime
+            return False
+        self._automaton = AhoCorasick(terms)
+        self._mtime = mtime
+        logger.info(f"Moderation blocklist loaded: {len(self._automaton)} terms")
+        return True
+
+    async def watch(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.load)
+            except Exception as e:
+                logger.exception(f"Error reloading moderation blocklist: {e}")
+            await asyncio.sleep(self.reload_seconds)
+
+    def start(self) -> None:
+        if self.path and self._watcher is None:
+            self._watcher = asyncio.create_task(self.watch())
+
+    async def stop(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+
+    def find(self, text: str) -> list[str]:
+        return self._automaton.find(text)
+
+    def moderate(self, text: str) -> bool:
+        """
+        The moderate function applies the moderation policy to a comment text.
+        With the reject policy a text containing a blocked term raises an HTTPException with status code 400;
+        with the flag policy the text is accepted and the function returns True, so the comment is stored as flagged.
+
+        :param text: str: The text of the comment
+        :return: True if the comment must be flagged
+        """
+        if not self.find(text):
+            return False
+        if self.policy == "flag":
+            return True
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=messages.get_message("COMMENT_REJECTED_BY_MODERATION"))
+
+
+moderation_service = ModerationService(
+    settings.moderation_blocklist_path, settings.moderation_policy, settings.moderation_reload_seconds
+)
@@ -0,0 +1,81 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import AsyncIterator, Sequence
+
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.messages import messages
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(*values) -> str:
+    """
+    The encode_cursor function packs the sort key of the last row of a page into an opaque string.
+    Clients send it back unchanged to get the next page, so the format can change without breaking them.
+
+    :param values: The values of the sort key, e.g. created_at and id of the last row
+    :return: A url-safe base64 string
+    """
+    raw = json.dumps([_encode_value(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _has_type(value, expected: type | tuple[type, ...]) -> bool:
+    # bool is a subclass of int, but true and false are not ids or counts.
+    return isinstance(value, expected) and not (isinstance(value, bool) and expected is not bool)
+
+
+def decode_cursor(cursor: str, *types: type | tuple[type, ...]) -> list:
+    """
+    The decode_cursor function unpacks a cursor created by encode_cursor and checks the type of every value,
+    so a crafted cursor never reaches the database as a value of the wrong type.
+    If the cursor is damaged, holds a different number of values or a value of another type,
+    it raises an HTTPException with status code 400.
+
+    :param cursor: str: The cursor received from the client
+    :param types: type | tuple[type, ...]: The type of every value of the sort key, e.g. datetime and int
+    :return: A list with the values of the sort key
+    """
+    invalid = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=messages.get_message("INVALID_CURSOR"))
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        values = [_decode_value(value) for value in values]
+    except (ValueError, TypeError, UnicodeEncodeError, binascii.Error):
+        raise invalid
+    if not all(_has_type(value, expected) for value, expected in zip(values, types)):
+        raise invalid
+    return values
+
+
+async def id_batches(column, batch_size: int, db: AsyncSession) -> AsyncIterator[Sequence[int]]:
+    """
+    The id_batches function yields all ids of a table in order, batch_size ids at a time,
+    walking the primary key by keyset so every batch costs the same.
+
+    :param column: The id column of the table
+    :param batch_size: int: The number of ids per batch
+    :param db: AsyncSession: Pass the database session to the function
+    :return: An async iterator of lists of ids
+    """
+    last_id = 0
+    while ids := (await db.execute(select(column).where(column > last_id).order_by(column).limit(batch_size))).scalars().all():
+        yield ids
+        last_id = ids[-1]
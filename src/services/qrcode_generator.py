@@ -1,13 +1,39 @@
-import qrcode
 import base64
 import mimetypes
-import requests
 from io import BytesIO
+from typing import TYPE_CHECKING
+
+from src.services import tracing
+
+if TYPE_CHECKING:
+    import requests
 
 
 class QRGenerator:
-    @staticmethod
-    def generate_qrcode(link: str):
+    """
+    Generates QR codes of picture urls. The pictures are fetched through one HTTP session per worker,
+    opened by the first QR code, so the connections to the storage are kept alive between requests.
+    requests, qrcode and Pillow are imported on first use too.
+    """
+
+    def __init__(self, timeout: float = 10.0):
+        self.timeout = timeout
+        self._session: "requests.Session | None" = None
+
+    @property
+    def session(self) -> "requests.Session":
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+        return self._session
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def generate_qrcode(self, link: str):
         """
         The generate_qrcode function takes a link as an argument and returns the base64 encoded QR code of that link.
         The function first makes a GET request to the URL provided in order to get its content type. If it is successful, 
@@ -21,7 +47,8 @@ class QRGenerator:
         :return: A string containing a base64-encoded qr code image
 
         """
-        response = requests.get(link)
+        with tracing.span("qrcode fetch", {"url.full": link}):
+            response = self.session.get(link, headers=tracing.inject_headers(), timeout=self.timeout)
 
         if response.status_code == 200:
             content_type = response.headers.get("content-type")
@@ -30,7 +57,10 @@ class QRGenerator:
                 object_format = mimetypes.guess_extension(content_type)
 
                 if object_format:
-                    qrcode_img = qrcode.make(link)
+                    import qrcode
+
+                    with tracing.span("qrcode make"):
+                        qrcode_img = qrcode.make(link)
                     buffered = BytesIO()
                     qrcode_img.save(buffered)
                     base64code_object = base64.b64encode(buffered.getvalue()).decode("utf-8")
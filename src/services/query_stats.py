@@ -0,0 +1,199 @@
+import contextlib
+import logging
+import os
+import sys
+import time
+from contextvars import ContextVar
+from typing import Iterator
+
+import greenlet
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.conf.config import settings
+from src.services import metrics, tracing
+
+logger = logging.getLogger("uvicorn")
+
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE_DIR = os.path.join(SOURCE_DIR, "database")
+SERVICE_FILE = os.path.abspath(__file__)
+
+
+class QueryStats:
+    """
+    The number of SQL statements and the time spent in them during a request or a tracked block.
+    Blocks can be nested: a statement is counted in the innermost block and in all the enclosing ones.
+    """
+
+    def __init__(self, parent: "QueryStats | None" = None, keep_statements: bool = False):
+        self.parent = parent
+        self.keep_statements = keep_statements
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: list[tuple[str, float]] = []
+
+    def record(self, statement: str, seconds: float) -> None:
+        stats = self
+        while stats is not None:
+            stats.count += 1
+            stats.seconds += seconds
+            if stats.keep_statements:
+                stats.statements.append((statement, seconds))
+            stats = stats.parent
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.seconds * 1000:.1f};desc="{self.count} queries"'
+
+
+_current_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+@contextlib.contextmanager
+def track_queries(keep_statements: bool = False) -> Iterator[QueryStats]:
+    """
+    The track_queries function counts the SQL statements executed by the current task inside the with block.
+
+    :param keep_statements: bool: Keep the text and the duration of every statement
+    :return: The QueryStats of the block
+    """
+    stats = QueryStats(_current_stats.get(), keep_statements)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def parameter_shape(parameters, executemany: bool = False) -> str:
+    """
+    The parameter_shape function describes the bind parameters of a statement by their names and types,
+    without their values, so it's safe to log.
+
+    :param parameters: The parameters passed to the DBAPI cursor
+    :param executemany: bool: Whether parameters is a list of parameter sets
+    :return: A string like {name: str, id: int} or 100 x (int, int)
+    """
+    if executemany:
+        if not parameters:
+            return "[]"
+        return f"{len(parameters)} x {parameter_shape(parameters[0])}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{name}: {type(value).__name__}" for name, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+
+def query_origin() -> str | None:
+    """
+    The query_origin function finds the function of the application that issued the statement being executed.
+    The async SQLAlchemy API runs the statement in a greenlet, so the frames of the awaiting coroutines
+    are found in the parent greenlets.
+
+    :return: A string like src.repository.tags.get_tags:42, or None if the statement didn't come from src
+    """
+    frame = sys._getframe(1)
+    current = greenlet.getcurrent()
+    while True:
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(SOURCE_DIR) and not filename.startswith(DATABASE_DIR) and filename != SERVICE_FILE:
+                module = os.path.relpath(filename, os.path.dirname(SOURCE_DIR))[:-3].replace(os.sep, ".")
+                return f"{module}.{frame.f_code.co_name}:{frame.f_lineno}"
+            frame = frame.f_back
+        current = current.parent
+        if current is None:
+            return None
+        frame = current.gr_frame
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if tracing.enabled():
+        context._query_span = tracing.start_span(
+            statement.split(None, 1)[0].upper() if statement.strip() else "SQL",
+            {"db.system": conn.dialect.name, "db.statement": statement[:1000]},
+        )
+    context._query_started = time.perf_counter()
+
+
+def _handle_error(exception_context) -> None:
+    context = exception_context.execution_context
+    if context is not None:
+        tracing.end_span(getattr(context, "_query_span", None), exception_context.original_exception)
+        context._query_span = None
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    seconds = time.perf_counter() - context._query_started
+    tracing.end_span(getattr(context, "_query_span", None))
+    metrics.db_query_duration.observe(seconds)
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+    if settings.db_slow_query_ms is not None and seconds * 1000 >= settings.db_slow_query_ms:
+        origin = query_origin()
+        shape = parameter_shape(parameters, executemany)
+        logger.warning(
+            f"Slow query ({seconds * 1000:.1f} ms) from {origin}: {statement[:1000]} {shape}",
+            extra={"duration_ms": round(seconds * 1000, 1), "statement": statement, "parameters": shape, "origin": origin},
+        )
+
+
+def instrument(engine: Engine) -> None:
+    """
+    The instrument function registers the query counting, the slow query log and the SQL spans on an engine.
+    For an AsyncEngine, pass its sync_engine.
+
+    :param engine: Engine: The engine to instrument
+    :return: None
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+class QueryStatsMiddleware:
+    """
+    An ASGI middleware that counts the SQL statements of every request and the time spent in them.
+    The totals are sent in a Server-Timing header, e.g. Server-Timing: db;dur=12.5;desc="4 queries",
+    logged with the method, the path and the status of the request, and observed in the db_queries_per_request metric.
+    """
+
+    def __init__(self, app: ASGIApp, server_timing: bool = True):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = None
+        with track_queries() as stats:
+
+            async def send_with_timing(message: Message) -> None:
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    if self.server_timing:
+                        MutableHeaders(scope=message).append("Server-Timing", stats.server_timing())
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                metrics.db_queries_per_request.observe(stats.count)
+                logger.debug(
+                    f"{scope['method']} {scope['path']} {status}: {stats.count} queries in {stats.seconds * 1000:.1f} ms",
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status,
+                        "queries": stats.count,
+                        "db_ms": round(stats.seconds * 1000, 1),
+                    },
+                )
@@ -0,0 +1,95 @@
+import hashlib
+import logging
+
+import redis.asyncio as redis_async
+from jose import JWTError, jwt
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.conf.config import init_async_redis, settings
+
+logger = logging.getLogger("uvicorn")
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class ReadYourWrites:
+    """
+    Pins a client to the primary database for a few seconds after it writes,
+    so reads routed to a lagging replica never hide the client's own changes.
+
+    The pin is a Redis key with a TTL, shared by all workers. Clients are identified by the subject
+    of their bearer token, read without verification: the key only decides where a read is sent,
+    and get_current_user still verifies the token. Anonymous clients are identified by their address.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self._redis: redis_async.Redis | None = None
+
+    async def redis(self) -> redis_async.Redis:
+        if self._redis is None:
+            self._redis = await init_async_redis()
+        return self._redis
+
+    @staticmethod
+    def client_key(headers: Headers, client: tuple | None) -> str:
+        authorization = headers.get("authorization", "")
+        identity = None
+        if authorization.lower().startswith("bearer "):
+            try:
+                identity = jwt.get_unverified_claims(authorization[7:]).get("sub")
+            except JWTError:
+                identity = None
+        if identity is None:
+            identity = client[0] if client else "anonymous"
+        return "primary_pin:" + hashlib.sha256(str(identity).encode("utf-8")).hexdigest()[:32]
+
+    async def pin(self, key: str) -> None:
+        try:
+            redis = await self.redis()
+            await redis.set(key, 1, px=int(self.seconds * 1000))
+        except redis_async.RedisError as e:
+            logger.error(f"Error pinning a client to the primary database: {e}")
+
+    async def is_pinned(self, key: str) -> bool:
+        """
+        The is_pinned function tells whether the client wrote within the last few seconds.
+        If Redis can't be reached, the client is treated as pinned, so reads stay consistent.
+
+        :param key: str: The key of the client returned by client_key
+        :return: True if the reads of the client must go to the primary
+        """
+        try:
+            redis = await self.redis()
+            return bool(await redis.exists(key))
+        except redis_async.RedisError as e:
+            logger.error(f"Error checking the primary pin of a client: {e}")
+            return True
+
+
+class ReadYourWritesMiddleware:
+    """
+    An ASGI middleware that pins the client to the primary after every successful write request.
+    The pin is stored before the response is sent, so the next request of the client already sees it.
+    """
+
+    def __init__(self, app: ASGIApp, read_your_writes: "ReadYourWrites", enabled: bool = True):
+        self.app = app
+        self.read_your_writes = read_your_writes
+        self.enabled = enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self.enabled or scope["type"] != "http" or scope["method"] not in WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_pinned(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                await self.read_your_writes.pin(self.read_your_writes.client_key(Headers(scope=scope), scope.get("client")))
+            await send(message)
+
+        await self.app(scope, receive, send_pinned)
+
+
+read_your_writes = ReadYourWrites(settings.db_read_your_writes_seconds)
@@ -0,0 +1,220 @@
+import asyncio
+import contextlib
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from src.conf.config import settings
+from src.database.db import sessionmanager
+from src.repository import storage as repository_storage
+from src.services import metrics, tracing
+from src.services.cloud_picture import CloudPicture
+
+logger = logging.getLogger("uvicorn")
+
+DONE_STATUSES = ("deleted", "not_found")
+
+
+class RateLimiter:
+    """
+    Spaces calls at least 1 / calls_per_second seconds apart.
+    """
+
+    def __init__(self, calls_per_second: float):
+        self.interval = 1.0 / calls_per_second if calls_per_second > 0 else 0.0
+        self._next_call = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            delay = self._next_call - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_call = time.monotonic() + self.interval
+
+
+class StorageCollector:
+    """
+    Removes from Cloudinary the assets queued in pending_deletions by the deletions of pictures, users and avatars.
+
+    The queue rows are written in the transaction that makes the assets unused, so no asset is forgotten when a
+    worker stops. A background task claims due rows in batches and deletes their assets with one bulk call of the
+    Admin API per batch, spaced by a rate limiter. Failed rows are retried with an exponential backoff, up to
+    max_attempts. Assets still used by another picture or avatar are dropped from the queue without being deleted.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 100,
+        calls_per_second: float = 1.0,
+        idle_seconds: float = 30.0,
+        lease_seconds: float = 300.0,
+        retry_seconds: float = 60.0,
+        max_attempts: int = 10,
+    ):
+        self.batch_size = batch_size
+        self.idle_seconds = idle_seconds
+        self.lease_seconds = lease_seconds
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+        self.limiter = RateLimiter(calls_per_second)
+        self._task: asyncio.Task | None = None
+        self._stopping = asyncio.Event()
+
+    def backoff(self, attempts: int) -> timedelta:
+        return timedelta(seconds=min(self.retry_seconds * 2 ** (attempts - 1), 3600.0))
+
+    async def collect(self) -> int:
+        """
+        The collect function processes one batch of due rows of the queue.
+
+        :return: The number of claimed rows, 0 when nothing is due
+        """
+        with tracing.span("storage_gc collect"):
+            return await self._collect()
+
+    async def _collect(self) -> int:
+        async with sessionmanager.session() as db:
+            rows = await repository_storage.claim_deletions(self.batch_size, self.lease_seconds, self.max_attempts, db)
+            if not rows:
+                return 0
+
+            ids_by_public_id: dict[str, list[int]] = {}
+            done = []
+            for row in rows:
+                public_id = CloudPicture.public_id_from_url(row.url)
+                if public_id is None:
+                    done.append(row.id)
+                else:
+                    ids_by_public_id.setdefault(public_id, []).append(row.id)
+
+            referenced = {
+                CloudPicture.public_id_from_url(url)
+                for url in await repository_storage.referenced_urls(list(ids_by_public_id), db)
+            }
+            for public_id in referenced & ids_by_public_id.keys():
+                done.extend(ids_by_public_id.pop(public_id))
+
+            errors: dict[str, str] = {}
+            if ids_by_public_id:
+                await self.limiter.wait()
+                try:
+                    response = await asyncio.to_thread(CloudPicture.delete_pictures, list(ids_by_public_id))
+                    statuses = response.get("deleted", {})
+                    errors = {
+                        public_id: str(statuses.get(public_id, "missing from the response"))
+                        for public_id in ids_by_public_id
+                        if statuses.get(public_id) not in DONE_STATUSES
+                    }
+                except Exception as e:
+                    logger.error(f"Error deleting assets from storage: {e}")
+                    errors = {public_id: f"{type(e).__name__}: {e}" for public_id in ids_by_public_id}
+
+            attempts = {row.id: row.attempts for row in rows}
+            now = datetime.utcnow()
+            retries = []
+            for public_id, ids in ids_by_public_id.items():
+                if public_id in errors:
+                    retries.extend((id, now + self.backoff(attempts[id]), errors[public_id]) for id in ids)
+                else:
+                    done.extend(ids)
+            await repository_storage.complete_deletions(done, db)
+            await repository_storage.retry_deletions(retries, db)
+            await db.commit()
+        return len(rows)
+
+    async def drain(self) -> int:
+        """
+        The drain function processes batches until no row is due.
+
+        :return: The number of claimed rows
+        """
+        total = 0
+        while claimed := await self.collect():
+            total += claimed
+        return total
+
+    async def reconcile(self, grace_seconds: float, dry_run: bool = False) -> list[str]:
+        """
+        The reconcile function finds the assets under settings.cloudinary_folder that no picture, avatar or queued
+        deletion refers to and queues them for deletion. Assets younger than grace_seconds are left alone,
+        as their picture may not be committed yet. The public_ids in use are held in memory during the scan,
+        and the assets are listed page by page.
+
+        :param grace_seconds: float: The minimum age of an orphaned asset
+        :param dry_run: bool: Only return the orphaned assets
+        :return: The urls of the orphaned assets
+        """
+        used = set()
+        async with sessionmanager.read_session() as db:
+            async for urls in repository_storage.stream_stored_urls(1000, db):
+                used.update(CloudPicture.public_id_from_url(url) for url in urls)
+
+        created_before = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+        orphans = []
+        next_cursor = None
+        while True:
+            await self.limiter.wait()
+            page = await asyncio.to_thread(CloudPicture.list_pictures, f"{settings.cloudinary_folder}/", next_cursor)
+            urls = [
+                resource["secure_url"]
+                for resource in page.get("resources", [])
+                if resource["public_id"] not in used
+                and datetime.fromisoformat(resource["created_at"].replace("Z", "+00:00")) < created_before
+            ]
+            if urls and not dry_run:
+                async with sessionmanager.session() as db:
+                    await repository_storage.enqueue_deletions(urls, db)
+                    await db.commit()
+            orphans.extend(urls)
+            next_cursor = page.get("next_cursor")
+            if not next_cursor:
+                return orphans
+
+    async def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                while not self._stopping.is_set() and await self.collect():
+                    pass
+            except Exception as e:
+                logger.error(f"Error collecting storage garbage: {e}")
+            try:
+                async with sessionmanager.read_session(primary=True) as db:
+                    metrics.storage_gc_queue_depth.set(await repository_storage.count_deletions(db))
+            except Exception as e:
+                logger.error(f"Error measuring the storage garbage queue: {e}")
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._stopping.wait(), self.idle_seconds)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self, timeout: float = 0.0) -> None:
+        """
+        The stop function lets the batch in progress finish for up to timeout seconds, then cancels the task.
+        The rows of a cancelled batch are claimed until their lease runs out, and then come due again.
+
+        :param timeout: float: How long to wait for the batch in progress
+        :return: None
+        """
+        if self._task is None:
+            return
+        self._stopping.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+
+storage_collector = StorageCollector(
+    batch_size=settings.storage_gc_batch_size,
+    calls_per_second=settings.storage_gc_calls_per_second,
+    idle_seconds=settings.storage_gc_idle_seconds,
+    lease_seconds=settings.storage_gc_lease_seconds,
+    retry_seconds=settings.storage_gc_retry_seconds,
+    max_attempts=settings.storage_gc_max_attempts,
+)
@@ -0,0 +1,204 @@
+import asyncio
+import bisect
+import heapq
+import json
+import logging
+
+import redis.asyncio as redis_async
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.config import settings
+from src.database.db import sessionmanager
+from src.database.models import Tag
+from src.services.events import event_broker
+
+logger = logging.getLogger("uvicorn")
+
+TAGS_CHANNEL = "tags:events"
+
+
+class TagIndex:
+    """
+    An in-memory index of tag names of one worker, used for autocomplete and to resolve tag names without the database.
+
+    Names are kept in a sorted array of case-folded keys, so all names with a prefix are found with two bisections.
+    Every worker applies the tag_created, tag_renamed and tag_deleted events published by the others,
+    and reloads the whole index periodically to pick up new popularity numbers and any missed event.
+    """
+
+    def __init__(self, reload_seconds: float = 300.0):
+        self.reload_seconds = reload_seconds
+        self._keys: list[tuple[str, int]] = []
+        self._tags: dict[int, tuple[str, int]] = {}
+        self._ids: dict[str, int] = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._recordings: list[list[tuple[str, dict]]] = []
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def __len__(self) -> int:
+        return len(self._tags)
+
+    async def load(self, db: AsyncSession) -> None:
+        """
+        The load function replaces the index with the tags of the database and their usage_count.
+        The events applied while the tags are read may be missing from the rows, so they are recorded
+        and applied again to the new index once it replaces the old one.
+
+        :param db: AsyncSession: Pass the database session to the function
+        :return: None
+        """
+        recording: list[tuple[str, dict]] = []
+        self._recordings.append(recording)
+        try:
+            rows = (await db.execute(select(Tag.id, Tag.tagname, Tag.usage_count))).all()
+            async with self._lock:
+                self._tags = {tag_id: (tagname, popularity) for tag_id, tagname, popularity in rows}
+                self._ids = {tagname: tag_id for tag_id, tagname, _ in rows}
+                self._keys = sorted((tagname.casefold(), tag_id) for tag_id, tagname, _ in rows)
+                for event, data in recording:
+                    self._change(event, data)
+                self._loaded = True
+        finally:
+            self._recordings.remove(recording)
+
+    async def ensure_loaded(self, db: AsyncSession) -> None:
+        if not self._loaded:
+            await self.load(db)
+
+    def get_id(self, tagname: str) -> int | None:
+        """
+        The get_id function returns the id of a tag known to the index, or None if the tag is unknown.
+
+        :param tagname: str: The name of the tag
+        :return: The id of the tag or None
+        """
+        return self._ids.get(tagname)
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[dict]:
+        """
+        The suggest function returns the most popular tags whose name starts with the prefix, case-insensitively.
+
+        :param prefix: str: The beginning of the tag name
+        :param limit: int: The maximum number of suggestions
+        :return: A list of dicts with the id, tagname and popularity of the tags
+        """
+        key = prefix.casefold()
+        start = bisect.bisect_left(self._keys, (key,))
+        end = bisect.bisect_left(self._keys, (key + "\U0010ffff",), lo=start)
+        tag_ids = (tag_id for _, tag_id in self._keys[start:end])
+        best = heapq.nsmallest(limit, tag_ids, key=lambda tag_id: (-self._tags[tag_id][1], self._tags[tag_id][0]))
+        return [{"id": tag_id, "tagname": self._tags[tag_id][0], "popularity": self._tags[tag_id][1]} for tag_id in best]
+
+    def add(self, tag_id: int, tagname: str, popularity: int = 0) -> None:
+        if tag_id in self._tags:
+            self.remove(tag_id)
+        self._tags[tag_id] = (tagname, popularity)
+        self._ids[tagname] = tag_id
+        bisect.insort(self._keys, (tagname.casefold(), tag_id))
+
+    def remove(self, tag_id: int) -> None:
+        tag = self._tags.pop(tag_id, None)
+        if tag is None:
+            return
+        tagname, _ = tag
+        if self._ids.get(tagname) == tag_id:
+            del self._ids[tagname]
+        index = bisect.bisect_left(self._keys, (tagname.casefold(), tag_id))
+        if index < len(self._keys) and self._keys[index] == (tagname.casefold(), tag_id):
+            del self._keys[index]
+
+    def rename(self, tag_id: int, tagname: str) -> None:
+        _, popularity = self._tags.get(tag_id, (tagname, 0))
+        self.add(tag_id, tagname, popularity)
+
+    def use(self, tag_ids: list[int], count: int = 1) -> None:
+        for tag_id in tag_ids:
+            if tag_id in self._tags:
+                tagname, popularity = self._tags[tag_id]
+                self._tags[tag_id] = (tagname, max(popularity + count, 0))
+
+    def apply(self, event: str, data: dict) -> None:
+        """
+        The apply function changes the index according to an event published by publish.
+
+        :param event: str: tag_created, tag_renamed or tag_deleted
+        :param data: dict: The id and the tagname of the tag
+        :return: None
+        """
+        for recording in self._recordings:
+            recording.append((event, data))
+        self._change(event, data)
+
+    def _change(self, event: str, data: dict) -> None:
+        if event == "tag_created":
+            self.add(data["id"], data["tagname"], self._tags.get(data["id"], (None, 0))[1])
+        elif event == "tag_renamed":
+            self.rename(data["id"], data["tagname"])
+        elif event == "tag_deleted":
+            self.remove(data["id"])
+
+    async def publish(self, event: str, tag_id: int, tagname: str | None = None) -> None:
+        """
+        The publish function applies a change of a tag to the index of this worker and sends it to the other workers.
+
+        :param event: str: tag_created, tag_renamed or tag_deleted
+        :param tag_id: int: The id of the tag
+        :param tagname: str | None: The name of the tag
+        :return: None
+        """
+        data = {"id": tag_id, "tagname": tagname}
+        self.apply(event, data)
+        await event_broker.publish(TAGS_CHANNEL, event, data)
+
+    async def _reload(self) -> None:
+        if self._loaded:
+            await asyncio.sleep(self.reload_seconds)
+        while True:
+            try:
+                async with sessionmanager.session() as db:
+                    await self.load(db)
+            except Exception as e:
+                logger.error(f"Error loading tag index: {e}")
+            await asyncio.sleep(self.reload_seconds)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with event_broker.subscribe(TAGS_CHANNEL) as subscription:
+                    while True:
+                        payload = await subscription.queue.get()
+                        if subscription.take_dropped():
+                            self._loaded = False
+                        try:
+                            message = json.loads(payload)
+                            self.apply(message["event"], message["data"])
+                        except (ValueError, KeyError) as e:
+                            logger.error(f"Skipping malformed tag event {payload!r}: {e}")
+            except redis_async.RedisError as e:
+                logger.error(f"Error listening to tag events: {e}")
+                await asyncio.sleep(self.reload_seconds)
+
+    def start(self) -> None:
+        """
+        The start function loads the index in the background, unless it was loaded on startup,
+        and starts listening to the changes made by other workers.
+
+        :return: None
+        """
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._reload())]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+tag_index = TagIndex(reload_seconds=settings.tag_index_reload_seconds)
@@ -0,0 +1,289 @@
+"""
+Distributed tracing of the API with OpenTelemetry.
+
+Tracing is off unless settings.tracing_enabled is set, and then opentelemetry is only imported by setup,
+which every worker calls on startup. When it is on:
+
+- TracingMiddleware opens a server span per request, continuing the trace of the W3C traceparent header
+  of the request, if any;
+- instrument_app wraps the async FastAPI dependencies of every route, e.g. get_db or get_current_user,
+  in spans that cover their setup;
+- instrument_module wraps the coroutine functions of the repository modules;
+- the SQL statements, the Redis commands and the storage, email and QR code calls open their own spans
+  through span and start_span, and the outgoing HTTP requests carry the traceparent of the current span.
+
+Sampling is decided at the head of a trace: a request that carries a traceparent follows the decision
+of its caller, the others are sampled with the probability tracing_sample_ratio. The spans are exported
+by the exporter named in tracing_exporter: "console", "file" (JSON lines appended to tracing_file),
+"otlp" (to tracing_otlp_endpoint, with opentelemetry-exporter-otlp installed) or the dotted path
+of any SpanExporter class, e.g. "mypackage.exporters:MyExporter".
+"""
+import contextlib
+import functools
+import importlib
+import inspect
+import sys
+from typing import Callable, Iterator
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+_tracer = None
+_provider = None
+_propagator = None
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def create_exporter(name: str):
+    """
+    The create_exporter function builds the span exporter named in the settings.
+
+    :param name: str: "console", "file", "otlp" or the path of a SpanExporter class, as module:Class
+    :return: A SpanExporter
+    """
+    from src.conf.config import settings
+
+    if name == "console":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+        return ConsoleSpanExporter(service_name=settings.tracing_service_name)
+    if name == "file":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+        return ConsoleSpanExporter(
+            service_name=settings.tracing_service_name,
+            out=open(settings.tracing_file, "a", encoding="utf-8"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+    if name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        return OTLPSpanExporter(endpoint=settings.tracing_otlp_endpoint)
+    module, _, attribute = name.partition(":")
+    return getattr(importlib.import_module(module), attribute)()
+
+
+def setup(exporter=None, sample_ratio: float | None = None) -> None:
+    """
+    The setup function creates the tracer of the worker. The spans are exported in batches from a background thread,
+    or one by one when an exporter is passed, which tests use with an in-memory exporter.
+
+    :param exporter: SpanExporter: Export to this exporter instead of the one of the settings
+    :param sample_ratio: float | None: The share of the traces sampled, default settings.tracing_sample_ratio
+    :return: None
+    """
+    global _tracer, _provider, _propagator
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+    from src.conf.config import settings
+
+    if sample_ratio is None:
+        sample_ratio = settings.tracing_sample_ratio
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": settings.tracing_service_name}),
+        sampler=ParentBased(TraceIdRatioBased(sample_ratio)),
+    )
+    if exporter is None:
+        _provider.add_span_processor(BatchSpanProcessor(create_exporter(settings.tracing_exporter)))
+    else:
+        _provider.add_span_processor(SimpleSpanProcessor(exporter))
+    _tracer = _provider.get_tracer("photoshare")
+    _propagator = TraceContextTextMapPropagator()
+
+
+def shutdown() -> None:
+    """
+    The shutdown function exports the spans still buffered and drops the tracer.
+
+    :return: None
+    """
+    global _tracer, _provider
+    if _provider is not None:
+        _provider.shutdown()
+    _tracer = _provider = None
+
+
+@contextlib.contextmanager
+def span(name: str, attributes: dict | None = None, context=None, kind=None) -> Iterator:
+    """
+    The span function opens a span, the child of the current one, around the with block.
+    An exception raised in the block is recorded in the span. Without a tracer it does nothing.
+
+    :param name: str: The name of the span
+    :param attributes: dict | None: The attributes of the span
+    :param context: The parent context, default the current one
+    :param kind: SpanKind: The kind of the span, default INTERNAL
+    :return: The span, or None
+    """
+    if _tracer is None:
+        yield None
+        return
+    options = {"kind": kind} if kind is not None else {}
+    with _tracer.start_as_current_span(name, context=context, attributes=attributes, **options) as current:
+        yield current
+
+
+def start_span(name: str, attributes: dict | None = None):
+    """
+    The start_span function starts a child of the current span without making it current,
+    for the callbacks that start and end an operation separately, like the SQLAlchemy events.
+
+    :param name: str: The name of the span
+    :param attributes: dict | None: The attributes of the span
+    :return: The span, to be passed to end_span, or None without a tracer
+    """
+    if _tracer is None:
+        return None
+    return _tracer.start_span(name, attributes=attributes)
+
+
+def end_span(current, error: BaseException | None = None) -> None:
+    if current is None:
+        return
+    if error is not None:
+        from opentelemetry.trace import Status, StatusCode
+
+        current.record_exception(error)
+        current.set_status(Status(StatusCode.ERROR, str(error)))
+    current.end()
+
+
+def inject_headers(headers: dict | None = None) -> dict:
+    """
+    The inject_headers function adds the traceparent of the current span to the headers of an outgoing request.
+
+    :param headers: dict | None: The headers of the request
+    :return: The headers
+    """
+    headers = {} if headers is None else headers
+    if _propagator is not None:
+        _propagator.inject(headers)
+    return headers
+
+
+def traced(function: Callable, name: str | None = None) -> Callable:
+    """
+    The traced function wraps a coroutine function, an async generator function or an object with an async __call__
+    in spans named after it. The span of an async generator covers the code before its first yield,
+    e.g. the setup of a FastAPI dependency; the rest is run as the exit of an async context manager,
+    so exceptions thrown into the generator are handled as FastAPI expects. Other callables are returned unchanged.
+
+    :param function: Callable: The function to wrap
+    :param name: str | None: The name of the spans, default the qualified name of the function
+    :return: The wrapped function
+    """
+    call = function if inspect.isfunction(function) or inspect.ismethod(function) else getattr(function, "__call__", None)
+    name = name or getattr(function, "__qualname__", None) or type(function).__qualname__
+    if inspect.isasyncgenfunction(call):
+
+        @functools.wraps(call)
+        async def traced_generator(*args, **kwargs):
+            manager = contextlib.asynccontextmanager(function)(*args, **kwargs)
+            with span(name):
+                value = await manager.__aenter__()
+            try:
+                yield value
+            except BaseException:
+                if not await manager.__aexit__(*sys.exc_info()):
+                    raise
+            else:
+                await manager.__aexit__(None, None, None)
+
+        return traced_generator
+    if inspect.iscoroutinefunction(call):
+
+        @functools.wraps(call)
+        async def traced_coroutine(*args, **kwargs):
+            with span(name):
+                return await function(*args, **kwargs)
+
+        return traced_coroutine
+    return function
+
+
+def instrument_module(module_name: str) -> None:
+    """
+    The instrument_module function replaces the coroutine functions defined in a module by traced ones,
+    when tracing is enabled in the settings. It is called at the end of the module, so that the modules
+    importing its functions get the traced ones. Nothing is wrapped when tracing is disabled.
+
+    :param module_name: str: The __name__ of the module
+    :return: None
+    """
+    from src.conf.config import settings
+
+    if not settings.tracing_enabled:
+        return
+    module = sys.modules[module_name]
+    for attribute, value in list(vars(module).items()):
+        if inspect.iscoroutinefunction(value) and value.__module__ == module_name:
+            setattr(module, attribute, traced(value, f"{module_name.rpartition('.')[2]}.{attribute}"))
+
+
+def instrument_app(app) -> None:
+    """
+    The instrument_app function wraps the async dependencies of every route of the app in spans.
+    A dependency used by several routes gets a single wrapper, so FastAPI still resolves it once per request.
+    Overrides in app.dependency_overrides are keyed by the original dependencies,
+    so they no longer apply to the wrapped ones: tests that override dependencies run without tracing.
+
+    :param app: FastAPI: The app, with all its routes included
+    :return: None
+    """
+    wrappers: dict[int, Callable] = {}
+
+    def wrap(dependant) -> None:
+        for dependency in dependant.dependencies:
+            if dependency.call is not None:
+                if id(dependency.call) not in wrappers:
+                    wrappers[id(dependency.call)] = traced(dependency.call)
+                dependency.call = wrappers[id(dependency.call)]
+            wrap(dependency)
+
+    for route in app.router.routes:
+        if getattr(route, "dependant", None) is not None:
+            wrap(route.dependant)
+
+
+class TracingMiddleware:
+    """
+    An ASGI middleware that opens a server span per HTTP request, the child of the span of the caller when the request
+    has a W3C traceparent header. The span is named after the method and the route template of the request,
+    e.g. POST /api/pictures/, and records its status code.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or _tracer is None:
+            await self.app(scope, receive, send)
+            return
+
+        from opentelemetry.trace import SpanKind, Status, StatusCode
+
+        carrier = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        method = scope["method"]
+        attributes = {"http.request.method": method, "url.path": scope["path"]}
+        with span(method, attributes, context=_propagator.extract(carrier), kind=SpanKind.SERVER) as current:
+
+            async def send_with_status(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    current.set_attribute("http.response.status_code", message["status"])
+                    if message["status"] >= 500:
+                        current.set_status(Status(StatusCode.ERROR))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = scope.get("route")
+                if route is not None:
+                    current.set_attribute("http.route", route.path)
+                    current.update_name(f"{method} {route.path}")
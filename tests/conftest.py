@@ -1,3 +1,4 @@
+import contextlib
 import os
 
 import pytest
@@ -7,12 +8,14 @@ from sqlalchemy.ext.asyncio import (AsyncSession, async_sessionmaker,
                                     create_async_engine)
 
 from main import app
-from src.database.db import get_db
+from src.database.db import get_db, get_read_db
 from src.database.models import Base
+from src.services.query_stats import instrument, track_queries
 
 SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///" + os.path.join(os.getcwd(), "test.sqlite")
 
 async_engine = create_async_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+instrument(async_engine.sync_engine)
 TestingAsyncDBSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession)
 
 
@@ -38,6 +41,7 @@ async def client(session):
             await session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
 
     async with AsyncClient(app=app, base_url="http://testserver") as client:
         yield client
@@ -46,3 +50,22 @@ async def client(session):
 @pytest.fixture(scope="module")
 def user():
     return {"username": "admin_test5", "email": "admin_test5@example.com", "password": "1234567890", "confirmed": False}
+
+
+@pytest.fixture(scope="function")
+def query_budget():
+    """
+    Fails the test when the requests made inside the with block run more SQL statements than the budget.
+
+    Usage:
+        with query_budget(3):
+            response = await client.get("/api/tags/")
+    """
+    @contextlib.contextmanager
+    def budget(max_queries: int):
+        with track_queries(keep_statements=True) as stats:
+            yield stats
+        statements = "\n".join(f"  {seconds * 1000:.1f} ms: {statement}" for statement, seconds in stats.statements)
+        assert stats.count <= max_queries, f"{stats.count} queries over a budget of {max_queries}:\n{statements}"
+
+    return budget
@@ -0,0 +1,65 @@
+import random
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from bench.load.report import Recorder, compare, percentile
+from bench.load.scenarios import VirtualUser
+
+
+class TestLoadReport(unittest.TestCase):
+
+    def test_percentile(self):
+        values = [float(value) for value in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile(values, 100), 100.0)
+        self.assertEqual(percentile([3.0], 90), 3.0)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_summary(self):
+        recorder = Recorder()
+        for _ in range(9):
+            recorder.record("GET /a", 0.01, 200, ok=True)
+        recorder.record("GET /a", 0.1, 500, ok=False)
+        recorder.stop()
+        summary = recorder.summary({"concurrency": 1})
+        route = summary["routes"]["GET /a"]
+        self.assertEqual(route["count"], 10)
+        self.assertAlmostEqual(route["error_rate"], 0.1)
+        self.assertAlmostEqual(route["p50_ms"], 10.0)
+        self.assertAlmostEqual(route["p99_ms"], 100.0)
+        self.assertEqual(route["statuses"], {"200": 9, "500": 1})
+        self.assertEqual(summary["total"]["count"], 10)
+        self.assertEqual(summary["config"], {"concurrency": 1})
+
+    @staticmethod
+    def run_summary(p99_ms: float, rps: float, error_rate: float = 0.0, count: int = 100) -> dict:
+        stats = {"count": count, "rps": rps, "p99_ms": p99_ms, "error_rate": error_rate}
+        return {"routes": {"GET /a": stats}, "total": stats}
+
+    def test_compare_finds_regressions(self):
+        regressions = compare(self.run_summary(10.0, 100.0), self.run_summary(12.0, 80.0, 0.2), threshold=0.1)
+        self.assertEqual(len(regressions), 6)
+        self.assertTrue(any("p99" in regression for regression in regressions))
+
+    def test_compare_tolerates_small_changes(self):
+        self.assertEqual(compare(self.run_summary(10.0, 100.0), self.run_summary(10.5, 95.0), threshold=0.1), [])
+
+    def test_compare_skips_routes_with_few_requests(self):
+        self.assertEqual(compare(self.run_summary(10.0, 100.0, count=5), self.run_summary(50.0, 10.0, count=5)), [])
+
+
+class TestVirtualUser(unittest.IsolatedAsyncioTestCase):
+
+    async def test_exceptions_are_failed_requests(self):
+        recorder = Recorder()
+        client = MagicMock(request=AsyncMock(side_effect=RuntimeError("raised by the app")))
+        user = VirtualUser(client, recorder, MagicMock(), random.Random(0))
+        self.assertIsNone(await user.request("GET /a", "GET", "/a"))
+        recorder.stop()
+        route = recorder.summary({})["routes"]["GET /a"]
+        self.assertEqual((route["count"], route["error_rate"], route["statuses"]), (1, 1.0, {"0": 1}))
+
+
+if __name__ == "__main__":
+    unittest.main()
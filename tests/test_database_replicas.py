@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+
+from src.database.db import DatabaseSessionManager
+from src.services.read_your_writes import ReadYourWrites, ReadYourWritesMiddleware
+
+
+class TestDatabaseReplicas(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.primary = "sqlite+aiosqlite:///" + os.path.join(self.directory.name, "primary.sqlite")
+        self.replicas = [
+            "sqlite+aiosqlite:///" + os.path.join(self.directory.name, f"replica{i}.sqlite") for i in range(2)
+        ]
+        self.manager = DatabaseSessionManager(self.primary, self.replicas)
+
+    async def asyncTearDown(self):
+        await self.manager.close()
+        self.directory.cleanup()
+
+    def _url(self, session) -> str:
+        return str(session.bind.url)
+
+    async def test_round_robin(self):
+        urls = []
+        for _ in range(4):
+            async with self.manager.read_session() as session:
+                urls.append(self._url(session))
+        self.assertEqual(urls, self.replicas * 2)
+
+    async def test_pinned_reads_go_to_primary(self):
+        async with self.manager.read_session(primary=True) as session:
+            self.assertEqual(self._url(session), self.primary)
+
+    async def test_unhealthy_replicas_are_skipped(self):
+        self.manager._replicas[0].healthy = False
+        async with self.manager.read_session() as session:
+            self.assertEqual(self._url(session), self.replicas[1])
+        self.manager._replicas[1].healthy = False
+        async with self.manager.read_session() as session:
+            self.assertEqual(self._url(session), self.primary)
+
+    async def test_errors_of_the_route_are_raised(self):
+        for session in (self.manager.read_session, self.manager.session):
+            with self.subTest(session=session.__name__), self.assertLogs("uvicorn", "ERROR"), \
+                    self.assertRaises(HTTPException) as error:
+                async with session():
+                    raise HTTPException(status_code=404)
+            self.assertEqual(error.exception.status_code, 404)
+
+    async def test_check_replicas(self):
+        engine = self.manager._replicas[0].engine
+        self.manager._replicas[0].engine = MagicMock(connect=MagicMock(side_effect=OSError("down")))
+        await self.manager.check_replicas()
+        self.manager._replicas[0].engine = engine
+        self.assertFalse(self.manager._replicas[0].healthy)
+        self.assertTrue(self.manager._replicas[1].healthy)
+        self.assertEqual(self.manager._replicas[1].lag_seconds, 0)
+        stats = self.manager.pool_stats()
+        self.assertEqual([replica["healthy"] for replica in stats["replicas"]], [False, True])
+
+
+class TestReadYourWrites(unittest.IsolatedAsyncioTestCase):
+
+    def test_client_key(self):
+        anonymous = ReadYourWrites.client_key(Headers({}), ("10.0.0.1", 1234))
+        self.assertTrue(anonymous.startswith("primary_pin:"))
+        self.assertEqual(anonymous, ReadYourWrites.client_key(Headers({}), ("10.0.0.1", 4321)))
+        invalid = ReadYourWrites.client_key(Headers({"authorization": "Bearer invalid"}), ("10.0.0.1", 1234))
+        self.assertEqual(invalid, anonymous)
+
+    async def test_middleware_pins_after_write(self):
+        read_your_writes = MagicMock(client_key=ReadYourWrites.client_key, pin=AsyncMock())
+
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": scope["status"], "headers": []})
+
+        middleware = ReadYourWritesMiddleware(app, read_your_writes)
+        send = AsyncMock()
+        for method, status in (("GET", 200), ("POST", 422), ("POST", 201)):
+            scope = {"type": "http", "method": method, "headers": [], "client": ("10.0.0.1", 1234), "status": status}
+            await middleware(scope, AsyncMock(), send)
+
+        read_your_writes.pin.assert_awaited_once()
+        self.assertEqual(send.await_count, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,22 @@
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+
+from bench.bench_startup import LAZY_MODULES
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_main_does_not_import_lazy_modules(self):
+        code = f"import sys, main; print(','.join(sorted(set({LAZY_MODULES!r}) & sys.modules.keys())))"
+        result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
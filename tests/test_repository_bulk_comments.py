@@ -0,0 +1,55 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.repository.comments import bulk_delete_comments
+from src.schemas.comments import CommentBulkAction, CommentBulkDelete
+
+
+class TestRepositoryBulkComments(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.session = AsyncMock(spec=AsyncSession)
+
+    def tearDown(self):
+        del self.session
+
+    def _rows(self, *ids):
+        return MagicMock(all=MagicMock(return_value=[MagicMock(id=id, picture_id=id % 2, is_hidden=False) for id in ids]))
+
+    def test_filter_is_required(self):
+        with self.assertRaises(ValidationError):
+            CommentBulkDelete(action=CommentBulkAction.hide)
+
+    async def test_bulk_delete_in_batches(self):
+        self.session.execute.side_effect = [
+            self._rows(1, 2), MagicMock(), self._rows(3, 4), MagicMock(), self._rows(5), MagicMock()
+        ]
+        body = CommentBulkDelete(user_id=1, batch_size=2)
+        with patch("src.repository.comments.event_broker.publish", AsyncMock()) as publish:
+            result = await bulk_delete_comments(body, self.session)
+
+        self.assertEqual(result["affected"], 5)
+        self.assertEqual(result["batches"], 3)
+        self.assertEqual(result["pictures"], 2)
+        self.assertEqual(self.session.execute.await_count, 6)
+        counters = self.session.execute.await_args.args[1]
+        self.assertEqual(counters, [{"b_picture_id": 1, "b_delta": -1}])
+        self.assertEqual(self.session.commit.await_count, 3)
+        self.assertEqual(publish.await_count, 5)
+        self.assertTrue(all(len(call.args[2]["ids"]) <= body.batch_size for call in publish.await_args_list))
+
+    async def test_bulk_hide_without_matches(self):
+        self.session.execute.return_value = self._rows()
+        body = CommentBulkDelete(text_pattern="%spam%", action=CommentBulkAction.hide)
+        result = await bulk_delete_comments(body, self.session)
+
+        self.assertEqual(result["affected"], 0)
+        self.assertEqual(result["batches"], 0)
+        self.session.commit.assert_awaited_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
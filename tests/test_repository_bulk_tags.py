@@ -0,0 +1,62 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import Role, User
+from src.repository.pictures import bulk_update_picture_tags
+from src.schemas.pictures import PictureTagsBulk
+
+
+class TestRepositoryBulkTags(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.session = AsyncMock(spec=AsyncSession)
+        self.session.get_bind.return_value = MagicMock(dialect=MagicMock())
+        self.session.get_bind.return_value.dialect.name = "sqlite"
+        self.user = User(id=1, roles=Role.user)
+
+    def tearDown(self):
+        del self.session
+
+    def _scalars(self, *values):
+        return MagicMock(scalars=MagicMock(return_value=MagicMock(all=MagicMock(return_value=list(values)))))
+
+    def _rows(self, *rows):
+        return MagicMock(__iter__=MagicMock(return_value=iter(rows)))
+
+    def test_tags_are_required(self):
+        with self.assertRaises(ValidationError):
+            PictureTagsBulk(picture_ids=[1])
+
+    async def test_foreign_picture(self):
+        self.session.execute.return_value = self._scalars(1)
+        with self.assertRaises(HTTPException) as error:
+            await bulk_update_picture_tags([1, 2], ["cat"], [], self.user, self.session)
+        self.assertEqual(error.exception.status_code, 404)
+        self.assertEqual(self.session.execute.await_count, 1)
+
+    async def test_too_many_tags(self):
+        tags = [MagicMock(id=id, tagname=f"tag{id}") for id in range(1, 4)]
+        existing = [(1, 4), (1, 5), (1, 6)]
+        self.session.execute.side_effect = [self._scalars(1), self._rows(*tags), self._rows(*existing)]
+        with self.assertRaises(HTTPException) as error:
+            await bulk_update_picture_tags([1], ["tag1", "tag2", "tag3"], [], self.user, self.session)
+        self.assertEqual(error.exception.status_code, 400)
+        self.session.commit.assert_not_awaited()
+
+    async def test_add_and_remove(self):
+        tags = [MagicMock(id=1, tagname="cat"), MagicMock(id=2, tagname="dog")]
+        existing = [(1, 2), (2, 1)]
+        self.session.execute.side_effect = [self._scalars(1, 2), self._rows(*tags), self._rows(*existing)] + [MagicMock()] * 8
+        with patch("src.repository.pictures.tag_index.publish", AsyncMock()):
+            result = await bulk_update_picture_tags([1, 2], ["cat"], ["dog"], self.user, self.session)
+
+        self.assertEqual(result, {"pictures": 1, "added": 1, "removed": 1})
+        self.session.commit.assert_awaited_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
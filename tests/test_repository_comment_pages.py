@@ -0,0 +1,68 @@
+import pickle
+import unittest
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from src.database.models import Base, Comment, Picture, Role, User
+from src.repository.comments import get_comments_to_picture, recount_comments
+from src.repository.users import get_user_by_email, get_user_profile
+from src.services.pagination import encode_cursor
+
+
+class TestRepositoryCommentPages(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://")
+        async with self.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        self.session = AsyncSession(self.engine)
+        self.session.add(User(id=1, username="user", email="user@example.com", password="password", avatar="avatar", roles=Role.user))
+        self.session.add_all([Picture(id=id, name="picture", description="", picture_url=f"url{id}", user_id=1) for id in (1, 2)])
+        start = datetime(2023, 10, 5, 12)
+        # Comments 3 and 4 share their created_at, so the id breaks the tie; comment 6 is hidden.
+        for id, seconds in [(1, 0), (2, 1), (3, 2), (4, 2), (5, 3), (6, 4), (7, 5)]:
+            self.session.add(Comment(id=id, text=f"comment {id}", picture_id=1, user_id=1, is_hidden=id == 6,
+                                     created_at=start + timedelta(seconds=seconds)))
+        self.session.add(Comment(id=8, text="other picture", picture_id=2, user_id=1, created_at=start))
+        await self.session.commit()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.engine.dispose()
+
+    async def test_pages_follow_the_keyset(self):
+        pages, cursor = [], None
+        while True:
+            comments, cursor = await get_comments_to_picture(2, cursor, 1, self.session)
+            pages.append([comment.id for comment in comments])
+            if cursor is None:
+                break
+        self.assertEqual(pages, [[1, 2], [3, 4], [5, 7]])
+
+    async def test_crafted_cursors_are_rejected(self):
+        for values in [(1, "x"), ("2023-10-05T12:00:00", 1), (encode_cursor(datetime(2023, 10, 5)), 1), (None, None)]:
+            with self.subTest(values=values), self.assertRaises(HTTPException) as error:
+                await get_comments_to_picture(2, encode_cursor(*values), 1, self.session)
+            self.assertEqual(error.exception.status_code, 400)
+
+    async def test_user_listings_skip_hidden_comments(self):
+        user = await get_user_by_email("user@example.com", self.session)
+        self.assertEqual(sorted(comment.id for comment in user.comments_user), [1, 2, 3, 4, 5, 7, 8])
+        # The user is cached by pickling it.
+        self.assertEqual(len(pickle.loads(pickle.dumps(user)).comments_user), 7)
+        profile = await get_user_profile(user, self.session)
+        self.assertEqual(profile.comments_count, 7)
+
+    async def test_recount_comments(self):
+        await self.session.execute(update(Picture).values(comments_count=-3))
+        await self.session.commit()
+        self.assertEqual(await recount_comments(1, self.session), 2)
+        counts = (await self.session.execute(select(Picture.id, Picture.comments_count).order_by(Picture.id))).all()
+        self.assertEqual([tuple(row) for row in counts], [(1, 6), (2, 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from src.database.models import (Base, Comment, PendingDeletion, Picture, Rating,
+                                 Role, Tag, User, picture_tags, tag_cooccurrence)
+from src.repository import users as repository_users
+
+CLOUD_URL = "https://res.cloudinary.com/name/image/upload/"
+
+
+def enable_foreign_keys(connection, record):
+    # SQLite enforces ON DELETE CASCADE only with this pragma, PostgreSQL always does.
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+class TestRepositoryDeleteUser(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://")
+        event.listen(self.engine.sync_engine, "connect", enable_foreign_keys)
+        async with self.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        self.session = AsyncSession(self.engine)
+        self.session.add(User(id=1, username="owner", email="owner@example.com", password="password", roles=Role.user,
+                              avatar=CLOUD_URL + "avatar"))
+        self.session.add(User(id=2, username="other", email="other@example.com", password="password", roles=Role.user,
+                              avatar="https://www.gravatar.com/avatar/other"))
+        self.session.add_all([Tag(id=1, tagname="sea", usage_count=5), Tag(id=2, tagname="sky", usage_count=5)])
+        for id in range(1, 6):
+            self.session.add(Picture(id=id, name="picture", description="description", picture_url=f"{CLOUD_URL}{id}",
+                                     user_id=1, comments_count=1))
+            self.session.add(Comment(text="comment", picture_id=id, user_id=2))
+            self.session.add(Rating(rating=5, picture_id=id, user_id=2))
+        self.session.add(Picture(id=6, name="picture", description="description", picture_url=f"{CLOUD_URL}6",
+                                 user_id=2, comments_count=3, rating_average=3.0))
+        self.session.add_all([Comment(text="comment", picture_id=6, user_id=1) for _ in range(3)])
+        self.session.add_all([Rating(rating=1, picture_id=6, user_id=1), Rating(rating=5, picture_id=6, user_id=2)])
+        await self.session.flush()
+        await self.session.execute(picture_tags.insert(), [{"picture_id": id, "tag_id": tag_id} for id in range(1, 6) for tag_id in (1, 2)])
+        await self.session.execute(tag_cooccurrence.insert(), [{"tag_id": 1, "related_tag_id": 2, "count": 5},
+                                                               {"tag_id": 2, "related_tag_id": 1, "count": 5}])
+        await self.session.commit()
+        self.publish = patch("src.repository.users.event_broker.publish", AsyncMock())
+        self.publish.start()
+
+    async def asyncTearDown(self):
+        self.publish.stop()
+        await self.session.close()
+        await self.engine.dispose()
+
+    async def count(self, table, *conditions):
+        return await self.session.scalar(select(func.count()).select_from(table).where(*conditions))
+
+    async def test_delete_user_in_batches(self):
+        result = await repository_users.delete_user(1, self.session, batch_size=2)
+
+        # 1 batch of ratings, 2 of comments, 3 of pictures and the user row.
+        self.assertEqual(result, {"pictures": 5, "comments": 3, "ratings": 1, "batches": 7})
+        self.assertEqual(await self.count(User), 1)
+        self.assertEqual(await self.count(Picture), 1)
+        self.assertEqual(await self.count(Comment), 0)
+        self.assertEqual(await self.count(Rating), 1)
+        self.assertEqual(await self.count(picture_tags), 0)
+        self.assertEqual(await self.count(tag_cooccurrence), 0)
+        self.assertEqual((await self.session.execute(select(Tag.usage_count).order_by(Tag.id))).scalars().all(), [0, 0])
+
+        picture = (await self.session.execute(select(Picture.comments_count, Picture.rating_average))).one()
+        self.assertEqual((picture.comments_count, picture.rating_average), (0, 5.0))
+
+        urls = (await self.session.execute(select(PendingDeletion.url))).scalars().all()
+        self.assertEqual(sorted(urls), sorted([f"{CLOUD_URL}{id}" for id in range(1, 6)] + [CLOUD_URL + "avatar"]))
+
+    async def test_delete_missing_user(self):
+        self.assertIsNone(await repository_users.delete_user(3, self.session))
+
+    async def test_gravatar_is_not_queued(self):
+        await repository_users.delete_user(2, self.session)
+
+        self.assertEqual(await self.count(User), 1)
+        self.assertEqual(await self.count(Comment), 0)
+        self.assertEqual(await self.count(PendingDeletion), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,20 @@
 import unittest
 from datetime import datetime
-from unittest.mock import AsyncMock, MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 
-from src.database.models import Tag
-from src.repository.tags import (get_tag_by_id, get_tag_by_tagname, get_tags,
-                                 remove_tag,
+from src.database.models import (Base, Picture, Role, Tag, User, picture_lsh_buckets,
+                                 picture_tags, tag_cooccurrence)
+from src.repository.tags import (change_cooccurrence, change_usage_count, get_tag_by_id,
+                                 get_tag_by_tagname, get_tags, merge_tag_into,
+                                 merge_tags, rebuild_similarity, remove_tag,
                                  update_tag)
-from src.schemas.tags import TagModel, TagResponse
+from src.schemas.tags import (TagModel, TagOrder, TagResponse,
+                              normalize_tagname)
+from src.services.pagination import decode_cursor, encode_cursor
 
 
 class TestRepositoryTags(unittest.IsolatedAsyncioTestCase):
@@ -35,10 +41,61 @@ class TestRepositoryTags(unittest.IsolatedAsyncioTestCase):
         tag_response.updated_at=datetime.time
         
     async def test_get_tags(self):
-        self.session.execute.return_value = MagicMock(scalar=MagicMock(return_value=self.mock_tag))
-        result = await get_tags(db=self.session)
-        self.assertTrue(result)
-        
+        tags = [self._create_mock_tag(), Tag(id=2, tagname="bob", usage_count=0)]
+        tags[0].usage_count = 5
+        self.session.execute.return_value = MagicMock(scalars=MagicMock(return_value=MagicMock(all=MagicMock(return_value=tags))))
+        result, next_cursor = await get_tags(db=self.session, order_by=TagOrder.usage_count_desc, limit=1)
+        self.assertEqual(result, tags[:1])
+        self.assertEqual(decode_cursor(next_cursor, str, int, int), ["-usage_count", 5, 1])
+
+    async def test_get_tags_cursor_of_other_order(self):
+        with self.assertRaises(HTTPException) as error:
+            await get_tags(db=self.session, order_by=TagOrder.id, cursor=encode_cursor("tagname", "alex", 1))
+        self.assertEqual(error.exception.status_code, 400)
+        self.session.execute.assert_not_awaited()
+
+    async def test_get_tags_cursor_value_of_other_type(self):
+        for order_by, values in [(TagOrder.usage_count, ("usage_count", "5", 1)), (TagOrder.tagname, ("tagname", 5, 1))]:
+            with self.subTest(order_by=order_by), self.assertRaises(HTTPException) as error:
+                await get_tags(db=self.session, order_by=order_by, cursor=encode_cursor(*values))
+            self.assertEqual(error.exception.status_code, 400)
+        self.session.execute.assert_not_awaited()
+
+    async def test_change_usage_count_stops_at_zero(self):
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        async with AsyncSession(engine) as session:
+            session.add_all([Tag(id=1, tagname="old", usage_count=0), Tag(id=2, tagname="new", usage_count=3)])
+            await session.commit()
+            await change_usage_count({1: -1, 2: -1}, session)
+            counts = (await session.execute(select(Tag.id, Tag.usage_count).order_by(Tag.id))).all()
+        await engine.dispose()
+        self.assertEqual([tuple(row) for row in counts], [(1, 0), (2, 2)])
+
+    async def test_rebuild_similarity(self):
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        async with AsyncSession(engine) as session:
+            session.add(User(id=1, username="user", email="user@example.com", password="password", roles=Role.user))
+            session.add_all([Tag(id=id, tagname=f"tag{id}") for id in (1, 2, 3)])
+            session.add_all([Picture(id=id, name="picture", description="", picture_url=f"url{id}", user_id=1) for id in (1, 2, 3)])
+            await session.flush()
+            await session.execute(picture_tags.insert(), [
+                {"picture_id": picture_id, "tag_id": tag_id} for picture_id, tag_id in [(1, 1), (1, 2), (2, 1), (2, 2), (2, 3), (3, 3)]
+            ])
+            await session.execute(tag_cooccurrence.insert(), [{"tag_id": 1, "related_tag_id": 3, "count": 9}])
+            await session.commit()
+
+            result = await rebuild_similarity(2, session)
+            pairs = (await session.execute(select(tag_cooccurrence).order_by(tag_cooccurrence.c.tag_id, tag_cooccurrence.c.related_tag_id))).all()
+            buckets = (await session.execute(select(picture_lsh_buckets.c.picture_id).distinct())).scalars().all()
+        await engine.dispose()
+        self.assertEqual(result, {"tags": 3, "pictures": 3})
+        self.assertEqual([tuple(pair) for pair in pairs], [(1, 2, 2), (1, 3, 1), (2, 1, 2), (2, 3, 1), (3, 1, 1), (3, 2, 1)])
+        self.assertEqual(sorted(buckets), [1, 2, 3])
+
     async def test_get_tag_by_id(self):
         self.session.execute.return_value = MagicMock(scalar=MagicMock(return_value=self.mock_tag))
         result = await get_tag_by_id(tag_id=self._create_mock_tag().id, db=self.session)
@@ -49,6 +106,47 @@ class TestRepositoryTags(unittest.IsolatedAsyncioTestCase):
         result = await get_tag_by_tagname(tagname=self._create_mock_tag().tagname, db=self.session)
         self.assertEqual(result.tagname, self._create_mock_tag().tagname)
 
+    async def test_change_cooccurrence_upserts_both_directions(self):
+        self.session.get_bind.return_value = MagicMock(dialect=MagicMock())
+        self.session.get_bind.return_value.dialect.name = "sqlite"
+        await change_cooccurrence([1, 2, 3], 1, db=self.session)
+        params = self.session.execute.await_args.args[1]
+        self.assertEqual(sorted((row["tag_id"], row["related_tag_id"]) for row in params), [(1, 2), (1, 3), (2, 1), (2, 3), (3, 1), (3, 2)])
+
+    async def test_change_cooccurrence_decrease(self):
+        await change_cooccurrence([1, 2], -1, db=self.session)
+        self.assertEqual(self.session.execute.await_count, 2)
+        await change_cooccurrence([1], -1, db=self.session)
+        self.assertEqual(self.session.execute.await_count, 2)
+
+    async def test_merge_tags(self):
+        self.session.get_bind.return_value = MagicMock(dialect=MagicMock())
+        self.session.get_bind.return_value.dialect.name = "sqlite"
+        self.session.execute.return_value = MagicMock(
+            scalars=MagicMock(return_value=MagicMock(all=MagicMock(return_value=[10, 11]))),
+            __iter__=MagicMock(return_value=iter([])),
+        )
+        result = await merge_tags({2: 1, 3: 1, 1: 1}, db=self.session)
+        self.assertEqual(result, 2)
+        moved = self.session.execute.await_args_list[1].args[1]
+        self.assertEqual(moved, [{"b_source": 2, "b_target": 1}, {"b_source": 3, "b_target": 1}])
+        self.session.commit.assert_not_awaited()
+
+    async def test_merge_tags_without_sources(self):
+        self.assertEqual(await merge_tags({1: 1}, db=self.session), 0)
+        self.session.execute.assert_not_awaited()
+
+    async def test_merge_tag_into(self):
+        target = Tag(id=1, tagname="alex", usage_count=7)
+        self.session.get.return_value = target
+        with patch("src.repository.tags.merge_tags", AsyncMock(return_value=3)) as merge, \
+                patch("src.repository.tags.tag_index.publish", AsyncMock()) as publish:
+            result = await merge_tag_into(2, 1, db=self.session)
+        merge.assert_awaited_once_with({2: 1}, self.session)
+        self.session.commit.assert_awaited_once()
+        publish.assert_awaited_once_with("tag_deleted", 2)
+        self.assertIs(result, target)
+
     async def test_update_tag(self):
         body = TagModel(tagname='test')
         self.session.execute.return_value = MagicMock(tag_response=MagicMock(return_value=self.mock_tag_response))
@@ -61,6 +159,25 @@ class TestRepositoryTags(unittest.IsolatedAsyncioTestCase):
         self.assertIsNone(result)
 
 
+class TestNormalizeTagname(unittest.TestCase):
+
+    def test_normalize_tagname(self):
+        self.assertEqual(normalize_tagname("  Cat "), "cat")
+        self.assertEqual(normalize_tagname("Ｄｏｇ"), "dog")
+        self.assertEqual(normalize_tagname("Straße  Art"), "strasse art")
+
+    def test_tag_model_rejects_blank_names(self):
+        self.assertEqual(TagModel(tagname=" CAT").tagname, "cat")
+        with self.assertRaises(ValueError):
+            TagModel(tagname="   ")
+
+    def test_tag_stores_the_normalized_name(self):
+        tag = Tag(tagname=" Ｓtraße  Art")
+        self.assertEqual(tag.tagname, "strasse art")
+        tag.tagname = "DOG"
+        self.assertEqual(tag.tagname, "dog")
+
+
 if __name__ == "__main__":
     unittest.main()           
         
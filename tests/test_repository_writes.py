@@ -0,0 +1,173 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from sqlalchemy import select
+
+from src.database.models import Base, Comment, InvalidToken, Picture, Role, Tag, User, picture_tags
+from src.repository import comments as repository_comments
+from src.repository import pictures as repository_pictures
+from src.repository import users as repository_users
+from src.schemas.comments import CommentCreate, CommentUpdate
+from src.schemas.pictures import PictureDescrUpdate, PictureNameUpdate, PictureUpload
+from src.schemas.users import UserModel
+from src.services.etag import etag, parse_if_match
+from src.services.query_stats import instrument, track_queries
+from src.services.tag_index import TagIndex
+
+
+class TestRepositoryWrites(unittest.IsolatedAsyncioTestCase):
+    """
+    Every write returns the columns of its response from the write statement itself,
+    so it issues one statement and a commit, and no SELECT to read the row back.
+    """
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://")
+        instrument(self.engine.sync_engine)
+        async with self.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        self.session = AsyncSession(self.engine)
+        self.session.add(User(id=1, username="owner", email="owner@example.com", password="password", roles=Role.admin))
+        self.session.add(Picture(id=1, name="picture", description="description", picture_url="url", user_id=1))
+        self.session.add(Comment(id=1, text="comment", picture_id=1, user_id=1))
+        await self.session.commit()
+        self.publish = patch("src.repository.comments.event_broker.publish", AsyncMock())
+        self.publish.start()
+
+    async def asyncTearDown(self):
+        self.publish.stop()
+        await self.session.close()
+        await self.engine.dispose()
+
+    async def test_create_user(self):
+        body = UserModel(username="second", email="second@example.com", password="password")
+        with patch("libgravatar.Gravatar.get_image", return_value="avatar"), track_queries(keep_statements=True) as stats:
+            user = await repository_users.create_user(body, self.session)
+
+        self.assertEqual(stats.count, 1, stats.statements)
+        self.assertEqual((user.username, user.roles), ("second", Role.user))
+
+    async def test_first_user_is_admin(self):
+        await self.session.execute(Comment.__table__.delete())
+        await self.session.execute(Picture.__table__.delete())
+        await self.session.execute(User.__table__.delete())
+        body = UserModel(username="first", email="first@example.com", password="password")
+        with patch("libgravatar.Gravatar.get_image", return_value="avatar"):
+            user = await repository_users.create_user(body, self.session)
+        self.assertEqual(user.roles, Role.admin)
+
+    async def test_manage_user(self):
+        for change, expected in (
+            (repository_users.ban_user("owner@example.com", self.session), False),
+            (repository_users.activate_user("owner@example.com", self.session), True),
+        ):
+            with track_queries() as stats:
+                user = await change
+            self.assertEqual(stats.count, 1)
+            self.assertEqual(user.username, "owner")
+            self.assertIs(await self.session.scalar(User.__table__.select().with_only_columns(User.is_active)), expected)
+
+        with track_queries() as stats:
+            user = await repository_users.change_role("owner@example.com", Role.moderator, self.session)
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(user.roles, Role.moderator)
+        self.assertIsNone(await repository_users.ban_user("missing@example.com", self.session))
+
+    async def test_invalidate_token(self):
+        with track_queries() as stats:
+            await repository_users.invalidate_token("token", self.session)
+        # The INSERT and the cleanup of expired tokens done by the after_insert listener.
+        self.assertEqual(stats.count, 2)
+        self.assertTrue(await repository_users.is_validate_token("token", self.session))
+
+    async def test_update_picture(self):
+        with track_queries() as stats:
+            picture = await repository_pictures.update_picture_name(1, PictureNameUpdate(name="renamed"), 1, self.session)
+            picture = await repository_pictures.update_picture_description(
+                1, PictureDescrUpdate(description="changed"), 1, self.session
+            )
+        self.assertEqual(stats.count, 2)
+        self.assertEqual((picture.name, picture.description, picture.user_id), ("renamed", "changed", 1))
+
+        with self.assertRaises(HTTPException) as error:
+            await repository_pictures.update_picture_name(1, PictureNameUpdate(name="stolen"), 2, self.session)
+        self.assertEqual(error.exception.status_code, 404)
+
+    async def test_stale_tag_id_of_the_index(self):
+        self.session.add(Tag(id=1, tagname="dog"))
+        await self.session.commit()
+        index = TagIndex()
+        await index.load(self.session)
+        # The index still knows cat under the id of a tag deleted since.
+        index.add(99, "cat")
+        body = PictureUpload(name="new", description="description")
+        with patch("src.repository.pictures.tag_index", index):
+            picture = await repository_pictures.save_data_of_picture_to_db(body, "url2", User(id=1), self.session, ["dog", "cat"])
+
+        tags = dict((await self.session.execute(select(Tag.tagname, Tag.id))).all())
+        links = (await self.session.execute(select(picture_tags.c.tag_id).where(picture_tags.c.picture_id == picture.id))).scalars()
+        self.assertEqual(sorted(links), sorted(tags.values()))
+        self.assertEqual(index.get_id("cat"), tags["cat"])
+        self.assertNotIn(99, tags.values())
+
+    async def test_comments(self):
+        with track_queries() as stats:
+            comment = await repository_comments.create_comment(CommentCreate(text="new"), 1, 1, self.session)
+        # The INSERT and the comments_count increment.
+        self.assertEqual(stats.count, 2)
+        self.assertEqual((comment.text, comment.user_id, comment.picture_id), ("new", 1, 1))
+
+        with track_queries() as stats:
+            comment = await repository_comments.update_comment(1, comment.id, CommentUpdate(text="edited"), 1, self.session)
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(comment.text, "edited")
+
+        with self.assertRaises(HTTPException) as error:
+            await repository_comments.update_comment(1, comment.id, CommentUpdate(text="edited"), 2, self.session)
+        self.assertEqual(error.exception.status_code, 404)
+
+    async def test_concurrent_picture_edits(self):
+        # Both editors read version 1; the first write wins, the second gets 412 instead of overwriting it.
+        picture = await repository_pictures.update_picture_name(1, PictureNameUpdate(name="first"), 1, self.session, [1])
+        self.assertEqual(picture.version, 2)
+
+        with self.assertRaises(HTTPException) as error:
+            await repository_pictures.update_picture_description(1, PictureDescrUpdate(description="second"), 1, self.session, [1])
+        self.assertEqual(error.exception.status_code, 412)
+
+        with self.assertRaises(HTTPException) as error:
+            await repository_pictures.update_picture_name(2, PictureNameUpdate(name="missing"), 1, self.session, [1])
+        self.assertEqual(error.exception.status_code, 404)
+
+        with track_queries() as stats:
+            picture = await repository_pictures.update_picture_description(
+                1, PictureDescrUpdate(description="second"), 1, self.session, parse_if_match(etag(picture.version))
+            )
+        self.assertEqual(stats.count, 1)
+        self.assertEqual((picture.name, picture.description, picture.version), ("first", "second", 3))
+
+    async def test_concurrent_comment_edits(self):
+        comment = await repository_comments.update_comment(1, 1, CommentUpdate(text="first"), 1, self.session, [1, 5])
+        self.assertEqual(comment.version, 2)
+
+        with self.assertRaises(HTTPException) as error:
+            await repository_comments.update_comment(1, 1, CommentUpdate(text="second"), 1, self.session, [1])
+        self.assertEqual(error.exception.status_code, 412)
+
+        comment = await repository_comments.update_comment(1, 1, CommentUpdate(text="last"), 1, self.session)
+        self.assertEqual((comment.text, comment.version), ("last", 3))
+
+    def test_parse_if_match(self):
+        self.assertIsNone(parse_if_match(None))
+        self.assertIsNone(parse_if_match("*"))
+        self.assertEqual(parse_if_match('"3", "4"'), [3, 4])
+        with self.assertRaises(HTTPException) as error:
+            parse_if_match('W/"3"')
+        self.assertEqual(error.exception.status_code, 412)
+
+
+if __name__ == "__main__":
+    unittest.main()
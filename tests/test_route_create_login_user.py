@@ -128,3 +128,14 @@ async def test_login_user(client: AsyncClient, session: AsyncSession, user):
     assert response.status_code == 200, response.text
     data = response.json()
     assert data["token_type"] == "bearer"
+
+
+@pytest.mark.asyncio
+async def test_create_user_query_budget(client: AsyncClient, user, monkeypatch, query_budget):
+    monkeypatch.setattr("src.routes.auth.send_email", MagicMock())
+
+    with query_budget(3):
+        response = await client.post("/api/auth/signup", json=user)
+
+    assert response.status_code == 201, response.text
+    assert response.headers["server-timing"].startswith("db;dur=")
@@ -0,0 +1,52 @@
+import json
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from src.services.events import EventBroker, Subscription, picture_channel
+
+
+class TestEventBroker(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.broker = EventBroker(queue_size=2)
+        self.pubsub = MagicMock()
+        self.pubsub.subscribe = AsyncMock()
+        self.pubsub.unsubscribe = AsyncMock()
+        self.pubsub.get_message = AsyncMock(return_value=None)
+        self.redis = MagicMock()
+        self.redis.publish = AsyncMock()
+        self.redis.pubsub = MagicMock(return_value=self.pubsub)
+        self.broker._redis = self.redis
+
+    async def asyncTearDown(self):
+        if self.broker._listener is not None:
+            self.broker._listener.cancel()
+
+    def test_slow_subscription_drops_oldest_events(self):
+        subscription = Subscription(maxsize=2)
+        for message in ("1", "2", "3"):
+            subscription.put(message)
+        self.assertEqual(subscription.queue.get_nowait(), "2")
+        self.assertEqual(subscription.take_dropped(), 1)
+        self.assertEqual(subscription.take_dropped(), 0)
+
+    async def test_publish(self):
+        await self.broker.publish(picture_channel(1), "comment_created", {"id": 5})
+        channel, message = self.redis.publish.call_args.args
+        self.assertEqual(channel, "picture:1:events")
+        self.assertEqual(json.loads(message), {"event": "comment_created", "data": {"id": 5}})
+
+    async def test_one_redis_subscription_per_channel(self):
+        channel = picture_channel(1)
+        async with self.broker.subscribe(channel) as first:
+            async with self.broker.subscribe(channel) as second:
+                self.broker.dispatch(channel, "event")
+                self.assertEqual(first.queue.get_nowait(), "event")
+                self.assertEqual(second.queue.get_nowait(), "event")
+            self.pubsub.unsubscribe.assert_not_called()
+        self.pubsub.subscribe.assert_awaited_once_with(channel)
+        self.pubsub.unsubscribe.assert_awaited_once_with(channel)
+
+
+if __name__ == "__main__":
+    unittest.main()
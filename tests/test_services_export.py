@@ -0,0 +1,134 @@
+import asyncio
+import contextlib
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import insert
+
+from main import app
+from src.database.db import DatabaseSessionManager
+from src.database.models import Base, Picture, Role, User
+from src.repository.exports import stream_export
+from src.routes.exports import export_body
+from src.schemas.exports import ExportFormat, ExportKind
+from src.services.export import ExportResponse, gzip_chunks
+from src.services.roles import admin
+
+
+class TestExport(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.manager = DatabaseSessionManager("sqlite+aiosqlite:///" + os.path.join(self.directory.name, "export.sqlite"))
+        async with self.manager._engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        async with self.manager.session() as db:
+            db.add(User(id=1, username="owner", email="owner@example.com", password="password", roles=Role.admin))
+            await db.flush()
+            await db.execute(
+                insert(Picture),
+                [
+                    {"id": id, "name": f"picture {id}", "description": 'a, "quoted" description', "picture_url": "url", "user_id": 1}
+                    for id in range(1, 2501)
+                ],
+            )
+            await db.commit()
+        app.dependency_overrides[admin] = lambda: None
+
+    async def asyncTearDown(self):
+        app.dependency_overrides.pop(admin, None)
+        await self.manager.close()
+        self.directory.cleanup()
+
+    async def export(self, url: str):
+        with patch("src.routes.exports.sessionmanager", self.manager), patch("src.routes.exports.settings.export_batch_size", 1000):
+            async with AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver") as client:
+                return await client.get(url)
+
+    async def test_batches(self):
+        async with self.manager.session() as db:
+            sizes = [len(rows) async for rows in stream_export(ExportKind.pictures, 1000, db)]
+        self.assertEqual(sizes, [1000, 1000, 500])
+
+    async def test_ndjson(self):
+        response = await self.export("/api/exports/pictures")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([row["id"] for row in rows], list(range(1, 2501)))
+        self.assertEqual(rows[0]["description"], 'a, "quoted" description')
+
+    async def test_csv_gzip(self):
+        response = await self.export("/api/exports/users?format=csv&gzip=true")
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]["username"], rows[0]["roles"]), ("owner", "admin"))
+        self.assertNotIn("password", rows[0])
+
+    async def test_gzip_stream(self):
+        async def chunks():
+            for id in range(3):
+                yield f"line {id}\n".encode()
+
+        compressed = [chunk async for chunk in gzip_chunks(chunks())]
+        self.assertGreater(len(compressed), 3)
+        self.assertEqual(gzip.decompress(b"".join(compressed)), b"line 0\nline 1\nline 2\n")
+
+    async def test_disconnect_closes_cursor(self):
+        closed = []
+
+        async def spy(*args):
+            try:
+                async with contextlib.aclosing(stream_export(*args)) as partitions:
+                    async for partition in partitions:
+                        yield partition
+            finally:
+                closed.append(True)
+
+        sent = []
+
+        async def send(message):
+            if len(sent) == 2:
+                raise OSError("disconnected")
+            sent.append(message)
+
+        with patch("src.routes.exports.sessionmanager", self.manager), patch("src.routes.exports.settings.export_batch_size", 100), \
+                patch("src.routes.exports.repository_exports.stream_export", spy):
+            response = ExportResponse(export_body(ExportKind.pictures, ExportFormat.ndjson, False))
+            with self.assertRaises(OSError):
+                await response.stream_response(send)
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(closed, [True])
+
+    async def test_http_disconnect_releases_connection(self):
+        sent = []
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+            if len(sent) == 2:
+                disconnected.set()
+            await asyncio.sleep(0.01)
+
+        scope = {"type": "http", "asgi": {"spec_version": "2.3"}}
+        with patch("src.routes.exports.sessionmanager", self.manager), patch("src.routes.exports.settings.export_batch_size", 100):
+            response = ExportResponse(export_body(ExportKind.pictures, ExportFormat.ndjson, False))
+            await response(scope, receive, send)
+        self.assertLess(len(sent), 10)
+        self.assertEqual(self.manager._engine.pool.checkedout(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
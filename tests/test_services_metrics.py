@@ -0,0 +1,89 @@
+import io
+import unittest
+
+from fastapi import FastAPI, HTTPException
+from httpx import ASGITransport, AsyncClient
+from prometheus_client import REGISTRY
+
+from src.services import metrics
+from src.services.metrics import MetricsMiddleware, upload_size
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class TestMetrics(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.app = FastAPI()
+        self.app.add_middleware(MetricsMiddleware, routes=self.app.router.routes)
+
+        @self.app.get("/items/{item_id}")
+        async def get_item(item_id: int):
+            in_progress = sample("http_requests_in_progress", method="GET", route="/items/{item_id}")
+            if item_id == 0:
+                raise HTTPException(status_code=404)
+            return {"in_progress": in_progress}
+
+        @self.app.get("/orders/{order_id}")
+        async def get_order(order_id: int):
+            return {}
+
+        @self.app.delete("/orders/{order_ref}")
+        async def delete_order(order_ref: str):
+            return {}
+
+        @self.app.get("/metrics")
+        async def get_metrics():
+            body, _ = metrics.render()
+            return body.decode()
+
+        self.client = AsyncClient(transport=ASGITransport(app=self.app), base_url="http://testserver")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_requests_are_counted_by_route_template(self):
+        before = sample("http_requests_total", method="GET", route="/items/{item_id}", status="200")
+        duration_before = sample("http_request_duration_seconds_count", method="GET", route="/items/{item_id}")
+
+        for item_id in (1, 2, 3):
+            response = await self.client.get(f"/items/{item_id}")
+            self.assertEqual(response.json(), {"in_progress": 1.0})
+        await self.client.get("/items/0")
+        await self.client.get("/nowhere/1")
+
+        self.assertEqual(sample("http_requests_total", method="GET", route="/items/{item_id}", status="200") - before, 3)
+        self.assertGreaterEqual(sample("http_requests_total", method="GET", route="/items/{item_id}", status="404"), 1)
+        self.assertGreaterEqual(sample("http_requests_total", method="GET", route="unmatched", status="404"), 1)
+        self.assertEqual(sample("http_request_duration_seconds_count", method="GET", route="/items/{item_id}") - duration_before, 4)
+        self.assertEqual(sample("http_requests_in_progress", method="GET", route="/items/{item_id}"), 0)
+
+    async def test_routes_are_matched_by_method(self):
+        await self.client.delete("/orders/a")
+        await self.client.post("/orders/a")
+        await self.client.request("PURGE", "/orders/a")
+
+        self.assertGreaterEqual(sample("http_requests_total", method="DELETE", route="/orders/{order_ref}", status="200"), 1)
+        self.assertGreaterEqual(sample("http_requests_total", method="POST", route="/orders/{order_id}", status="405"), 1)
+        self.assertGreaterEqual(sample("http_requests_total", method="OTHER", route="/orders/{order_id}", status="405"), 1)
+        self.assertEqual(sample("http_requests_total", method="PURGE", route="/orders/{order_id}", status="405"), 0)
+
+    async def test_render(self):
+        metrics.user_cache_requests.labels("hit").inc()
+        response = await self.client.get("/metrics")
+
+        self.assertIn('user_cache_requests_total{result="hit"}', response.json())
+        self.assertIn("db_pool_checkout_wait_seconds_bucket", response.json())
+
+    def test_upload_size(self):
+        file = io.BytesIO(b"x" * 100)
+        file.seek(10)
+        self.assertEqual(upload_size(file), 90)
+        self.assertEqual(file.tell(), 10)
+        self.assertIsNone(upload_size(object()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from src.services.minhash import MinHasher, jaccard
+
+
+class TestMinHasher(unittest.TestCase):
+
+    def setUp(self):
+        self.minhasher = MinHasher(bands=16, rows=2, seed=1)
+
+    def test_signature_is_deterministic(self):
+        self.assertEqual(self.minhasher.signature([3, 1, 2]), MinHasher(seed=1).signature([2, 3, 1]))
+        self.assertEqual(len(self.minhasher.signature([1])), 32)
+        self.assertEqual(self.minhasher.signature([]), [])
+
+    def test_signature_is_elementwise_minimum(self):
+        first, second = self.minhasher.signature([1]), self.minhasher.signature([2])
+        self.assertEqual(self.minhasher.signature([1, 2]), [min(a, b) for a, b in zip(first, second)])
+
+    def test_band_buckets(self):
+        buckets = self.minhasher.buckets([1, 2, 3])
+        self.assertEqual(len(buckets), 16)
+        self.assertEqual(buckets, self.minhasher.buckets([1, 2, 3]))
+        self.assertTrue(all(0 <= bucket < 2 ** 61 for bucket in buckets))
+        self.assertEqual(self.minhasher.buckets([]), [])
+
+    def test_similar_sets_share_bands(self):
+        base = self.minhasher.buckets(range(1, 6))
+        similar = self.minhasher.buckets([1, 2, 3, 4, 6])
+        unrelated = self.minhasher.buckets(range(100, 105))
+        self.assertGreater(sum(a == b for a, b in zip(base, similar)), sum(a == b for a, b in zip(base, unrelated)))
+
+    def test_jaccard(self):
+        self.assertEqual(jaccard([1, 2, 3], [2, 3, 4]), 0.5)
+        self.assertEqual(jaccard([], []), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
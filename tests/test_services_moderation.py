@@ -0,0 +1,115 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from src.conf.config import Settings
+from src.services.moderation import AhoCorasick, ModerationService
+
+
+class TestAhoCorasick(unittest.TestCase):
+
+    def setUp(self):
+        self.automaton = AhoCorasick(["he", "she", "his", "hers", "Spam Offer"])
+
+    def test_overlapping_terms(self):
+        matches = sorted(self.automaton.terms[index] for _, index in self.automaton.iter_matches("ushers"))
+        self.assertEqual(matches, ["he", "hers", "she"])
+
+    def test_find_whole_words(self):
+        self.assertEqual(self.automaton.find("ushers"), [])
+        self.assertEqual(self.automaton.find("She said HERS!"), ["she", "hers"])
+
+    def test_find_normalizes_text(self):
+        self.assertEqual(self.automaton.find("great  SPAM\toffer"), ["spam offer"])
+        self.assertEqual(self.automaton.find("ｓｈｅ"), ["she"])
+
+
+class TestModerationService(unittest.TestCase):
+
+    def setUp(self):
+        file = tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8")
+        file.write("# blocked words\nbadword\n\n")
+        file.close()
+        self.path = file.name
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_reject_policy(self):
+        service = ModerationService(self.path, policy="reject")
+        service.load()
+        self.assertFalse(service.moderate("a nice picture"))
+        with self.assertRaises(HTTPException) as error:
+            service.moderate("a BadWord here")
+        self.assertEqual(error.exception.status_code, 400)
+
+    def test_flag_policy(self):
+        service = ModerationService(self.path, policy="flag")
+        service.load()
+        self.assertTrue(service.moderate("a badword here"))
+
+    def test_reload_when_file_changes(self):
+        service = ModerationService(self.path, policy="flag")
+        service.load()
+        self.assertFalse(service.moderate("terrible"))
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write("terrible\n")
+        os.utime(self.path, (0, os.stat(self.path).st_mtime + 10))
+        self.assertTrue(service.load())
+        self.assertTrue(service.moderate("terrible"))
+
+    def test_file_that_is_not_utf8_keeps_the_previous_terms(self):
+        service = ModerationService(self.path, policy="flag")
+        service.load()
+        self.assertTrue(service.moderate("badword"))
+        with open(self.path, "wb") as file:
+            file.write(b"\xff\xfe broken\n")
+        os.utime(self.path, (0, os.stat(self.path).st_mtime + 10))
+        with self.assertLogs("uvicorn", "ERROR"):
+            self.assertFalse(service.load())
+        self.assertTrue(service.moderate("badword"))
+
+    def test_find_does_not_compile_the_blocklist(self):
+        service = ModerationService(self.path, policy="flag")
+        with patch.object(service, "load") as load:
+            self.assertFalse(service.moderate("badword"))
+        load.assert_not_called()
+
+    def test_watcher_survives_errors(self):
+        service = ModerationService(self.path, reload_seconds=0)
+        calls = []
+
+        def load():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("unexpected")
+            return False
+
+        async def run():
+            with patch.object(service, "load", load):
+                service.start()
+                while len(calls) < 3:
+                    await asyncio.sleep(0.01)
+                await service.stop()
+
+        with self.assertLogs("uvicorn", "ERROR"):
+            asyncio.run(run())
+        self.assertGreaterEqual(len(calls), 3)
+
+    def test_unknown_policy_is_rejected_by_the_settings(self):
+        with self.assertRaises(ValidationError):
+            Settings(moderation_policy="flagg")
+        self.assertEqual(Settings(moderation_policy="flag").moderation_policy, "flag")
+
+    def test_without_blocklist(self):
+        service = ModerationService(None)
+        self.assertFalse(service.moderate("badword"))
+
+
+if __name__ == "__main__":
+    unittest.main()
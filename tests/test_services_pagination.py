@@ -0,0 +1,42 @@
+import unittest
+from datetime import datetime
+
+from fastapi import HTTPException
+
+from src.services.pagination import decode_cursor, encode_cursor
+
+
+class TestPagination(unittest.TestCase):
+
+    def test_cursor_round_trip(self):
+        created_at = datetime(2023, 10, 5, 12, 30, 15, 123456)
+        cursor = encode_cursor(created_at, 42)
+        self.assertEqual(decode_cursor(cursor, datetime, int), [created_at, 42])
+
+    def test_cursor_is_url_safe(self):
+        cursor = encode_cursor(datetime(2023, 10, 5), 1)
+        self.assertNotIn("=", cursor)
+        self.assertNotIn("/", cursor)
+        self.assertNotIn("+", cursor)
+
+    def test_decode_damaged_cursor(self):
+        with self.assertRaises(HTTPException) as error:
+            decode_cursor("not-a-cursor", datetime, int)
+        self.assertEqual(error.exception.status_code, 400)
+
+    def test_decode_cursor_of_wrong_size(self):
+        with self.assertRaises(HTTPException):
+            decode_cursor(encode_cursor(1, 2, 3), int, int)
+
+    def test_decode_cursor_with_values_of_wrong_type(self):
+        for values in [(1, "x"), (datetime(2023, 10, 5), "x"), ("2023-10-05", 1), (datetime(2023, 10, 5), True), ({"a": 1}, 1)]:
+            with self.subTest(values=values), self.assertRaises(HTTPException) as error:
+                decode_cursor(encode_cursor(*values), datetime, int)
+            self.assertEqual(error.exception.status_code, 400)
+
+    def test_decode_cursor_with_alternative_types(self):
+        self.assertEqual(decode_cursor(encode_cursor("a", 1), (int, str), int), ["a", 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
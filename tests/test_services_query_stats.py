@@ -0,0 +1,47 @@
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from src.database.models import Base
+from src.repository.tags import get_tags
+from src.services.query_stats import instrument, parameter_shape, track_queries
+
+
+class TestQueryStats(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://")
+        instrument(self.engine.sync_engine)
+        async with self.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        self.session = AsyncSession(self.engine)
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.engine.dispose()
+
+    def test_parameter_shape(self):
+        self.assertEqual(parameter_shape({"name": "cat", "id": 1}), "{name: str, id: int}")
+        self.assertEqual(parameter_shape(("cat", 1)), "(str, int)")
+        self.assertEqual(parameter_shape([(1, 2), (3, 4)], executemany=True), "2 x (int, int)")
+
+    async def test_nested_tracking(self):
+        with track_queries() as outer:
+            await get_tags(self.session)
+            with track_queries(keep_statements=True) as inner:
+                await get_tags(self.session)
+        self.assertEqual(inner.count, 1)
+        self.assertEqual(outer.count, 2)
+        self.assertIn("FROM tags", inner.statements[0][0])
+        self.assertTrue(inner.server_timing().endswith('desc="1 queries"'))
+
+    async def test_slow_query_log(self):
+        with patch("src.services.query_stats.settings.db_slow_query_ms", 0), self.assertLogs("uvicorn", "WARNING") as logs:
+            await get_tags(self.session)
+        self.assertEqual(logs.records[0].origin.rsplit(":", 1)[0], "src.repository.tags.get_tags")
+        self.assertEqual(logs.records[0].parameters, "(int, int)")
+
+
+if __name__ == "__main__":
+    unittest.main()
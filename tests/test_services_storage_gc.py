@@ -0,0 +1,121 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from sqlalchemy import select
+
+from src.database.db import DatabaseSessionManager
+from src.database.models import Base, PendingDeletion, Picture, Role, User
+from src.repository.storage import referenced_urls
+from src.services.cloud_picture import CloudPicture
+from src.services.storage_gc import StorageCollector
+
+CLOUD_URL = "https://res.cloudinary.com/name/image/upload/c_fill,h_350,w_350/v1/"
+
+
+class TestStorageCollector(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.manager = DatabaseSessionManager("sqlite+aiosqlite:///" + os.path.join(self.directory.name, "gc.sqlite"))
+        async with self.manager._engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        async with self.manager.session() as db:
+            db.add(User(id=1, username="owner", email="owner@example.com", password="password", roles=Role.admin))
+            db.add(Picture(id=1, name="picture", description="description", picture_url=CLOUD_URL + "a", user_id=1))
+            db.add_all([PendingDeletion(url=f"{CLOUD_URL}photoshare/a/{id}") for id in range(5)])
+            db.add(PendingDeletion(url=CLOUD_URL + "a"))
+            db.add(PendingDeletion(url="https://www.gravatar.com/avatar/owner"))
+            await db.commit()
+        self.collector = StorageCollector(batch_size=3, calls_per_second=0, retry_seconds=60.0, max_attempts=2)
+        self.session = patch("src.services.storage_gc.sessionmanager", self.manager)
+        self.session.start()
+
+    async def asyncTearDown(self):
+        self.session.stop()
+        await self.manager.close()
+        self.directory.cleanup()
+
+    async def queue(self):
+        async with self.manager.session() as db:
+            return (await db.execute(select(PendingDeletion).order_by(PendingDeletion.id))).scalars().all()
+
+    def test_public_id_from_url(self):
+        self.assertEqual(CloudPicture.public_id_from_url(CLOUD_URL + "photoshare/a/b"), "photoshare/a/b")
+        self.assertEqual(CloudPicture.public_id_from_url("https://res.cloudinary.com/name/image/upload/v2/photoshare/a/b.jpg"), "photoshare/a/b")
+        self.assertEqual(CloudPicture.public_id_from_url("https://res.cloudinary.com/name/image/upload/c_fill,h_350/a"), "a")
+        self.assertIsNone(CloudPicture.public_id_from_url("https://www.gravatar.com/avatar/owner"))
+
+    async def test_referenced_urls_skips_single_upload_ids(self):
+        public_id = CloudPicture.generate_public_id("owner@example.com")
+        self.assertTrue(CloudPicture.is_single_upload(public_id))
+        self.assertFalse(CloudPicture.is_single_upload("a"))
+        async with self.manager.session() as db:
+            self.assertEqual(await referenced_urls(["a"], db), [CLOUD_URL + "a"])
+            with patch.object(db, "execute") as execute:
+                self.assertEqual(await referenced_urls([public_id], db), [])
+            execute.assert_not_called()
+
+    async def test_drain_in_batches(self):
+        delete = MagicMock(side_effect=lambda public_ids: {"deleted": {public_id: "deleted" for public_id in public_ids}})
+        with patch("src.services.storage_gc.CloudPicture.delete_pictures", delete):
+            self.assertEqual(await self.collector.drain(), 7)
+
+        self.assertEqual(await self.queue(), [])
+        deleted = [public_id for call in delete.call_args_list for public_id in call.args[0]]
+        # The asset still used by picture 1 and the Gravatar avatar are dropped from the queue without a call.
+        self.assertEqual(sorted(deleted), [f"photoshare/a/{id}" for id in range(5)])
+        self.assertTrue(all(len(call.args[0]) <= 3 for call in delete.call_args_list))
+
+    async def test_queued_rows_are_due_by_the_clock_of_the_claims(self):
+        before = datetime.utcnow()
+        async with self.manager.session() as db:
+            db.add(PendingDeletion(url=CLOUD_URL + "photoshare/a/new"))
+            await db.commit()
+        after = datetime.utcnow()
+        row = (await self.queue())[-1]
+        self.assertTrue(before <= row.next_attempt_at <= after)
+
+    async def test_failures_are_retried_with_backoff(self):
+        def delete(public_ids):
+            return {"deleted": {public_id: "deleted" if public_id.endswith("0") else "error" for public_id in public_ids}}
+
+        with patch("src.services.storage_gc.CloudPicture.delete_pictures", delete):
+            await self.collector.drain()
+        queue = await self.queue()
+        self.assertEqual([row.url for row in queue], [f"{CLOUD_URL}photoshare/a/{id}" for id in range(1, 5)])
+        self.assertTrue(all(row.attempts == 1 and row.last_error == "error" for row in queue))
+        self.assertTrue(all(row.next_attempt_at > datetime.utcnow() + timedelta(seconds=50) for row in queue))
+
+        with patch("src.services.storage_gc.CloudPicture.delete_pictures", side_effect=ConnectionError("down")):
+            self.assertEqual(await self.collector.drain(), 0)
+
+    async def test_rows_are_given_up_after_max_attempts(self):
+        async with self.manager.session() as db:
+            await db.execute(PendingDeletion.__table__.update().values(attempts=2))
+            await db.commit()
+
+        self.assertEqual(await self.collector.collect(), 0)
+        self.assertEqual(len(await self.queue()), 7)
+
+    async def test_reconcile(self):
+        old = (datetime.utcnow() - timedelta(days=2)).isoformat() + "Z"
+        new = datetime.utcnow().isoformat() + "Z"
+        page = {
+            "resources": [
+                {"public_id": "photoshare/a/0", "secure_url": CLOUD_URL + "photoshare/a/0.jpg", "created_at": old},
+                {"public_id": "photoshare/b/orphan", "secure_url": CLOUD_URL + "photoshare/b/orphan.jpg", "created_at": old},
+                {"public_id": "photoshare/b/uploading", "secure_url": CLOUD_URL + "photoshare/b/uploading.jpg", "created_at": new},
+            ]
+        }
+        with patch("src.services.storage_gc.CloudPicture.list_pictures", return_value=page):
+            orphans = await self.collector.reconcile(grace_seconds=3600)
+
+        self.assertEqual(orphans, [CLOUD_URL + "photoshare/b/orphan.jpg"])
+        self.assertEqual(len(await self.queue()), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import asyncio
+import contextlib
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.services.events import Subscription
+from src.services.tag_index import TagIndex
+
+
+class TestTagIndex(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.session = AsyncMock(spec=AsyncSession)
+        self.session.execute.return_value = MagicMock(all=MagicMock(return_value=[
+            (1, "cat", 5),
+            (2, "Car", 9),
+            (3, "dog", 7),
+            (4, "cats", 5),
+        ]))
+        self.index = TagIndex()
+        await self.index.load(self.session)
+
+    async def test_suggest_by_prefix_and_popularity(self):
+        suggestions = self.index.suggest("ca")
+        self.assertEqual([tag["tagname"] for tag in suggestions], ["Car", "cat", "cats"])
+        self.assertEqual(self.index.suggest("CAT", limit=1), [{"id": 1, "tagname": "cat", "popularity": 5}])
+        self.assertEqual(self.index.suggest("x"), [])
+
+    async def test_ensure_loaded_reads_database_once(self):
+        await self.index.ensure_loaded(self.session)
+        self.session.execute.assert_awaited_once()
+
+    async def test_add_rename_remove(self):
+        self.index.add(5, "camel")
+        self.index.use([5], count=20)
+        self.assertEqual(self.index.suggest("ca")[0]["tagname"], "camel")
+
+        self.index.rename(5, "llama")
+        self.assertIsNone(self.index.get_id("camel"))
+        self.assertEqual(self.index.suggest("ll"), [{"id": 5, "tagname": "llama", "popularity": 20}])
+
+        self.index.remove(5)
+        self.assertEqual(self.index.suggest("ll"), [])
+        self.assertEqual(len(self.index), 4)
+
+    async def test_apply_events(self):
+        self.index.apply("tag_created", {"id": 6, "tagname": "bird"})
+        self.assertEqual(self.index.get_id("bird"), 6)
+        self.index.apply("tag_renamed", {"id": 3, "tagname": "puppy"})
+        self.assertEqual(self.index.get_id("puppy"), 3)
+        self.assertIsNone(self.index.get_id("dog"))
+        self.index.apply("tag_deleted", {"id": 6, "tagname": None})
+        self.assertIsNone(self.index.get_id("bird"))
+
+    async def test_publish_applies_locally(self):
+        with patch("src.services.tag_index.event_broker.publish", AsyncMock()) as publish:
+            await self.index.publish("tag_deleted", 1)
+        self.assertIsNone(self.index.get_id("cat"))
+        publish.assert_awaited_once()
+
+    async def test_events_during_load_are_kept(self):
+        index = TagIndex()
+
+        async def execute(statement):
+            index.apply("tag_created", {"id": 7, "tagname": "owl"})
+            index.apply("tag_deleted", {"id": 1, "tagname": None})
+            return MagicMock(all=MagicMock(return_value=[(1, "cat", 5), (3, "dog", 7)]))
+
+        self.session.execute.side_effect = execute
+        await index.load(self.session)
+        self.assertEqual(index.get_id("owl"), 7)
+        self.assertIsNone(index.get_id("cat"))
+        self.assertEqual(index.get_id("dog"), 3)
+        self.assertEqual(index._recordings, [])
+
+    async def test_listener_skips_malformed_events(self):
+        subscription = Subscription(10)
+        for payload in ("not json", '{"event": "tag_created"}', '{"event": "tag_created", "data": {"id": 6, "tagname": "bird"}}'):
+            subscription.put(payload)
+
+        @contextlib.asynccontextmanager
+        async def subscribe(channel):
+            yield subscription
+
+        with patch("src.services.tag_index.event_broker.subscribe", subscribe), self.assertLogs("uvicorn", "ERROR") as logs:
+            listener = asyncio.create_task(self.index._listen())
+            while self.index.get_id("bird") is None:
+                await asyncio.sleep(0.01)
+            listener.cancel()
+            await asyncio.gather(listener, return_exceptions=True)
+        self.assertEqual(len(logs.output), 2)
+        self.assertEqual(self.index.get_id("bird"), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
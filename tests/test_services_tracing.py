@@ -0,0 +1,97 @@
+import unittest
+
+from fastapi import Depends, FastAPI, HTTPException
+from httpx import ASGITransport, AsyncClient
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.services import tracing
+from src.services.query_stats import instrument
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+class TestTracing(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.exporter = InMemorySpanExporter()
+        tracing.setup(self.exporter, sample_ratio=1.0)
+        self.engine = create_async_engine("sqlite+aiosqlite://")
+        instrument(self.engine.sync_engine)
+        self.closed = []
+
+        async def get_connection():
+            async with self.engine.connect() as connection:
+                yield connection
+            self.closed.append(True)
+
+        async def check_item(item_id: int):
+            if item_id == 0:
+                raise HTTPException(status_code=404)
+
+        self.app = FastAPI()
+        self.app.add_middleware(tracing.TracingMiddleware)
+
+        @self.app.get("/items/{item_id}", dependencies=[Depends(check_item)])
+        async def get_item(item_id: int, connection=Depends(get_connection)):
+            return (await connection.execute(text("SELECT :id"), {"id": item_id})).scalar()
+
+        tracing.instrument_app(self.app)
+        self.client = AsyncClient(transport=ASGITransport(app=self.app), base_url="http://testserver")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await self.engine.dispose()
+        tracing.shutdown()
+
+    def spans(self) -> dict:
+        return {span.name: span for span in self.exporter.get_finished_spans()}
+
+    async def test_request_spans(self):
+        response = await self.client.get("/items/7", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+
+        self.assertEqual(response.json(), 7)
+        self.assertEqual(self.closed, [True])
+        spans = self.spans()
+        server = spans["GET /items/{item_id}"]
+        self.assertEqual(format(server.context.trace_id, "032x"), TRACE_ID)
+        self.assertEqual(format(server.parent.span_id, "016x"), PARENT_ID)
+        self.assertEqual(server.attributes["http.response.status_code"], 200)
+        for name in ("TestTracing.asyncSetUp.<locals>.check_item", "TestTracing.asyncSetUp.<locals>.get_connection", "SELECT"):
+            self.assertEqual(spans[name].context.trace_id, server.context.trace_id, name)
+        self.assertEqual(spans["SELECT"].attributes["db.system"], "sqlite")
+
+    async def test_dependency_errors_are_recorded(self):
+        response = await self.client.get("/items/0")
+
+        self.assertEqual(response.status_code, 404)
+        span = self.spans()["TestTracing.asyncSetUp.<locals>.check_item"]
+        self.assertFalse(span.status.is_ok)
+
+    async def test_unsampled_parent_is_followed(self):
+        await self.client.get("/items/1", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-00"})
+
+        self.assertEqual(self.exporter.get_finished_spans(), ())
+
+    async def test_head_sampling(self):
+        tracing.shutdown()
+        exporter = InMemorySpanExporter()
+        tracing.setup(exporter, sample_ratio=0.0)
+        await self.client.get("/items/1")
+
+        self.assertEqual(exporter.get_finished_spans(), ())
+
+    async def test_traced_passes_through_without_tracer(self):
+        tracing.shutdown()
+
+        async def double(value):
+            return value * 2
+
+        self.assertEqual(await tracing.traced(double)(2), 4)
+        self.assertEqual(tracing.inject_headers(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()